@@ -0,0 +1,15 @@
+from django.contrib import admin
+
+from .models import Task
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'name', 'status', 'attempts', 'run_after', 'pub_date'
+    )
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'idempotency_key')
+    empty_value_display = '-пусто-'
+
+
+admin.site.register(Task, TaskAdmin)
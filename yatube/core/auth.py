@@ -0,0 +1,86 @@
+"""Загрузка вошедшего пользователя из кеша.
+
+AuthenticationMiddleware читает строку пользователя из базы на каждом
+запросе. ``get_user`` берёт её из кеша по id из сессии, а в базу идёт
+только при промахе. Проверка хеша сессии остаётся как в
+django.contrib.auth: смена пароля разлогинивает остальные сессии и с
+кешем; отключённый пользователь (is_active) не входит. Запись кеша
+сбрасывается при сохранении и удалении пользователя (core.signals), а
+если сброс не дошёл до другого процесса, живёт не дольше
+AUTH_USER_CACHE_TIMEOUT.
+
+В кеше лежат только поля из CACHED_FIELDS и хеш сессии, но не хеш
+пароля. Пользователь собирается из них с отложенными остальными полями:
+обращение к ним читает базу, а save() пишет только загруженные поля.
+"""
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import router
+from django.utils.crypto import constant_time_compare
+
+USER_KEY = 'auth:user:{}'
+CACHED_FIELDS = ('username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def user_key(user_id):
+    return USER_KEY.format(user_id)
+
+
+def invalidate_user(user_id):
+    cache.delete(user_key(user_id))
+
+
+def dump_user(user):
+    """Запись кеша: pk, CACHED_FIELDS и хеш сессии."""
+    data = {name: getattr(user, name) for name in CACHED_FIELDS}
+    data['pk'] = user.pk
+    data['session_hash'] = user.get_session_auth_hash()
+    return data
+
+
+def load_user(data):
+    """Пользователь из записи кеша, остальные поля отложены."""
+    model = auth.get_user_model()
+    loaded = {name: data[name] for name in CACHED_FIELDS}
+    loaded[model._meta.pk.attname] = data['pk']
+    values = [
+        loaded[field.attname] for field in model._meta.concrete_fields
+        if field.attname in loaded
+    ]
+    return model.from_db(router.db_for_read(model), list(loaded), values)
+
+
+def get_user(request):
+    """То же, что django.contrib.auth.get_user, но через кеш."""
+    try:
+        user_id = auth._get_user_session_key(request)
+        backend_path = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+
+    key = user_key(user_id)
+    data = cache.get(key)
+    if data is None:
+        user = auth.get_user(request)
+        if user.is_authenticated:
+            cache.set(
+                key, dump_user(user), settings.AUTH_USER_CACHE_TIMEOUT
+            )
+        return user
+
+    # Как ModelBackend.get_user: отключённого пользователя не пускаем.
+    if not data['is_active']:
+        return AnonymousUser()
+    session_hash = request.session.get(auth.HASH_SESSION_KEY)
+    if not session_hash or not constant_time_compare(
+        session_hash, data['session_hash']
+    ):
+        request.session.flush()
+        return AnonymousUser()
+    user = load_user(data)
+    user.backend = backend_path
+    return user
@@ -0,0 +1,443 @@
+"""Двухуровневый кеш: LRU в памяти процесса (L1) перед общим кешем (L2).
+
+``TieredCache`` - бэкенд кеша Django. Каждое обращение к общему кешу -
+это поход по сети, поэтому часто читаемые и редко меняющиеся значения
+(фрагменты шаблонов, подписки, пользователи) процесс держит у себя:
+
+* L1 ограничен и числом записей, и суммой байт; при переполнении
+  вытесняются давно не читанные записи;
+* запись живёт в L1 не дольше LOCAL_TIMEOUT секунд, даже если в L2
+  у неё срок больше (или уже истёк);
+* в L1 попадают только ключи с префиксами из LOCAL_KEY_PREFIXES.
+  Счётчики, блокировки на ``add`` и сессии читаются только из L2:
+  для них устаревшее значение хуже лишнего похода.
+
+Согласованность между процессами держится на поколениях. Каждая запись
+процесса в L1-ключ увеличивает счётчик поколения в L2 и кладёт рядом
+сообщение с номером поколения и списком изменённых ключей. Не чаще раза
+в SYNC_INTERVAL секунд процесс сверяет своё поколение с общим и
+выбрасывает из L1 ключи из новых сообщений. Если сообщений не хватает
+(истекли, L2 очищен), L1 очищается целиком. Так другой процесс видит
+изменение не позже чем через SYNC_INTERVAL секунд.
+
+Попадания и промахи считаются по уровням. Процессы складывают их в L2
+при сверке, сводку по всем процессам выводит ``manage.py cache_stats``.
+
+``get_or_compute`` - чтение кеша с пересчётом без давки: когда дорогое
+значение истекает, его пересчитывает один процесс, а остальные отдают
+старое.
+"""
+import math
+import pickle
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+STATS = ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses')
+# Бэкенды, записи которых не видны другим процессам.
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_stores = {}
+_stores_lock = threading.Lock()
+_missing = object()
+
+
+def incr_or_create(cache, key, delta=1, timeout=None):
+    """cache.incr, который заводит отсутствующий счётчик."""
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, timeout)
+        return cache.incr(key, delta)
+
+
+class LocalStore:
+    """LRU в памяти процесса, общий для всех потоков.
+
+    Значения хранятся сериализованными, как в LocMemCache: изменение
+    полученного объекта не портит кеш, а размер записи известен точно.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        # Свои сообщения об изменениях процесс пропускает.
+        self.token = uuid.uuid4().hex
+        self.generation = None
+        self.synced = None
+        self.stats = Counter()
+        self.reported = Counter()
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, pickled = entry
+            if expires <= now:
+                self._pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return pickled
+
+    def set(self, key, pickled, expires):
+        size = len(key) + len(pickled)
+        with self.lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (expires, pickled)
+            self.size += size
+            while (
+                len(self.entries) > self.max_entries
+                or self.size > self.max_bytes
+            ):
+                self._pop(next(iter(self.entries)))
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def count(self, field, value=1):
+        with self.lock:
+            self.stats[field] += value
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[1])
+
+
+class TieredCache(BaseCache):
+    """Бэкенд кеша: L1 в памяти процесса, L2 - кеш ``OPTIONS['SHARED']``.
+
+    Ключи версионируются и дополняются префиксом в L2 (его make_key),
+    поэтому KEY_PREFIX и VERSION задаются у общего кеша.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.name = location or 'default'
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.sync_interval = options.get('SYNC_INTERVAL', 1)
+        self.max_messages = options.get('MAX_MESSAGES', 100)
+        self.local_prefixes = tuple(options.get('LOCAL_KEY_PREFIXES', ('',)))
+        with _stores_lock:
+            if self.name not in _stores:
+                _stores[self.name] = LocalStore(
+                    options.get('LOCAL_MAX_ENTRIES', 1000),
+                    options.get('LOCAL_MAX_BYTES', 16 * 1024 * 1024)
+                )
+            self.local = _stores[self.name]
+
+    @property
+    def shared(self):
+        # Экземпляры бэкендов у Django свои в каждом потоке.
+        return caches[self.shared_alias]
+
+    def _control_key(self, suffix):
+        return f'tiered:{self.name}:{suffix}'
+
+    def _local_key(self, key, version):
+        if key.startswith(self.local_prefixes):
+            return self.shared.make_key(key, version)
+        return None
+
+    def _remember(self, local_key, value, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.shared.default_timeout
+        if timeout is not None:
+            timeout = min(timeout, self.local_timeout)
+        else:
+            timeout = self.local_timeout
+        if timeout <= 0:
+            self.local.delete([local_key])
+            return
+        self.local.set(
+            local_key,
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            time.monotonic() + timeout
+        )
+
+    def _publish(self, local_keys):
+        """Сообщает другим процессам, что ключи изменились."""
+        if not local_keys:
+            return
+        generation = incr_or_create(self.shared, self._control_key('gen'))
+        self.shared.set(
+            self._control_key(f'inv:{generation}'),
+            (self.local.token, local_keys),
+            self.local_timeout * 2
+        )
+
+    def _sync(self):
+        """Выбрасывает из L1 ключи, изменённые другими процессами."""
+        store = self.local
+        now = time.monotonic()
+        with store.lock:
+            if (
+                store.synced is not None
+                and now - store.synced < self.sync_interval
+            ):
+                return
+            idle = now - (store.synced or now)
+            store.synced = now
+            seen = store.generation
+        self._report()
+        generation = self.shared.get(self._control_key('gen'))
+        if seen is None:
+            # Первая сверка: в L1 только записи самого процесса,
+            # отсчёт поколений начинается отсюда.
+            pass
+        elif (
+            generation is None or generation < seen
+            or generation - seen > self.max_messages
+            # Все записи L1 и так истекли, а сообщения могли пропасть.
+            or idle >= self.local_timeout
+        ):
+            store.clear()
+        elif generation > seen:
+            names = [
+                self._control_key(f'inv:{number}')
+                for number in range(seen + 1, generation + 1)
+            ]
+            messages = self.shared.get_many(names)
+            if len(messages) < len(names):
+                store.clear()
+            else:
+                for token, keys in messages.values():
+                    if token != store.token:
+                        store.delete(keys)
+        store.generation = generation or 0
+
+    def _report(self):
+        """Складывает счётчики попаданий процесса в общую сводку."""
+        store = self.local
+        with store.lock:
+            delta = store.stats - store.reported
+            store.reported = store.stats.copy()
+        for field, value in delta.items():
+            incr_or_create(self.shared, self._control_key(field), value)
+
+    def get(self, key, default=None, version=None):
+        local_key = self._local_key(key, version)
+        if local_key is not None:
+            self._sync()
+            pickled = self.local.get(local_key, time.monotonic())
+            if pickled is not None:
+                self.local.count('l1_hits')
+                return pickle.loads(pickled)
+            self.local.count('l1_misses')
+        value = self.shared.get(key, _missing, version)
+        if value is _missing:
+            self.local.count('l2_misses')
+            return default
+        self.local.count('l2_hits')
+        if local_key is not None:
+            self._remember(local_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_many(self, keys, version=None):
+        local_keys = {key: self._local_key(key, version) for key in keys}
+        eligible = [key for key, local_key in local_keys.items() if local_key]
+        result = {}
+        if eligible:
+            self._sync()
+            now = time.monotonic()
+            for key in eligible:
+                pickled = self.local.get(local_keys[key], now)
+                if pickled is not None:
+                    result[key] = pickle.loads(pickled)
+            self.local.count('l1_hits', len(result))
+            self.local.count('l1_misses', len(eligible) - len(result))
+        remote = [key for key in local_keys if key not in result]
+        if remote:
+            found = self.shared.get_many(remote, version)
+            self.local.count('l2_hits', len(found))
+            self.local.count('l2_misses', len(remote) - len(found))
+            for key, value in found.items():
+                if local_keys[key] is not None:
+                    self._remember(local_keys[key], value, DEFAULT_TIMEOUT)
+            result.update(found)
+        return result
+
+    def has_key(self, key, version=None):
+        local_key = self._local_key(key, version)
+        if local_key is not None:
+            self._sync()
+            if self.local.get(local_key, time.monotonic()) is not None:
+                return True
+        return self.shared.has_key(key, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        local_key = self._local_key(key, version)
+        if added and local_key is not None:
+            self._remember(local_key, value, timeout)
+            self._publish([local_key])
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        local_key = self._local_key(key, version)
+        if local_key is not None:
+            self._remember(local_key, value, timeout)
+            self._publish([local_key])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        changed = []
+        for key, value in data.items():
+            local_key = self._local_key(key, version)
+            if local_key is None:
+                continue
+            if key in failed:
+                self.local.delete([local_key])
+            else:
+                self._remember(local_key, value, timeout)
+            changed.append(local_key)
+        self._publish(changed)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version)
+        self._forget([key], version)
+        return value
+
+    def delete(self, key, version=None):
+        self.shared.delete(key, version)
+        self._forget([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version)
+        self._forget(keys, version)
+
+    def _forget(self, keys, version):
+        local_keys = [
+            local_key for local_key in (
+                self._local_key(key, version) for key in keys
+            ) if local_key is not None
+        ]
+        self.local.delete(local_keys)
+        self._publish(local_keys)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+        self.local.generation = None
+        self.local.stats.clear()
+        self.local.reported.clear()
+
+    def stats(self):
+        """Попадания и промахи по уровням, сумма по всем процессам."""
+        self._report()
+        totals = self.shared.get_many(
+            [self._control_key(field) for field in STATS]
+        )
+        result = {}
+        for field in STATS:
+            tier, name = field.split('_')
+            result.setdefault(tier, {})[name] = totals.get(
+                self._control_key(field), 0
+            )
+        result['l1'].update(
+            entries=len(self.local.entries), bytes=self.local.size
+        )
+        return result
+
+
+def is_process_local(alias):
+    """Видны ли записи кеша ``alias`` только своему процессу.
+
+    У TieredCache смотрим на общий уровень: L1 и так свой у процесса.
+    """
+    config = settings.CACHES[alias]
+    backend = import_string(config['BACKEND'])
+    if issubclass(backend, TieredCache):
+        return is_process_local(
+            config.get('OPTIONS', {}).get('SHARED', 'shared')
+        )
+    return config['BACKEND'] in PROCESS_LOCAL_BACKENDS
+
+
+def get_or_compute(key, compute, timeout, cache=None):
+    """Значение из кеша или ``compute()``, пересчитанное одним процессом.
+
+    Само значение лежит под ``key`` как есть (его можно сдвигать
+    incr), рядом под ``key:meta`` - срок свежести и время пересчёта.
+
+    * Вероятностное раннее истечение: чем ближе срок и чем дольше
+      считается значение, тем вероятнее, что очередной запрос пересчитает
+      его заранее (CACHE_EARLY_BETA). Пересчёты размазываются по времени
+      вместо того, чтобы начаться разом в момент истечения.
+    * Один пересчёт: пересчитывает тот, кто взял блокировку ``add``;
+      в ней лежит его метка, и снимает он только её.
+    * Устаревшее, пока идёт пересчёт: после срока значение живёт ещё
+      CACHE_STALE_TIMEOUT секунд, и все, кроме пересчитывающего, отдают
+      его. Если значения нет совсем, запросы ждут пересчитывающего до
+      CACHE_LOCK_WAIT секунд и только потом считают сами.
+    """
+    cache = cache or default_cache
+    meta_key = f'{key}:meta'
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    found = cache.get_many([key, meta_key])
+    if key in found:
+        expires, delta = found.get(meta_key, (0, 0))
+        # 1 - random() не бывает нулём, логарифм определён.
+        early = -delta * settings.CACHE_EARLY_BETA * math.log(
+            1 - random.random()
+        )
+        if time.time() + early < expires:
+            return found[key]
+        if not cache.add(lock_key, token, settings.CACHE_LOCK_TIMEOUT):
+            return found[key]
+    elif not cache.add(lock_key, token, settings.CACHE_LOCK_TIMEOUT):
+        deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(settings.CACHE_LOCK_POLL)
+            value = cache.get(key, _missing)
+            if value is not _missing:
+                return value
+        return compute()
+
+    try:
+        start = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - start
+        cache.set_many(
+            {key: value, meta_key: (time.time() + timeout, delta)},
+            timeout + settings.CACHE_STALE_TIMEOUT
+        )
+    finally:
+        # Пересчёт мог идти дольше CACHE_LOCK_TIMEOUT, и блокировку уже
+        # взял другой процесс: снимаем только свою.
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    return value
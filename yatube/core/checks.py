@@ -0,0 +1,24 @@
+"""Проверки настроек при запуске (manage.py check, runserver, migrate)."""
+from django.conf import settings
+from django.core import checks
+
+from .cache import is_process_local
+from .sessions import stores_in_cache
+
+
+@checks.register()
+def check_session_cache(app_configs, **kwargs):
+    """Сессии в кеше требуют кеша, общего для всех процессов.
+
+    С кешем в памяти процесса сессия, созданная одним воркером, не
+    видна другим: пользователя разлогинивает на каждом втором запросе.
+    """
+    if stores_in_cache() and is_process_local(settings.SESSION_CACHE_ALIAS):
+        return [checks.Error(
+            f'Сессии хранятся в кеше {settings.SESSION_CACHE_ALIAS!r}, '
+            'а он у каждого процесса свой.',
+            hint="Подключите memcached или redis либо выберите "
+                 "SESSION_STORE = 'db'.",
+            id='core.E001',
+        )]
+    return []
@@ -0,0 +1,114 @@
+"""Сжатие ответов brotli, zstd и gzip.
+
+brotli и zstandard необязательны: без модуля его кодировка просто не
+предлагается клиенту.
+"""
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        # wbits=31: поток с заголовком gzip, а не голый deflate.
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, level):
+        self._obj = brotli.Compressor(quality=level)
+
+    def chunk(self, data):
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def chunk(self, data):
+        return (
+            self._obj.compress(data)
+            + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        )
+
+    def finish(self):
+        return self._obj.flush()
+
+
+COMPRESSORS = {'gzip': GzipCompressor}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+
+def accepted_encodings(request):
+    """Кодировки из Accept-Encoding, кроме запрещённых через q=0."""
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        coding, *params = part.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def negotiate(request):
+    """Лучшая из COMPRESSION_ENCODINGS, которую понимает клиент."""
+    accepted = accepted_encodings(request)
+    for coding in settings.COMPRESSION_ENCODINGS:
+        if coding in accepted and coding in COMPRESSORS:
+            return coding
+    return None
+
+
+def compressor(coding):
+    return COMPRESSORS[coding](settings.COMPRESSION_LEVELS[coding])
+
+
+def compress(coding, data):
+    """Сжимает тело ответа целиком."""
+    obj = compressor(coding)
+    return obj.chunk(data) + obj.finish()
+
+
+def compress_stream(coding, chunks):
+    """Сжимает потоковый ответ по кускам.
+
+    Каждый кусок сбрасывается в выход сразу, чтобы клиент получал
+    данные по мере генерации, а не в конце.
+    """
+    obj = compressor(coding)
+    for data in chunks:
+        compressed = obj.chunk(data)
+        if compressed:
+            yield compressed
+    yield obj.finish()
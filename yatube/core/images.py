@@ -0,0 +1,265 @@
+"""Приём загружаемых картинок.
+
+``ImageUploadLimitHandler`` проверяет размер и тип файла по мере приёма
+и отбрасывает лишнее, не дожидаясь конца загрузки; к обработчикам форм
+с картинками его подключает декоратор ``limit_image_uploads``.
+``check_image`` проверяет файл ещё при проверке формы,
+``normalize_image`` ужимает оригинал до IMAGE_MAX_SIDE, поворачивает по
+EXIF, удаляет метаданные и пережимает, так что в хранилище попадает уже
+готовый к показу файл. ``dhash`` - перцептивный хеш для поиска похожих
+картинок, ``describe`` - размеры и крошечное превью-заглушка для ленты.
+"""
+import base64
+import hashlib
+import os
+from functools import wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image, ImageOps
+
+# Сигнатуры форматов, которые принимаются к загрузке.
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+]
+EXIF_ORIENTATION = 0x0112
+# Ориентации EXIF, при которых картинка поворачивается на 90 градусов.
+TRANSPOSED = (5, 6, 7, 8)
+
+
+def sniff(head):
+    """Формат по первым байтам файла или None."""
+    for signature, image_format in SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class ImageUploadLimitHandler(FileUploadHandler):
+    """Отбрасывает не картинки и файлы больше IMAGE_UPLOAD_MAX_SIZE.
+
+    Ставится первым в список обработчиков запроса: остальные не
+    получают данных отброшенного файла. Причина отказа остаётся в
+    ``request.upload_errors`` - {поле формы: сообщение}. Заодно по ходу
+    приёма считается SHA-256 каждого файла: ``request.upload_digests``
+    - {поле формы: [хеши в порядке файлов]}.
+    """
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.received = 0
+        self.digest = hashlib.sha256()
+
+    def reject(self, message):
+        if not hasattr(self.request, 'upload_errors'):
+            self.request.upload_errors = {}
+        self.request.upload_errors[self.field_name] = message
+        raise SkipFile
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and sniff(raw_data[:12]) is None:
+            self.reject(
+                'Загрузите картинку в формате JPEG, PNG, GIF или WebP.'
+            )
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_SIZE:
+            limit = filesizeformat(settings.IMAGE_UPLOAD_MAX_SIZE)
+            self.reject(f'Файл больше {limit}.')
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_digests'):
+            self.request.upload_digests = {}
+        self.request.upload_digests.setdefault(self.field_name, []).append(
+            self.digest.hexdigest()
+        )
+        return None
+
+
+def limit_image_uploads(view):
+    """Принимает файлы запроса через ImageUploadLimitHandler.
+
+    Обработчики загрузки можно менять, только пока никто не читал
+    request.POST, а CsrfViewMiddleware читает его раньше обработчика.
+    Поэтому CSRF проверяется здесь, уже после подмены, как советует
+    документация Django.
+    """
+    protected = csrf_protect(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, ImageUploadLimitHandler(request))
+        return protected(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def check_image(uploaded):
+    """Проверяет загрузку так же, как ImageField, не декодируя пиксели.
+
+    Pillow читает заголовок и проверяет структуру файла (verify), а
+    картинки больше IMAGE_MAX_PIXELS отклоняются. Ошибки - ValidationError
+    для формы; проверка нужна до сохранения поста, иначе испорченный
+    файл всплывёт только при записи в хранилище.
+    """
+    uploaded.seek(0)
+    try:
+        image = Image.open(uploaded)
+        if image.width * image.height > settings.IMAGE_MAX_PIXELS:
+            raise ValidationError('Слишком большая картинка.')
+        image.verify()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise ValidationError('Файл не похож на картинку.')
+    finally:
+        uploaded.seek(0)
+
+
+def normalize_image(uploaded):
+    """Готовит загруженную картинку к хранению.
+
+    Большие картинки ужимаются до IMAGE_MAX_SIDE по длинной стороне,
+    JPEG при этом декодируется сразу в уменьшенном масштабе (draft).
+    Картинка поворачивается по EXIF Orientation, метаданные кроме
+    цветового профиля не сохраняются. Непрозрачные картинки пишутся в
+    JPEG, с прозрачностью - в PNG. Анимированные GIF не трогаются.
+    Маленький файл без EXIF возвращается как есть. Файл, который не
+    удалось прочитать, - ValidationError, как и в ``check_image``.
+    """
+    check_image(uploaded)
+    try:
+        return _normalize(uploaded)
+    except (OSError, SyntaxError, ValueError):
+        raise ValidationError('Файл не похож на картинку.')
+
+
+def _normalize(uploaded):
+    max_side = settings.IMAGE_MAX_SIDE
+    image = Image.open(uploaded)
+    if getattr(image, 'is_animated', False):
+        return uploaded
+
+    icc_profile = image.info.get('icc_profile')
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    oversized = max(image.size) > max_side
+    if not oversized and 'exif' not in image.info and orientation == 1:
+        uploaded.seek(0)
+        return uploaded
+
+    if image.format == 'JPEG' and oversized:
+        # Декодирование JPEG сразу в 1/2, 1/4 или 1/8 размера.
+        image.draft('RGB', (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    output = BytesIO()
+    options = {'icc_profile': icc_profile}
+    if _has_alpha(image):
+        image_format, extension = 'PNG', '.png'
+        options['optimize'] = True
+    else:
+        image_format, extension = 'JPEG', '.jpg'
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        options.update(
+            quality=settings.IMAGE_JPEG_QUALITY,
+            optimize=True,
+            progressive=True
+        )
+    image.save(output, image_format, **options)
+
+    root, _ = os.path.splitext(os.path.basename(uploaded.name))
+    return SimpleUploadedFile(
+        root + extension,
+        output.getvalue(),
+        content_type=Image.MIME[image_format]
+    )
+
+
+def dhash(file, size=8):
+    """Разностный хеш картинки: ``size * size`` бит в виде int.
+
+    Картинка сводится к серой (size + 1) x size, каждый бит - ярче ли
+    пиксель соседа справа. Пережатие, смена размера и лёгкая правка
+    цвета меняют лишь несколько бит, поэтому похожие картинки ищутся по
+    расстоянию Хэмминга.
+    """
+    file.seek(0)
+    image = Image.open(file)
+    # Для JPEG декодируем сразу в малом масштабе.
+    image.draft('L', (size * 8, size * 8))
+    image = ImageOps.exif_transpose(image).convert('L')
+    pixels = list(image.resize((size + 1, size), Image.LANCZOS).getdata())
+    file.seek(0)
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            value = value << 1 | (left > pixels[row * (size + 1) + column + 1])
+    return value
+
+
+def describe(file):
+    """Ширина, высота и превью-заглушка картинки.
+
+    Заглушка (LQIP) - JPEG со стороной IMAGE_PLACEHOLDER_SIZE в виде
+    data URI, несколько сотен байт. Её растянутой показывают вместо
+    картинки, пока та не загрузилась. Размеры - после поворота по EXIF.
+    """
+    size = settings.IMAGE_PLACEHOLDER_SIZE
+    file.seek(0)
+    image = Image.open(file)
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION, 1) in TRANSPOSED:
+        width, height = height, width
+    image.draft('RGB', (size * 4, size * 4))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((size, size), Image.LANCZOS)
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=60)
+    file.seek(0)
+    data = base64.b64encode(output.getvalue()).decode('ascii')
+    return width, height, f'data:image/jpeg;base64,{data}'
+
+
+def stored_dhash(name):
+    """(имя, хеш) файла из хранилища, хеш None - файл не прочитать.
+
+    Модуль не трогает модели, поэтому функцию можно отдать пулу
+    процессов, запущенных через spawn.
+    """
+    try:
+        with default_storage.open(name) as file:
+            return name, dhash(file)
+    except (OSError, SyntaxError, ValueError):
+        return name, None
+
+
+def stored_description(name):
+    """(имя, ширина, высота, заглушка) файла из хранилища.
+
+    None вместо размеров, если файл не прочитать. Как и stored_dhash,
+    годится для пула процессов.
+    """
+    try:
+        with default_storage.open(name) as file:
+            return (name, *describe(file))
+    except (OSError, SyntaxError, ValueError):
+        return name, None, None, ''
@@ -0,0 +1,71 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+User = get_user_model()
+
+
+def _touch_user(request):
+    # Как любой обработчик, который смотрит на request.user.
+    request.user.is_authenticated
+    return HttpResponse()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает число запросов к базе и время на запрос вошедшего '
+            'пользователя для разных SESSION_STORE.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=500,
+            help='Сколько запросов прогонять на каждом движке.'
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError('Нет пользователей для замера.')
+        repeat = options['repeat']
+        self.stdout.write(
+            f'{"хранилище":<16}{"запросов к БД":>16}{"мс на запрос":>16}'
+        )
+        for store, engine_path in settings.SESSION_ENGINES.items():
+            with override_settings(SESSION_ENGINE=engine_path):
+                queries, seconds = self.measure(engine_path, user, repeat)
+            self.stdout.write(
+                f'{store:<16}{queries / repeat:>16.2f}'
+                f'{seconds / repeat * 1000:>16.3f}'
+            )
+
+    @staticmethod
+    def measure(engine_path, user, repeat):
+        """Прогоняет запросы через SessionMiddleware и
+        AuthenticationMiddleware с сессией вошедшего пользователя."""
+        engine = import_module(engine_path)
+        session = engine.SessionStore()
+        session['_auth_user_id'] = str(user.pk)
+        session['_auth_user_backend'] = settings.AUTHENTICATION_BACKENDS[0]
+        session['_auth_user_hash'] = user.get_session_auth_hash()
+        session.save()
+        cookie = session.session_key
+
+        handler = SessionMiddleware(AuthenticationMiddleware(_touch_user))
+        factory = RequestFactory()
+        factory.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        handler(factory.get('/'))  # прогрев кеша
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                handler(factory.get('/'))
+            seconds = time.perf_counter() - start
+        session.delete()
+        return len(queries), seconds
@@ -0,0 +1,104 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from core.jinja import get_engine
+from posts.models import Post
+from yatube.settings import NUMBER_OF_POSTS
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает время отрисовки страниц лент на движках Django '
+        'и Jinja2.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='Сколько раз отрисовывать каждую страницу.'
+        )
+
+    def handle(self, *args, **options):
+        posts = list(
+            Post.objects.select_related('author', 'group')[:NUMBER_OF_POSTS]
+        )
+        if not posts:
+            raise CommandError('Нет постов для замера.')
+        page_obj = Paginator(posts, NUMBER_OF_POSTS).page(1)
+        author = posts[0].author
+        group = next((post.group for post in posts if post.group), None)
+
+        pages = [
+            ('posts/index.html', reverse('posts:index'), {}),
+            ('posts/profile.html',
+             reverse('posts:profile', args=[author.username]),
+             {'username': author, 'following': False}),
+            ('posts/follow.html', reverse('posts:follow_index'),
+             {'mutual': [], 'suggested': [author]}),
+        ]
+        if group is not None:
+            pages.append((
+                'posts/group_list.html',
+                reverse('posts:group_list', args=[group.slug]),
+                {'group': group}
+            ))
+
+        factory = RequestFactory()
+        django_engine = self.django_engine()
+        jinja_engine = get_engine()
+        repeat = options['repeat']
+        self.stdout.write(
+            f'{len(posts)} постов на странице, {repeat} отрисовок:'
+        )
+        for name, path, extra in pages:
+            request = factory.get(path)
+            request.resolver_match = resolve(path)
+            request.user = AnonymousUser()
+            context = dict(extra, page_obj=page_obj)
+            timings = []
+            for engine in (django_engine, jinja_engine):
+                template = engine.get_template(name)
+                timings.append(
+                    self.measure(template, context, request, repeat)
+                )
+            django_ms, jinja_ms = timings
+            self.stdout.write(
+                f'{name:24} django {django_ms:7.3f} ms  '
+                f'jinja2 {jinja_ms:7.3f} ms  x{django_ms / jinja_ms:.1f}'
+            )
+
+    def django_engine(self):
+        # Сравниваем с боевым режимом: шаблоны и include разобраны заранее.
+        if settings.TEMPLATES_CACHED:
+            return engines['django']
+        params = dict(
+            settings.TEMPLATES[-1], NAME='django-cached', APP_DIRS=False
+        )
+        del params['BACKEND']
+        params['OPTIONS'] = dict(params['OPTIONS'], loaders=[
+            ('django.template.loaders.cached.Loader',
+             settings.TEMPLATE_LOADERS),
+        ])
+        return DjangoTemplates(params)
+
+    def measure(self, template, context, request, repeat):
+        # Посты главной кешируются фрагментами, замеряем полную отрисовку.
+        fragments = [
+            make_template_fragment_key('index_post', [post.pk, index == 0])
+            for index, post in enumerate(context['page_obj'])
+        ]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            cache.delete_many(fragments)
+            template.render(dict(context), request)
+        return (time.perf_counter() - started) * 1000 / repeat
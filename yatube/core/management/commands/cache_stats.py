@@ -0,0 +1,36 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cache import TieredCache
+
+
+class Command(BaseCommand):
+    help = ('Попадания и промахи двухуровневого кеша по уровням, сумма по '
+            'всем процессам.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--alias', default='default', help='Имя кеша из CACHES.'
+        )
+
+    def handle(self, *args, **options):
+        cache = caches[options['alias']]
+        if not isinstance(cache, TieredCache):
+            raise CommandError(
+                f'Кеш {options["alias"]!r} не двухуровневый.'
+            )
+        stats = cache.stats()
+        self.stdout.write(
+            f'{"уровень":<10}{"попаданий":>12}{"промахов":>12}{"доля":>8}'
+        )
+        for tier in ('l1', 'l2'):
+            hits, misses = stats[tier]['hits'], stats[tier]['misses']
+            total = hits + misses
+            ratio = hits / total if total else 0
+            self.stdout.write(
+                f'{tier:<10}{hits:>12}{misses:>12}{ratio:>8.1%}'
+            )
+        self.stdout.write(
+            f'L1 этого процесса: записей {stats["l1"]["entries"]}, '
+            f'{stats["l1"]["bytes"]} байт.'
+        )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sessions import delete_expired, stores_in_db
+
+
+class Command(BaseCommand):
+    help = ('Удаляет истёкшие сессии из базы пачками, не блокируя '
+            'таблицу одним запросом.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch', type=int, default=None,
+            help='Строк в пачке (по умолчанию SESSION_CLEANUP_BATCH_SIZE).'
+        )
+
+    def handle(self, *args, **options):
+        if not stores_in_db():
+            raise CommandError('Сессии хранятся не в базе.')
+        deleted, _ = delete_expired(options['batch'])
+        self.stdout.write(f'Удалено сессий: {deleted}.')
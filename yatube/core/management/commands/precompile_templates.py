@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template import TemplateSyntaxError
+
+from core.rendering import precompile_templates, template_names
+
+
+class Command(BaseCommand):
+    help = 'Компилирует все шаблоны и показывает время разбора каждого.'
+
+    def handle(self, *args, **options):
+        try:
+            timings = precompile_templates()
+        except TemplateSyntaxError as error:
+            raise CommandError(f'Ошибка в шаблоне: {error}')
+        for name in template_names():
+            self.stdout.write(f'{timings[name] * 1000:8.2f} ms  {name}')
+        total = sum(timings.values()) * 1000
+        self.stdout.write(
+            f'Скомпилировано шаблонов: {len(timings)} за {total:.2f} ms.'
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from core.rendering import (format_stats, install_profiler, start_profiling,
+                            stop_profiling)
+
+
+class Command(BaseCommand):
+    help = (
+        'Запрашивает страницы и показывает, сколько времени уходит '
+        'на каждый {% include %} и {% thumbnail %}.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='*', default=['/'])
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Сколько раз запрашивать каждую страницу.'
+        )
+
+    def handle(self, *args, **options):
+        install_profiler()
+        client = Client()
+        for url in options['urls']:
+            totals = {}
+            for _ in range(options['repeat']):
+                start_profiling()
+                client.get(url)
+                for label, (count, seconds) in stop_profiling().items():
+                    entry = totals.setdefault(label, [0, 0.0])
+                    entry[0] += count
+                    entry[1] += seconds
+            self.stdout.write(f'{url} ({options["repeat"]} запросов):')
+            for line in format_stats(totals):
+                self.stdout.write(line)
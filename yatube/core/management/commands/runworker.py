@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core.tasks import claim, execute, schedule_periodic
+
+
+def _init_process():
+    django.setup()
+    connections.close_all()
+
+
+def _execute(pk):
+    # Каждый исполнитель работает со своим соединением с БД.
+    close_old_connections()
+    try:
+        return execute(pk)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркер фоновой очереди задач.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.TASKS_WORKERS,
+            help='Размер пула исполнителей.'
+        )
+        parser.add_argument(
+            '--pool', choices=('thread', 'process'), default='thread',
+            help='Тип пула: потоки или процессы.'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Выполнить накопившиеся задачи и завершиться.'
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['pool'] == 'process':
+            # Дочерние процессы не должны делить соединение с родителем.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_process
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.stdout.write(
+            f'Воркер запущен: {workers} исполнителей ({options["pool"]}).'
+        )
+        done = 0
+        due = {}
+        running = set()
+        with executor:
+            while True:
+                schedule_periodic(due)
+                # Берём задач ровно на свободные места: медленная задача
+                # не держит остальных исполнителей без работы.
+                free = workers - len(running)
+                claimed = claim(free) if free else []
+                running.update(executor.submit(_execute, pk) for pk in claimed)
+                done += len(claimed)
+                if running:
+                    _, running = wait(
+                        running, timeout=settings.TASKS_POLL_INTERVAL,
+                        return_when=FIRST_COMPLETED
+                    )
+                    continue
+                if options['burst']:
+                    break
+                try:
+                    time.sleep(settings.TASKS_POLL_INTERVAL)
+                except KeyboardInterrupt:
+                    break
+        self.stdout.write(f'Выполнено задач: {done}.')
@@ -0,0 +1,35 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.sessions import stores_in_cache
+
+
+class Command(BaseCommand):
+    help = ('Переносит действующие сессии из базы в кеш перед переходом '
+            'на SESSION_STORE = "cache", чтобы никого не разлогинить.')
+
+    def handle(self, *args, **options):
+        if not stores_in_cache():
+            raise CommandError('SESSION_ENGINE не хранит сессии в кеше.')
+        # Пишем так же, как движок: в кеш SESSION_CACHE_ALIAS под ключом
+        # cache_key_prefix + ключ сессии (документированный интерфейс
+        # SessionStore), значение - словарь данных сессии.
+        engine = import_module(settings.SESSION_ENGINE)
+        prefix = engine.SessionStore.cache_key_prefix
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        now = timezone.now()
+        copied = 0
+        sessions = Session.objects.filter(expire_date__gt=now)
+        for session in sessions.iterator():
+            timeout = int((session.expire_date - now).total_seconds())
+            cache.set(
+                prefix + session.session_key, session.get_decoded(),
+                max(timeout, 1)
+            )
+            copied += 1
+        self.stdout.write(f'Перенесено сессий: {copied}.')
@@ -0,0 +1,158 @@
+"""Отдача загруженных файлов из MEDIA_ROOT.
+
+View проверяет доступ и передаёт саму отправку фронтовому серверу
+заголовком X-Accel-Redirect (nginx) или X-Sendfile (Apache, lighttpd),
+так что воркер Django освобождается сразу. Без прокси файл отдаёт сам
+Django: FileResponse идёт через wsgi.file_wrapper, и gunicorn шлёт его
+системным вызовом sendfile без копирования в Python. Поддерживаются
+Range и If-Modified-Since.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseNotModified)
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeFile:
+    """Файл, из которого читается не больше ``length`` байт с ``start``.
+
+    fileno() отдаёт настоящий дескриптор, уже сдвинутый на начало
+    диапазона: gunicorn отправит через sendfile ровно Content-Length
+    байт с текущей позиции.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def can_access(request, path):
+    """Открыты только файлы из MEDIA_PUBLIC_PREFIXES, без скрытых."""
+    if any(part.startswith('.') for part in path.split('/')):
+        return False
+    return path.startswith(settings.MEDIA_PUBLIC_PREFIXES)
+
+
+def parse_range(header, size):
+    """(start, end) включительно, None - отдать весь файл.
+
+    Несколько диапазонов сразу не поддерживаются, тогда отдаётся весь
+    файл, как разрешает RFC 7233. ValueError - диапазон вне файла.
+    """
+    match = RANGE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def resolve(request, path):
+    """Полный путь к файлу или 404, если файла нет или он закрыт."""
+    path = posixpath.normpath(path).lstrip('/')
+    if not can_access(request, path):
+        raise Http404('Файл не найден')
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    if not os.path.isfile(fullpath):
+        raise Http404('Файл не найден')
+    return path, fullpath
+
+
+def offload(path, fullpath, content_type):
+    """Пустой ответ, файл по заголовку отправит прокси.
+
+    Range и повторные запросы прокси обработает сам.
+    """
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_PREFIX + quote(path)
+        )
+    else:
+        response['X-Sendfile'] = fullpath
+    return response
+
+
+def serve(request, path):
+    """Отдаёт файл из MEDIA_ROOT сам или через прокси (MEDIA_OFFLOAD)."""
+    path, fullpath = resolve(request, path)
+    statobj = os.stat(fullpath)
+    if not was_modified_since(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'),
+        statobj.st_mtime, statobj.st_size
+    ):
+        return HttpResponseNotModified()
+    last_modified = http_date(statobj.st_mtime)
+    content_type, _ = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    if settings.MEDIA_OFFLOAD:
+        response = offload(path, fullpath, content_type)
+        response['Last-Modified'] = last_modified
+        return response
+
+    size = statobj.st_size
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (if_range is None or if_range == last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(
+            RangeFile(file, start, end - start + 1),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = last_modified
+    return response
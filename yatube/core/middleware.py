@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import re
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+
+from .auth import get_user
+from .compression import compress, compress_stream, negotiate
+from .ratelimit import check, too_many_requests
+from .rendering import (format_stats, install_profiler, start_profiling,
+                        stop_profiling)
+
+logger = logging.getLogger('core.rendering')
+
+
+class TemplateProfilerMiddleware:
+    """Замеряет время {% include %} и {% thumbnail %} каждого ответа.
+
+    Итог пишется в лог и в заголовок Server-Timing, который видно во
+    вкладке Network инструментов разработчика браузера.
+    """
+
+    def __init__(self, get_response):
+        if not settings.TEMPLATE_PROFILING:
+            raise MiddlewareNotUsed
+        install_profiler()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start_profiling()
+        try:
+            response = self.get_response(request)
+        finally:
+            stats = stop_profiling()
+        if stats:
+            response['Server-Timing'] = ', '.join(
+                f'tpl{number};desc="{label}";dur={total * 1000:.2f}'
+                for number, (label, (_, total)) in enumerate(stats.items())
+            )
+            logger.info(
+                'Отрисовка %s:\n%s', request.path,
+                '\n'.join(format_stats(stats))
+            )
+        return response
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware, которая берёт пользователя из кеша.
+
+    request.user по-прежнему ленивый: запросы, которым пользователь не
+    нужен, не трогают ни кеш, ни базу.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+
+
+class CompressionMiddleware:
+    """Сжимает ответы brotli, zstd или gzip, смотря что понимает клиент.
+
+    Маленькие ответы, уже сжатые файлы (картинки, статика с
+    Content-Encoding) и ответы с Cache-Control: no-transform отдаются
+    как есть. Потоковые ответы сжимаются по кускам. Сжатые тела
+    страниц для анонимов кешируются по хешу содержимого, поэтому
+    повторные запросы к той же странице не сжимают её заново.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.compressible(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = negotiate(request)
+        if coding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                coding, response.streaming_content
+            )
+            del response['Content-Length']
+        else:
+            content = response.content
+            compressed = self.compress(request, coding, content)
+            if len(compressed) >= len(content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        response['Content-Encoding'] = coding
+        return response
+
+    @staticmethod
+    def compressible(response):
+        if response.has_header('Content-Encoding'):
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0]
+        if not content_type.startswith(settings.COMPRESSION_TYPES):
+            return False
+        if response.streaming:
+            length = response.get('Content-Length')
+            return length is None or (
+                int(length) >= settings.COMPRESSION_MIN_SIZE
+            )
+        return len(response.content) >= settings.COMPRESSION_MIN_SIZE
+
+    @staticmethod
+    def compress(request, coding, content):
+        user = getattr(request, 'user', None)
+        if request.method != 'GET' or (user and user.is_authenticated):
+            return compress(coding, content)
+        digest = hashlib.md5(content).hexdigest()
+        key = f'compressed:{coding}:{digest}'
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = compress(coding, content)
+            cache.set(key, compressed, settings.COMPRESSION_CACHE_TIMEOUT)
+        return compressed
+
+
+class RateLimitMiddleware:
+    """Применяет лимиты RATELIMITS к маршрутам по их имени.
+
+    Стоит после AuthenticationMiddleware: корзины вошедших
+    пользователей ведутся по их id. Маршруты без лимита обходятся одной
+    проверкой словаря, без обращений к кешу.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'ratelimited', False):
+            return None
+        retry_after = check(request, request.resolver_match.view_name)
+        if retry_after:
+            return too_many_requests(request, retry_after)
+        return None
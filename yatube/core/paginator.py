@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+from .cache import get_or_compute
+
+
+def cached_count(queryset, key):
+    """Число объектов выборки из кеша и признак того, что оно точное.
+
+    Число из кеша может немного отставать от БД. Небольшие выборки
+    (меньше PAGINATION_EXACT_THRESHOLD) всё равно считаются точным COUNT,
+    и оно записывается в кеш вместо отставшего.
+    Истёкшее число пересчитывает один запрос (get_or_compute).
+    """
+    computed = []
+
+    def count():
+        computed.append(True)
+        return queryset.count()
+
+    timeout = settings.PAGINATION_COUNT_TIMEOUT
+    value = get_or_compute(key, count, timeout)
+    if computed:
+        return value, True
+    if value < settings.PAGINATION_EXACT_THRESHOLD:
+        exact = queryset.count()
+        if exact != value:
+            # Поправляем отставшее число, срок свежести не трогаем.
+            cache.set(key, exact, timeout + settings.CACHE_STALE_TIMEOUT)
+        return exact, True
+    return value, False
+
+
+def adjust_count(key, delta):
+    """Сдвигает закешированное число, если оно есть в кеше."""
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        pass
+
+
+class CachedCountPaginator(Paginator):
+    """Пагинатор, который берёт общее число объектов из кеша.
+
+    Без ``count_key`` или с ``exact=True`` работает как обычный Paginator.
+    Если число взято из кеша, ``count_is_exact`` равно False и шаблон
+    показывает его как приблизительное.
+    """
+
+    def __init__(self, object_list, per_page, count_key=None, exact=False,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+        self.exact = exact
+        self.count_is_exact = True
+
+    @cached_property
+    def count(self):
+        if self.count_key is None or self.exact:
+            return super().count
+        count, self.count_is_exact = cached_count(
+            self.object_list, self.count_key
+        )
+        return count
@@ -0,0 +1,40 @@
+"""Обработка больших выборок пачками в пуле процессов."""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def map_batches(func, items, workers, batch_size):
+    """Применяет ``func`` к ``items``, отдаёт результаты пачками.
+
+    При ``workers`` > 1 работает пул процессов. Процессы запускаются
+    через spawn, а не fork, иначе они унаследуют открытое соединение с
+    базой, через которое родитель, возможно, читает ``items``. Поэтому
+    ``func`` должна лежать в модуле, который импортируется без моделей,
+    и не ходить в базу: писать результаты - дело родителя.
+    """
+    if workers <= 1:
+        for batch in batches(items, batch_size):
+            yield [func(item) for item in batch]
+        return
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup
+    )
+    with executor:
+        for batch in batches(items, batch_size):
+            yield list(executor.map(
+                func, batch, chunksize=max(len(batch) // (workers * 4), 1)
+            ))
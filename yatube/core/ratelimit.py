@@ -0,0 +1,122 @@
+"""Ограничение частоты запросов к пишущим обработчикам.
+
+Лимиты задаются в RATELIMITS по имени маршрута (``posts:post_create``):
+``{'user': '20/h', 'ip': '60/h', 'methods': ('POST',)}``. Корзина
+``user`` ведётся на пользователя и действует для вошедших, ``ip`` - на
+адрес клиента и действует для всех. Применяют лимиты
+``RateLimitMiddleware`` (ко всем маршрутам из настройки) и декоратор
+``ratelimit`` (к отдельному обработчику).
+
+Корзина живёт в общем кеше и обновляется только атомарными add/incr:
+compare-and-set бэкенды кеша Django не дают. Поэтому это не корзина с
+остатком и меткой времени, а её эквивалент на счётчиках: расход
+считается по окнам длиной ``period``, и к текущему окну добавляется
+доля предыдущего. В среднем проходит ``limit`` запросов за ``period``,
+разом - не больше ``limit``. Отклонённые запросы тоже расходуют
+корзину, так что клиент, не сбавивший темп, остаётся заблокирован.
+"""
+import math
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+RATE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60), '100/5m' -> (100, 300)."""
+    match = RATE.match(rate)
+    if match is None:
+        raise ValueError(f'Неверный лимит: {rate!r}')
+    limit, multiplier, unit = match.groups()
+    return int(limit), int(multiplier or 1) * UNITS[unit]
+
+
+def client_ip(request):
+    return request.META.get(settings.RATELIMIT_IP_HEADER, '').split(
+        ','
+    )[0].strip() or request.META.get('REMOTE_ADDR', '')
+
+
+def _incr(key, timeout):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Счётчика ещё нет; если его успел создать соседний запрос,
+        # add не сработает и остаётся увеличить созданный.
+        if cache.add(key, 1, timeout):
+            return 1
+        return cache.incr(key)
+
+
+def hit(key, rate, now=None):
+    """Расходует запрос из корзины ``key``.
+
+    Возвращает 0, если запрос укладывается в лимит, иначе - через
+    сколько секунд стоит повторить.
+    """
+    limit, period = parse_rate(rate)
+    if now is None:
+        now = time.time()
+    window, elapsed = divmod(now / period, 1)
+    window = int(window)
+    count = _incr(f'ratelimit:{key}:{window}', period * 2)
+    previous = cache.get(f'ratelimit:{key}:{window - 1}', 0)
+    if previous * (1 - elapsed) + count <= limit:
+        return 0
+    # Повторный запрос тоже израсходует корзину, учитываем и его.
+    if count + 1 <= limit:
+        # Хватит подождать, пока остынет доля предыдущего окна.
+        wait = 1 - (limit - count - 1) / previous - elapsed
+    else:
+        # Текущее окно станет предыдущим, и его доля должна остыть.
+        wait = 1 - elapsed + 1 - (limit - 1) / count
+    return max(math.ceil(wait * period), 1)
+
+
+def check(request, name):
+    """Через сколько секунд повторить запрос к маршруту ``name``, 0 -
+    лимит не превышен или не задан."""
+    limits = settings.RATELIMITS.get(name)
+    if not settings.RATELIMIT_ENABLED or limits is None:
+        return 0
+    if request.method not in limits.get('methods', ('POST',)):
+        return 0
+    buckets = []
+    user = getattr(request, 'user', None)
+    if 'user' in limits and user is not None and user.is_authenticated:
+        buckets.append((f'{name}:user:{user.pk}', limits['user']))
+    if 'ip' in limits:
+        buckets.append((f'{name}:ip:{client_ip(request)}', limits['ip']))
+    return max([hit(key, rate) for key, rate in buckets], default=0)
+
+
+def too_many_requests(request, retry_after):
+    response = render(
+        request, 'core/429.html', {'retry_after': retry_after}, status=429
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def ratelimit(view):
+    """Применяет к обработчику лимит из RATELIMITS по имени маршрута.
+
+    RateLimitMiddleware такие обработчики пропускает, чтобы не считать
+    запрос дважды.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        match = request.resolver_match
+        retry_after = check(request, match.view_name) if match else 0
+        if retry_after:
+            return too_many_requests(request, retry_after)
+        return view(request, *args, **kwargs)
+
+    wrapper.ratelimited = True
+    return wrapper
@@ -0,0 +1,111 @@
+"""Предкомпиляция шаблонов и профилирование их отрисовки."""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from django.template import engines
+from django.template.loader_tags import IncludeNode
+from sorl.thumbnail.templatetags.thumbnail import ThumbnailNodeBase
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _leaf_loaders(loaders):
+    for loader in loaders:
+        if hasattr(loader, 'loaders'):
+            yield from _leaf_loaders(loader.loaders)
+        else:
+            yield loader
+
+
+def template_names(engine=None):
+    """Имена всех шаблонов, которые видят загрузчики движка."""
+    engine = engine or engines['django'].engine
+    names = set()
+    for loader in _leaf_loaders(engine.template_loaders):
+        for directory in loader.get_dirs():
+            for root, _, files in os.walk(directory):
+                for filename in files:
+                    if filename.endswith(('.html', '.txt')):
+                        path = os.path.join(root, filename)
+                        names.add(os.path.relpath(path, directory))
+    return sorted(name.replace(os.sep, '/') for name in names)
+
+
+def precompile_templates(engine=None):
+    """Загружает и компилирует все шаблоны.
+
+    С кеширующим загрузчиком скомпилированные шаблоны остаются в памяти
+    процесса, и первые запросы не тратят время на разбор. Возвращает
+    словарь {имя шаблона: время компиляции в секундах}.
+    """
+    engine = engine or engines['django'].engine
+    timings = {}
+    for name in template_names(engine):
+        started = time.perf_counter()
+        engine.get_template(name)
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def start_profiling():
+    _local.stats = defaultdict(lambda: [0, 0.0])
+
+
+def stop_profiling():
+    """Завершает замер и возвращает {узел: [вызовов, секунд]}."""
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return dict(stats or {})
+
+
+def _timed(label_for):
+    def decorator(render):
+        @wraps(render)
+        def wrapper(self, context):
+            stats = getattr(_local, 'stats', None)
+            if stats is None:
+                return render(self, context)
+            started = time.perf_counter()
+            try:
+                return render(self, context)
+            finally:
+                entry = stats[label_for(self)]
+                entry[0] += 1
+                entry[1] += time.perf_counter() - started
+        wrapper.profiled = True
+        return wrapper
+    return decorator
+
+
+def _include_label(node):
+    name = node.template.token.strip('\'"')
+    return f'include {name}'
+
+
+def install_profiler():
+    """Оборачивает {% include %} и {% thumbnail %} замером времени.
+
+    Замер идёт только между start_profiling() и stop_profiling(), в
+    остальное время обёртка лишь проверяет флаг.
+    """
+    if getattr(IncludeNode.render, 'profiled', False):
+        return
+    IncludeNode.render = _timed(_include_label)(IncludeNode.render)
+    ThumbnailNodeBase.render = _timed(
+        lambda node: 'thumbnail'
+    )(ThumbnailNodeBase.render)
+
+
+def format_stats(stats):
+    """Строки отчёта, самые дорогие узлы сверху."""
+    rows = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+    return [
+        f'{total * 1000:8.2f} ms {count:5d}x  {label}'
+        for label, (count, total) in rows
+    ]
@@ -0,0 +1,82 @@
+"""Хранилище сессий и уборка истёкших.
+
+SESSION_STORE выбирает движок (SESSION_ENGINES в настройках):
+
+* ``db`` - таблица django_session, запрос к базе на каждый запрос
+  вошедшего пользователя; выбран по умолчанию;
+* ``cached_db`` - чтение из кеша, запись и в кеш, и в базу; после
+  промаха кеша сессия читается из базы, так что переход с ``db``
+  никого не разлогинивает;
+* ``cache`` - только кеш; перед переходом с ``db`` сессии переносятся
+  командой warm_session_cache;
+* ``signed_cookies`` - данные в подписанной cookie, сервер ничего не
+  хранит; при переходе пользователям придётся войти заново.
+
+Для ``cached_db`` и ``cache`` нужен кеш, общий для всех процессов
+(memcached, redis): с кешем в памяти процесса сайт не запустится
+(core.checks).
+
+Истёкшие строки django_session удаляет задача ``clear_expired_sessions``
+небольшими пачками, не блокируя таблицу одним большим DELETE; runworker
+ставит её раз в SESSION_CLEANUP_INTERVAL секунд (TASKS_PERIODIC).
+"""
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+from .tasks import enqueue_batched, task
+
+
+def stores_in_db():
+    return settings.SESSION_ENGINE in (
+        'django.contrib.sessions.backends.db',
+        'django.contrib.sessions.backends.cached_db',
+    )
+
+
+def stores_in_cache():
+    return settings.SESSION_ENGINE in (
+        'django.contrib.sessions.backends.cache',
+        'django.contrib.sessions.backends.cached_db',
+    )
+
+
+def delete_expired(batch_size=None, max_batches=None):
+    """Удаляет истёкшие сессии пачками по ``batch_size`` строк.
+
+    Возвращает (сколько удалено, остались ли ещё истёкшие).
+    """
+    batch_size = batch_size or settings.SESSION_CLEANUP_BATCH_SIZE
+    expired = Session.objects.filter(expire_date__lt=timezone.now())
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        keys = list(
+            expired.values_list('session_key', flat=True)[:batch_size]
+        )
+        if not keys:
+            return deleted, False
+        count, _ = Session.objects.filter(session_key__in=keys).delete()
+        deleted += count
+        batches += 1
+    return deleted, expired.exists()
+
+
+@task
+def clear_expired_sessions():
+    """Убирает истёкшие сессии за SESSION_CLEANUP_BATCHES пачек.
+
+    Если истёкших больше, задача ставит себя снова, а не занимает
+    исполнителя воркера надолго.
+    """
+    if not stores_in_db():
+        # Кеш и cookie истекают сами.
+        engine = import_module(settings.SESSION_ENGINE)
+        engine.SessionStore.clear_expired()
+        return
+    _, more = delete_expired(max_batches=settings.SESSION_CLEANUP_BATCHES)
+    if more:
+        enqueue_batched(
+            clear_expired_sessions, key='sessions:cleanup', window=1
+        )
@@ -0,0 +1,115 @@
+"""Статика с хешем в имени, заранее сжатая gzip и brotli.
+
+``collectstatic`` с хранилищем ``CompressedManifestStaticFilesStorage``
+кладёт рядом с каждым текстовым файлом версии ``.gz`` и ``.br``, а
+``serve`` отдаёт лучшую из них без сжатия на лету. Для хостов без
+фронтового прокси.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .compression import accepted_encodings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Расширение варианта и значение Content-Encoding, лучшие впереди.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+# ManifestStaticFilesStorage вставляет 12 символов md5 перед расширением.
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+
+
+def compress(path):
+    """Пишет path.gz и path.br, если они меньше оригинала.
+
+    Возвращает список созданных файлов.
+    """
+    with open(path, 'rb') as source:
+        content = source.read()
+    variants = [('.gz', gzip.compress(content, compresslevel=9))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content)))
+    created = []
+    for suffix, compressed in variants:
+        if len(compressed) >= len(content):
+            continue
+        with open(path + suffix, 'wb') as target:
+            target.write(compressed)
+        created.append(path + suffix)
+    return created
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Хеширует имена и сжимает текстовые файлы при collectstatic."""
+
+    def post_process(self, *args, **kwargs):
+        for name, hashed_name, processed in super().post_process(
+            *args, **kwargs
+        ):
+            if (not isinstance(processed, Exception)
+                    and hashed_name
+                    and hashed_name.endswith(
+                        settings.STATIC_COMPRESS_EXTENSIONS)):
+                compress(self.path(hashed_name))
+            yield name, hashed_name, processed
+
+
+def serve(request, path):
+    """Отдаёт файл из STATIC_ROOT, заранее сжатый, если клиент умеет.
+
+    Файлы с хешем в имени не меняются, их кешируют навсегда
+    (Cache-Control: immutable), остальные браузер перепроверяет по
+    Last-Modified.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    if not os.path.isfile(fullpath):
+        raise Http404('Файл не найден')
+
+    statobj = os.stat(fullpath)
+    if not was_modified_since(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'),
+        statobj.st_mtime, statobj.st_size
+    ):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    accepted = accepted_encodings(request)
+    encoding = None
+    filename = fullpath
+    for coding, suffix in ENCODINGS:
+        if coding in accepted and os.path.isfile(fullpath + suffix):
+            encoding, filename = coding, fullpath + suffix
+            break
+
+    response = FileResponse(
+        open(filename, 'rb'),
+        content_type=content_type or 'application/octet-stream'
+    )
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Last-Modified'] = http_date(statobj.st_mtime)
+    response['Cache-Control'] = (
+        IMMUTABLE if HASHED_NAME.search(path) else REVALIDATE
+    )
+    return response
@@ -0,0 +1,272 @@
+"""Хранилище медиафайлов: локальный диск или S3-совместимое хранилище.
+
+``MediaStorage`` - хранилище по умолчанию (DEFAULT_FILE_STORAGE). Куда
+на самом деле пишутся файлы, решает настройка MEDIA_STORAGE:
+
+* ``local`` - MEDIA_ROOT на диске текущей машины;
+* ``s3`` - бакет S3-совместимого хранилища (нужен boto3);
+* ``memory`` - бакет в памяти процесса, замена S3 в тестах.
+
+Ссылки на файлы собираются из имени, без запросов к хранилищу.
+Миниатюры sorl лежат рядом с оригиналом: ``posts/cat.jpg`` ->
+``posts/cat/<вариант>.jpg``.
+"""
+import mimetypes
+import posixpath
+import threading
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from sorl.thumbnail.base import EXTENSIONS, ThumbnailBackend
+from sorl.thumbnail.helpers import serialize, tokey
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+
+def variant_name(name, label, extension=None):
+    """Имя производного файла рядом с оригиналом.
+
+    >>> variant_name('posts/cat.png', 'thumb', 'jpg')
+    'posts/cat/thumb.jpg'
+    """
+    root, original_extension = posixpath.splitext(name)
+    extension = f'.{extension}' if extension else original_extension
+    return f'{root}/{label}{extension}'
+
+
+class MemoryBucket:
+    """Бакет в памяти процесса с тем же интерфейсом, что у S3Bucket."""
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, data, content_type):
+        with self._lock:
+            self._objects[name] = (data, content_type, timezone.now())
+
+    def get(self, name):
+        try:
+            return self._objects[name][0]
+        except KeyError:
+            raise FileNotFoundError(name)
+
+    def head(self, name):
+        """Размер и время изменения объекта."""
+        try:
+            data, _, modified = self._objects[name]
+        except KeyError:
+            raise FileNotFoundError(name)
+        return len(data), modified
+
+    def delete(self, name):
+        with self._lock:
+            self._objects.pop(name, None)
+
+    def exists(self, name):
+        return name in self._objects
+
+    def keys(self, prefix=''):
+        return sorted(key for key in self._objects if key.startswith(prefix))
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
+class S3Bucket:
+    """Бакет S3-совместимого хранилища (AWS, MinIO, Yandex Object Storage)."""
+
+    def __init__(self, bucket, endpoint_url=None, region=None,
+                 access_key=None, secret_key=None):
+        if boto3 is None:
+            raise ImproperlyConfigured(
+                'Для MEDIA_STORAGE = "s3" нужен пакет boto3'
+            )
+        self.bucket = bucket
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+        )
+
+    def put(self, name, data, content_type):
+        self.client.put_object(
+            Bucket=self.bucket, Key=name, Body=data,
+            ContentType=content_type or 'application/octet-stream'
+        )
+
+    def get(self, name):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=name)
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(name)
+        return response['Body'].read()
+
+    def head(self, name):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=name)
+        except self.client.exceptions.ClientError:
+            raise FileNotFoundError(name)
+        return response['ContentLength'], response['LastModified']
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def exists(self, name):
+        try:
+            self.head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def keys(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key']
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(mode):
+    """Бакет для режима 's3' или 'memory', один на процесс."""
+    with _buckets_lock:
+        if mode not in _buckets:
+            if mode == 'memory':
+                _buckets[mode] = MemoryBucket()
+            elif mode == 's3':
+                config = settings.MEDIA_S3
+                _buckets[mode] = S3Bucket(
+                    config['BUCKET'],
+                    endpoint_url=config['ENDPOINT_URL'],
+                    region=config['REGION'],
+                    access_key=config['ACCESS_KEY'],
+                    secret_key=config['SECRET_KEY'],
+                )
+            else:
+                raise ImproperlyConfigured(
+                    f'Неизвестный MEDIA_STORAGE: {mode!r}'
+                )
+        return _buckets[mode]
+
+
+class ObjectStorage(Storage):
+    """Хранилище Django поверх бакета."""
+
+    def __init__(self, bucket, base_url):
+        self.bucket = bucket
+        self.base_url = base_url
+
+    def _open(self, name, mode='rb'):
+        return ContentFile(self.bucket.get(name), name=name)
+
+    def _save(self, name, content):
+        name = name.replace('\\', '/')
+        content.seek(0)
+        content_type, _ = mimetypes.guess_type(name)
+        self.bucket.put(name, content.read(), content_type)
+        return name
+
+    def delete(self, name):
+        self.bucket.delete(name)
+
+    def exists(self, name):
+        return self.bucket.exists(name)
+
+    def listdir(self, path):
+        prefix = path.rstrip('/') + '/' if path else ''
+        directories, files = set(), []
+        for key in self.bucket.keys(prefix):
+            head, sep, _ = key[len(prefix):].partition('/')
+            if sep:
+                directories.add(head)
+            else:
+                files.append(head)
+        return sorted(directories), files
+
+    def size(self, name):
+        return self.bucket.head(name)[0]
+
+    def get_modified_time(self, name):
+        return self.bucket.head(name)[1]
+
+    def url(self, name):
+        return self.base_url + quote(name.replace('\\', '/'))
+
+
+@deconstructible
+class MediaStorage(Storage):
+    """Хранилище, выбранное настройкой MEDIA_STORAGE.
+
+    Режим читается при каждом обращении, поэтому override_settings в
+    тестах переключает и поля моделей, и миниатюры sorl.
+    """
+
+    def __init__(self):
+        self._local = FileSystemStorage()
+
+    @property
+    def backend(self):
+        mode = settings.MEDIA_STORAGE
+        if mode == 'local':
+            return self._local
+        base_url = settings.MEDIA_S3['PUBLIC_URL'] or settings.MEDIA_URL
+        return ObjectStorage(get_bucket(mode), base_url)
+
+    def _open(self, name, mode='rb'):
+        return self.backend._open(name, mode)
+
+    def _save(self, name, content):
+        return self.backend._save(name, content)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def delete(self, name):
+        return self.backend.delete(name)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def get_accessed_time(self, name):
+        return self.backend.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backend.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+
+class SiblingThumbnailBackend(ThumbnailBackend):
+    """Кладёт миниатюры sorl рядом с оригиналом, а не в общий cache/."""
+
+    def _get_thumbnail_filename(self, source, geometry_string, options):
+        key = tokey(source.key, geometry_string, serialize(options))
+        return variant_name(
+            source.name,
+            f'{geometry_string}-{key[:12]}',
+            EXTENSIONS[options['format']]
+        )
@@ -0,0 +1,214 @@
+"""Фоновая очередь задач с брокером в БД.
+
+Задача - обычная функция, помеченная декоратором ``task``. Обработчики
+кладут её в очередь через ``enqueue`` и сразу отвечают пользователю,
+а выполняет задачи команда ``python manage.py runworker``. Она же ставит
+периодические задачи из TASKS_PERIODIC (``schedule_periodic``), среди
+них - удаление старых выполненных задач (``purge_finished``).
+"""
+import json
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def task(func=None, *, max_attempts=None, retry_delay=None):
+    """Помечает функцию как фоновую задачу."""
+    def decorator(f):
+        f.is_task = True
+        f.task_name = f'{f.__module__}.{f.__qualname__}'
+        f.max_attempts = max_attempts or settings.TASKS_MAX_ATTEMPTS
+        f.retry_delay = retry_delay or settings.TASKS_RETRY_DELAY
+        return f
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def enqueue(func, *args, idempotency_key=None, delay=0, **kwargs):
+    """Ставит задачу в очередь и возвращает запись Task.
+
+    Повторный вызов с тем же ``idempotency_key`` новую задачу не создаёт.
+    """
+    if not getattr(func, 'is_task', False):
+        raise ValueError(f'{func!r} не помечена декоратором @task')
+    if settings.TASKS_EAGER:
+        func(*args, **kwargs)
+        return None
+
+    payload = json.dumps({'args': args, 'kwargs': kwargs})
+    run_after = timezone.now() + timedelta(seconds=delay)
+    if idempotency_key is None:
+        return Task.objects.create(
+            name=func.task_name,
+            payload=payload,
+            max_attempts=func.max_attempts,
+            run_after=run_after
+        )
+    try:
+        with transaction.atomic():
+            return Task.objects.create(
+                name=func.task_name,
+                payload=payload,
+                idempotency_key=idempotency_key,
+                max_attempts=func.max_attempts,
+                run_after=run_after
+            )
+    except IntegrityError:
+        return Task.objects.get(idempotency_key=idempotency_key)
+
+
+def enqueue_batched(func, *args, key, window, **kwargs):
+    """Ставит задачу не чаще раза за окно в ``window`` секунд.
+
+    Вызовы с одним ключом в пределах окна сливаются в одну задачу,
+    которая выполнится в конце окна.
+    """
+    now = time.time()
+    bucket = int(now // window)
+    return enqueue(
+        func,
+        *args,
+        idempotency_key=f'{key}:{bucket}',
+        delay=(bucket + 1) * window - now,
+        **kwargs
+    )
+
+
+def claim(limit):
+    """Забирает в работу до ``limit`` готовых к выполнению задач.
+
+    Задача считается взятой, только если условный UPDATE изменил строку,
+    поэтому несколько воркеров не выполнят одну задачу дважды. Задачи,
+    зависшие в статусе RUNNING дольше TASKS_VISIBILITY_TIMEOUT (воркер
+    упал), снова становятся доступны.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.TASKS_VISIBILITY_TIMEOUT)
+    ready = (
+        Q(status=Task.PENDING, run_after__lte=now)
+        | Q(status=Task.RUNNING, locked_at__lt=stale)
+    )
+    claimed = []
+    candidates = Task.objects.filter(ready).values_list(
+        'pk', 'status', 'locked_at'
+    )[:limit]
+    for pk, status, locked_at in candidates:
+        updated = Task.objects.filter(
+            pk=pk, status=status, locked_at=locked_at
+        ).update(
+            status=Task.RUNNING,
+            locked_at=now,
+            attempts=F('attempts') + 1
+        )
+        if updated:
+            claimed.append(pk)
+    return claimed
+
+
+def execute(pk):
+    """Выполняет взятую задачу и записывает результат."""
+    try:
+        job = Task.objects.get(pk=pk)
+        func = import_string(job.name)
+        if not getattr(func, 'is_task', False):
+            raise ValueError(f'{job.name} не помечена декоратором @task')
+        payload = json.loads(job.payload)
+        func(*payload['args'], **payload['kwargs'])
+    except Exception:
+        logger.exception('Задача %s завершилась с ошибкой', pk)
+        _fail(pk, traceback.format_exc())
+        return False
+    else:
+        Task.objects.filter(pk=pk).update(
+            status=Task.DONE, locked_at=None, last_error=''
+        )
+        return True
+
+
+def _fail(pk, error):
+    job = Task.objects.get(pk=pk)
+    if job.attempts >= job.max_attempts:
+        job.status = Task.FAILED
+    else:
+        # Экспоненциальная пауза перед следующей попыткой.
+        retry_delay = getattr(
+            _resolve(job.name), 'retry_delay', settings.TASKS_RETRY_DELAY
+        )
+        delay = retry_delay * 2 ** (job.attempts - 1)
+        job.status = Task.PENDING
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+    job.locked_at = None
+    job.last_error = error
+    job.save(update_fields=['status', 'run_after', 'locked_at', 'last_error'])
+
+
+def _resolve(name):
+    try:
+        return import_string(name)
+    except ImportError:
+        return None
+
+
+def run_pending(limit=100):
+    """Синхронно выполняет готовые задачи. Возвращает их количество."""
+    claimed = claim(limit)
+    for pk in claimed:
+        execute(pk)
+    return len(claimed)
+
+
+def schedule_periodic(due):
+    """Ставит периодические задачи из TASKS_PERIODIC, чей срок подошёл.
+
+    ``due`` - {путь к задаче: время, до которого ставить её не нужно};
+    воркер хранит его между вызовами. Через enqueue_batched несколько
+    воркеров ставят задачу один раз за период.
+    """
+    now = time.time()
+    for path, interval in settings.TASKS_PERIODIC.items():
+        if now < due.get(path, 0):
+            continue
+        enqueue_batched(
+            import_string(path), key=f'periodic:{path}', window=interval
+        )
+        due[path] = (now // interval + 1) * interval
+    return due
+
+
+@task
+def purge_finished():
+    """Удаляет выполненные задачи старше TASKS_RETENTION секунд.
+
+    Удаляет пачками по TASKS_PURGE_BATCH_SIZE строк, чтобы не держать
+    блокировку таблицы одним большим DELETE. Задачи с ошибкой остаются
+    для разбора.
+    """
+    finished = Task.objects.filter(
+        status=Task.DONE,
+        run_after__lt=timezone.now() - timedelta(
+            seconds=settings.TASKS_RETENTION
+        )
+    )
+    deleted = 0
+    while True:
+        pks = list(
+            finished.values_list('pk', flat=True)[
+                :settings.TASKS_PURGE_BATCH_SIZE
+            ]
+        )
+        if not pks:
+            return deleted
+        deleted += Task.objects.filter(pk__in=pks).delete()[0]
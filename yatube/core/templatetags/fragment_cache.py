@@ -0,0 +1,44 @@
+"""{% cache %} с пересчётом без давки (core.cache.get_or_compute).
+
+Синтаксис и ключи те же, что у тега Django: ``{% load fragment_cache %}``
+вместо ``{% load cache %}``.
+"""
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags import cache as django_cache
+
+from ..cache import get_or_compute
+
+register = template.Library()
+
+
+class FragmentCacheNode(django_cache.CacheNode):
+    def render(self, context):
+        try:
+            timeout = int(self.expire_time_var.resolve(context))
+        except (template.VariableDoesNotExist, ValueError, TypeError):
+            raise template.TemplateSyntaxError(
+                f'"cache" tag got an invalid timeout: '
+                f'{self.expire_time_var.var!r}'
+            )
+        fragment_cache = None
+        if self.cache_name:
+            fragment_cache = django_cache.caches[
+                self.cache_name.resolve(context)
+            ]
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return get_or_compute(
+            make_template_fragment_key(self.fragment_name, vary_on),
+            lambda: self.nodelist.render(context),
+            timeout,
+            cache=fragment_cache
+        )
+
+
+@register.tag('cache')
+def do_cache(parser, token):
+    node = django_cache.do_cache(parser, token)
+    return FragmentCacheNode(
+        node.nodelist, node.expire_time_var, node.fragment_name,
+        node.vary_on, node.cache_name
+    )
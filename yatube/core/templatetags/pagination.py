@@ -0,0 +1,35 @@
+from django import template
+from django.conf import settings
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page_obj, on_each_side=None, on_ends=None):
+    """Номера страниц вокруг текущей плюс первые и последние.
+
+    Пропуски обозначены None. Весь page_range не строится, поэтому цена
+    не зависит от числа страниц.
+    """
+    if on_each_side is None:
+        on_each_side = settings.PAGINATION_ON_EACH_SIDE
+    if on_ends is None:
+        on_ends = settings.PAGINATION_ON_ENDS
+    number = page_obj.number
+    num_pages = page_obj.paginator.num_pages
+
+    window_start = max(number - on_each_side, 1)
+    window_end = min(number + on_each_side, num_pages)
+    pages = []
+    if window_start > on_ends + 2:
+        pages.extend(range(1, on_ends + 1))
+        pages.append(None)
+    else:
+        window_start = 1
+    pages.extend(range(window_start, window_end + 1))
+    if window_end < num_pages - on_ends - 1:
+        pages.append(None)
+        pages.extend(range(num_pages - on_ends + 1, num_pages + 1))
+    else:
+        pages.extend(range(window_end + 1, num_pages + 1))
+    return pages
@@ -0,0 +1,20 @@
+from django import template
+from sorl.thumbnail.helpers import toint
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_size(width, height, geometry, upscale=False):
+    """Размер миниатюры sorl с crop по сохранённым размерам оригинала.
+
+    Повторяет расчёт sorl (масштаб, затем обрезка), поэтому ради width и
+    height у <img> не нужно открывать файл. Без размеров - None.
+    """
+    if not width or not height:
+        return None
+    box_width, box_height = map(int, geometry.split('x'))
+    factor = max(box_width / width, box_height / height)
+    if factor < 1 or upscale:
+        width, height = toint(width * factor), toint(height * factor)
+    return min(width, box_width), min(height, box_height)
@@ -6,3 +6,9 @@ register = template.Library()
 @register.filter
 def addclass(field, css):
     return field.as_widget(attrs={'class': css})
+
+
+@register.filter
+def is_author(viewer, obj):
+    """``viewer.is_author(obj)``: {% if viewer|is_author:post %}."""
+    return viewer.is_author(obj)
@@ -0,0 +1,17 @@
+"""Заготовки для тестов приложений."""
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+# Картинка GIF 2x1 пиксель.
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def small_gif(name='small.gif'):
+    """Загруженный файл с SMALL_GIF."""
+    return SimpleUploadedFile(name, SMALL_GIF, 'image/gif')
@@ -0,0 +1,1010 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import brotli
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.cache import \
+    SessionStore as CacheSessionStore
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.paginator import Paginator
+from django.core.management import call_command
+from django.http import (Http404, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
+from django.template import engines
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
+
+from posts.forms import PostForm
+from posts.models import Group, Post
+
+from .auth import get_user, user_key
+from .cache import LocalStore, TieredCache, _stores, get_or_compute
+from .checks import check_session_cache
+from .compression import compress as compress_body
+from .jinja import get_engine
+from .media import serve as serve_media
+from .middleware import CompressionMiddleware
+from .models import Task
+from .ratelimit import hit, parse_rate
+from .sessions import clear_expired_sessions, delete_expired
+from .rendering import (install_profiler, precompile_templates,
+                        start_profiling, stop_profiling)
+from .static import serve as serve_static
+from .storage import MemoryBucket, get_bucket
+from .templatetags.pagination import page_window
+from .templatetags.thumbnail_size import thumbnail_size
+from .tasks import (claim, enqueue, purge_finished, run_pending,
+                    schedule_periodic, task)
+from .testing import small_gif
+
+User = get_user_model()
+
+CALLS = []
+
+
+@task
+def remember(value):
+    CALLS.append(value)
+
+
+@task
+def remember_then_enqueue(value):
+    CALLS.append(value)
+    enqueue(remember, 'last')
+
+
+@task
+def wait_for_last():
+    deadline = time.monotonic() + 5
+    while 'last' not in CALLS and time.monotonic() < deadline:
+        time.sleep(0.01)
+    CALLS.append('slow')
+
+
+@task(max_attempts=2, retry_delay=1)
+def broken():
+    raise RuntimeError('boom')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_does_not_run_task(self):
+        """enqueue только кладёт задачу в очередь."""
+        job = enqueue(remember, 1)
+        self.assertEqual(job.status, Task.PENDING)
+        self.assertEqual(CALLS, [])
+
+    def test_run_pending_executes_tasks(self):
+        """run_pending выполняет задачи и помечает их выполненными."""
+        job = enqueue(remember, 'a')
+        self.assertEqual(run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Task.DONE)
+        self.assertEqual(CALLS, ['a'])
+
+    def test_idempotency_key(self):
+        """Задача с тем же ключом идемпотентности ставится один раз."""
+        first = enqueue(remember, 1, idempotency_key='key')
+        second = enqueue(remember, 2, idempotency_key='key')
+        self.assertEqual(first.pk, second.pk)
+        run_pending()
+        self.assertEqual(CALLS, [1])
+
+    def test_delayed_task_is_not_claimed(self):
+        """Отложенная задача не выполняется раньше срока."""
+        enqueue(remember, 1, delay=60)
+        self.assertEqual(run_pending(), 0)
+
+    def test_failed_task_is_retried(self):
+        """Упавшая задача повторяется, пока не кончатся попытки."""
+        job = enqueue(broken)
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Task.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('boom', job.last_error)
+
+        Task.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Task.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_stale_running_task_is_reclaimed(self):
+        """Задачу упавшего воркера можно взять снова."""
+        job = enqueue(remember, 1)
+        self.assertEqual(claim(10), [job.pk])
+        self.assertEqual(claim(10), [])
+        Task.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timedelta(days=1)
+        )
+        self.assertEqual(claim(10), [job.pk])
+
+    @override_settings(TASKS_RETENTION=60)
+    def test_purge_finished(self):
+        """Старые выполненные задачи удаляются, упавшие остаются."""
+        old = timezone.now() - timedelta(minutes=5)
+        for status in (Task.DONE, Task.DONE, Task.FAILED):
+            Task.objects.create(name='x', status=status, run_after=old)
+        recent = enqueue(remember, 1)
+        run_pending()
+        self.assertEqual(purge_finished(), 2)
+        self.assertEqual(
+            set(Task.objects.values_list('status', flat=True)),
+            {Task.FAILED, Task.DONE}
+        )
+        self.assertTrue(Task.objects.filter(pk=recent.pk).exists())
+
+    @override_settings(TASKS_PERIODIC={'core.tasks.purge_finished': 60})
+    def test_schedule_periodic(self):
+        """Периодическая задача ставится один раз за период."""
+        with mock.patch('core.tasks.time.time', return_value=600.5):
+            due = schedule_periodic({})
+            schedule_periodic(due)
+            schedule_periodic({})
+        self.assertEqual(due, {'core.tasks.purge_finished': 660})
+        self.assertEqual(Task.objects.filter(
+            name='core.tasks.purge_finished', status=Task.PENDING
+        ).count(), 1)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_mode(self):
+        """В режиме TASKS_EAGER задача выполняется сразу."""
+        self.assertIsNone(enqueue(remember, 'now'))
+        self.assertEqual(CALLS, ['now'])
+        self.assertFalse(Task.objects.exists())
+
+
+class RunWorkerTests(TransactionTestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_runworker_burst(self):
+        """Команда runworker --burst выполняет очередь и завершается."""
+        enqueue(remember, 1)
+        enqueue(remember, 2)
+        call_command('runworker', '--burst', '--workers=2', stdout=StringIO())
+        self.assertEqual(sorted(CALLS), [1, 2])
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 2)
+
+    def test_slow_task_does_not_block_pool(self):
+        """Пока идёт медленная задача, свободный исполнитель берёт новые."""
+        enqueue(wait_for_last)
+        enqueue(remember_then_enqueue, 'fast')
+        call_command('runworker', '--burst', '--workers=2', stdout=StringIO())
+        self.assertEqual(CALLS, ['fast', 'last', 'slow'])
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+class PageWindowTests(TestCase):
+    def window(self, number, num_pages):
+        page_obj = Paginator(range(num_pages), 1).page(number)
+        return page_window(page_obj, on_each_side=2, on_ends=1)
+
+    def test_middle_page_is_elided_on_both_sides(self):
+        """Вокруг текущей страницы окно, края через пропуск."""
+        self.assertEqual(
+            self.window(5000, 10000),
+            [1, None, 4998, 4999, 5000, 5001, 5002, None, 10000]
+        )
+
+    def test_pages_near_edges_are_not_elided(self):
+        """Рядом с краем пропуск не ставится."""
+        self.assertEqual(self.window(1, 10), [1, 2, 3, None, 10])
+        self.assertEqual(self.window(4, 10), [1, 2, 3, 4, 5, 6, None, 10])
+        self.assertEqual(self.window(10, 10), [1, None, 8, 9, 10])
+
+    def test_few_pages_are_shown_in_full(self):
+        """Небольшое число страниц выводится целиком."""
+        self.assertEqual(self.window(2, 3), [1, 2, 3])
+        self.assertEqual(self.window(1, 1), [1])
+
+
+class ThumbnailSizeTests(TestCase):
+    def test_matches_sorl_crop(self):
+        """Размер считается так же, как sorl масштабирует и обрезает."""
+        cases = [
+            ((1920, 1080, '960x339', True), (960, 339)),
+            ((100, 75, '960x339', True), (960, 339)),
+            ((1000, 500, '300x300', False), (300, 300)),
+            ((200, 100, '300x300', False), (200, 100)),
+            ((600, 100, '300x300', False), (300, 100)),
+        ]
+        for (width, height, geometry, upscale), size in cases:
+            with self.subTest(width=width, height=height, geometry=geometry):
+                self.assertEqual(
+                    thumbnail_size(width, height, geometry, upscale), size
+                )
+
+    def test_unknown_size(self):
+        """Без сохранённых размеров - None."""
+        self.assertIsNone(thumbnail_size(None, None, '300x300'))
+
+
+class TemplateRenderingTests(TestCase):
+    def test_precompile_templates(self):
+        """Предкомпиляция проходит по всем шаблонам проекта."""
+        timings = precompile_templates()
+        for name in ('base.html', 'posts/index.html',
+                     'posts/includes/paginator.html'):
+            with self.subTest(name=name):
+                self.assertIn(name, timings)
+
+    def test_profiler_counts_includes(self):
+        """Профайлер считает вызовы и время каждого {% include %}."""
+        install_profiler()
+        start_profiling()
+        Client().get(reverse('posts:index'))
+        stats = stop_profiling()
+        count, seconds = stats['include includes/header.html']
+        self.assertEqual(count, 1)
+        self.assertGreater(seconds, 0)
+
+    @override_settings(TEMPLATE_PROFILING=True)
+    def test_profiler_middleware_sets_server_timing(self):
+        """С TEMPLATE_PROFILING ответ получает заголовок Server-Timing."""
+        response = Client().get(reverse('posts:index'))
+        self.assertIn('includes/header.html', response['Server-Timing'])
+
+    def test_profiler_middleware_is_off_by_default(self):
+        """По умолчанию профайлер не подключается."""
+        response = Client().get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class JinjaTemplatesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        for number in range(12):
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=cls.user,
+                group=cls.group,
+                image=small_gif()
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def render(self, engine, name, url, **extra):
+        # Фрагменты постов главной кешируются общими ключами обоих движков.
+        cache.clear()
+        request = RequestFactory().get(url)
+        request.resolver_match = None
+        request.user = self.user
+        page_obj = Paginator(Post.objects.all(), 10).page(1)
+        context = dict(extra, page_obj=page_obj)
+        return engine.get_template(name).render(context, request)
+
+    def test_feed_templates_match_django(self):
+        """Шаблоны Jinja2 дают те же ссылки и картинки, что и Django."""
+        pages = [
+            ('posts/index.html', reverse('posts:index'), {}),
+            ('posts/group_list.html',
+             reverse('posts:group_list', args=[self.group.slug]),
+             {'group': self.group}),
+            ('posts/profile.html',
+             reverse('posts:profile', args=[self.user.username]),
+             {'username': self.user, 'following': False}),
+            ('posts/follow.html', reverse('posts:follow_index'),
+             {'suggested': [self.user]}),
+        ]
+        links = re.compile(r'(?:href|src)="([^"]+)"')
+        for name, url, extra in pages:
+            with self.subTest(name=name):
+                expected = self.render(engines['django'], name, url, **extra)
+                actual = self.render(get_engine(), name, url, **extra)
+                self.assertEqual(
+                    links.findall(actual), links.findall(expected)
+                )
+                self.assertIn('Пост 11', actual)
+                self.assertRegex(
+                    actual, settings.MEDIA_URL + r'posts/small\w*/960x339-'
+                )
+
+    def test_addclass_and_year(self):
+        """Фильтр addclass и переменная year доступны в Jinja2."""
+        template = get_engine().from_string(
+            '{{ form.text|addclass("form-control") }} {{ year }}'
+        )
+        html = template.render(
+            {'form': PostForm()}, RequestFactory().get('/')
+        )
+        self.assertIn('class="form-control"', html)
+        self.assertIn(str(timezone.now().year), html)
+
+
+TEMP_STATIC_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(
+    STATIC_ROOT=TEMP_STATIC_ROOT,
+    STATICFILES_STORAGE='core.static.CompressedManifestStaticFilesStorage'
+)
+class StaticAssetsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(TEMP_STATIC_ROOT, 'staticfiles.json')) as f:
+            cls.css = json.load(f)['paths']['css/bootstrap.min.css']
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_STATIC_ROOT, ignore_errors=True)
+
+    def get(self, path, **headers):
+        request = RequestFactory().get('/static/' + path, **headers)
+        return serve_static(request, path)
+
+    def test_collectstatic_precompresses_text_files(self):
+        """collectstatic пишет .gz и .br для css, но не для png."""
+        css = os.path.join(TEMP_STATIC_ROOT, self.css)
+        self.assertRegex(self.css, r'bootstrap\.min\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.isfile(css + '.gz'))
+        self.assertTrue(os.path.isfile(css + '.br'))
+        self.assertFalse(
+            os.path.isfile(os.path.join(TEMP_STATIC_ROOT, 'img/logo.png.gz'))
+        )
+
+    def test_serve_picks_best_encoding(self):
+        """Отдаётся лучший вариант из тех, что понимает клиент."""
+        cases = [
+            ('gzip, deflate, br', 'br'),
+            ('gzip', 'gzip'),
+            ('br;q=0, gzip', 'gzip'),
+            ('', None),
+        ]
+        for accept, encoding in cases:
+            with self.subTest(accept=accept):
+                response = self.get(self.css, HTTP_ACCEPT_ENCODING=accept)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertEqual(response['Content-Type'], 'text/css')
+                self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_hashed_files_are_immutable(self):
+        """Файлы с хешем кешируются навсегда, остальные перепроверяются."""
+        response = self.get(self.css)
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.get('css/bootstrap.min.css')
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_not_modified_and_missing(self):
+        """If-Modified-Since даёт 304, чужие пути - 404."""
+        response = self.get(self.css)
+        response = self.get(
+            self.css, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+        for path in ('css/missing.css', '../settings.py'):
+            with self.subTest(path=path):
+                with self.assertRaises(Http404):
+                    self.get(path)
+
+
+class CompressionMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def call(self, response, accept='br, gzip'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_feed_page_is_compressed(self):
+        """Главная страница уходит в brotli, а без br - в gzip."""
+        client = Client()
+        url = reverse('posts:index')
+        plain = client.get(url).content
+        response = client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain)
+        response = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_skips_small_and_compressed_responses(self):
+        """Маленькие ответы и картинки не сжимаются."""
+        responses = [
+            JsonResponse({'ok': True}),
+            HttpResponse(b'x' * 5000, content_type='image/png'),
+            HttpResponse(b'x' * 5000, content_type='text/css'),
+        ]
+        responses[2]['Content-Encoding'] = 'br'
+        for response in responses:
+            with self.subTest(content_type=response['Content-Type']):
+                content = response.content
+                response = self.call(response)
+                self.assertEqual(response.content, content)
+                self.assertNotEqual(response.get('Content-Encoding'), 'gzip')
+
+    def test_streaming_response(self):
+        """Потоковый ответ сжимается по кускам."""
+        chunks = [f'<p>{number}</p>' * 100 for number in range(10)]
+        response = self.call(
+            StreamingHttpResponse(iter(chunks)), accept='gzip'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)),
+            ''.join(chunks).encode()
+        )
+
+    def test_anonymous_pages_are_compressed_once(self):
+        """Одинаковая страница для анонимов сжимается один раз."""
+        body = '<p>Пост</p>' * 500
+        with mock.patch(
+            'core.middleware.compress', side_effect=compress_body
+        ) as compress:
+            first = self.call(HttpResponse(body))
+            second = self.call(HttpResponse(body))
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.content, second.content)
+
+
+@override_settings(MEDIA_STORAGE='memory')
+class MediaStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    def tearDown(self):
+        get_bucket('memory').clear()
+
+    def create_post(self):
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Пост с картинкой',
+                'image': small_gif()
+            }
+        )
+        return Post.objects.get()
+
+    def test_upload_goes_to_bucket(self):
+        """Картинка поста попадает в бакет, а не на диск."""
+        post = self.create_post()
+        bucket = get_bucket('memory')
+        self.assertEqual(bucket.keys(), [post.image.name])
+        self.assertFalse(
+            os.path.exists(os.path.join(settings.MEDIA_ROOT, post.image.name))
+        )
+        with post.image.open() as image:
+            self.assertTrue(image.read().startswith(b'GIF89a'))
+
+    def test_thumbnail_next_to_original(self):
+        """Миниатюра лежит рядом с оригиналом в том же бакете."""
+        post = self.create_post()
+        thumbnail = get_thumbnail(post.image, '960x339', crop='center')
+        folder, _ = os.path.splitext(post.image.name)
+        self.assertRegex(
+            thumbnail.name, rf'^{folder}/960x339-[0-9a-f]{{12}}\.jpg$'
+        )
+        self.assertTrue(get_bucket('memory').exists(thumbnail.name))
+
+    def test_urls_without_store_requests(self):
+        """Ссылки на картинки строятся без обращений к хранилищу."""
+        post = self.create_post()
+        get_thumbnail(post.image, '960x339', crop='center')
+        with mock.patch.object(MemoryBucket, 'exists') as exists, \
+                mock.patch.object(MemoryBucket, 'head') as head:
+            response = self.authorized_client.get(
+                reverse('posts:profile', args=[self.user.username])
+            )
+            self.assertEqual(
+                post.image.url, settings.MEDIA_URL + post.image.name
+            )
+        folder, _ = os.path.splitext(post.image.name)
+        self.assertContains(response, f'{settings.MEDIA_URL}{folder}/960x339-')
+        exists.assert_not_called()
+        head.assert_not_called()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaServeTests(TestCase):
+    content = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'posts'), exist_ok=True)
+        for name in ('posts/image.png', 'private.png'):
+            with open(os.path.join(TEMP_MEDIA_ROOT, name), 'wb') as file:
+                file.write(cls.content)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def get(self, path='posts/image.png', **headers):
+        request = RequestFactory().get(settings.MEDIA_URL + path, **headers)
+        return serve_media(request, path)
+
+    def test_full_file(self):
+        """Файл отдаётся целиком с Last-Modified и Accept-Ranges."""
+        response = self.get()
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        response.close()
+
+    def test_range(self):
+        """Range отдаёт только запрошенные байты."""
+        cases = [
+            ('bytes=0-9', 0, 9),
+            ('bytes=1000-', 1000, 1023),
+            ('bytes=-4', 1020, 1023),
+            ('bytes=1020-5000', 1020, 1023),
+        ]
+        for header, start, end in cases:
+            with self.subTest(header=header):
+                response = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    self.content[start:end + 1]
+                )
+                self.assertEqual(
+                    response['Content-Range'], f'bytes {start}-{end}/1024'
+                )
+                self.assertEqual(
+                    int(response['Content-Length']), end - start + 1
+                )
+                response.close()
+
+    def test_unsatisfiable_range(self):
+        """Диапазон за концом файла - 416."""
+        response = self.get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_not_modified(self):
+        """If-Modified-Since с тем же временем даёт 304."""
+        response = self.get()
+        response.close()
+        response = self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_access(self):
+        """Файлы вне открытых каталогов и чужие пути не отдаются."""
+        for path in ('private.png', 'posts/.hidden', '../settings.py',
+                     'posts/missing.png'):
+            with self.subTest(path=path):
+                with self.assertRaises(Http404):
+                    self.get(path)
+
+    def test_offload(self):
+        """С прокси отдача уходит в X-Accel-Redirect или X-Sendfile."""
+        with self.settings(MEDIA_OFFLOAD='x-accel-redirect'):
+            response = self.get(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            settings.MEDIA_ACCEL_PREFIX + 'posts/image.png'
+        )
+        self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_OFFLOAD='x-sendfile'):
+            response = self.get()
+        self.assertEqual(
+            response['X-Sendfile'],
+            os.path.join(TEMP_MEDIA_ROOT, 'posts/image.png')
+        )
+
+    def test_media_url(self):
+        """Картинки доступны по MEDIA_URL."""
+        response = Client().get(settings.MEDIA_URL + 'posts/image.png')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+
+@override_settings(
+    RATELIMIT_ENABLED=True,
+    RATELIMITS={
+        'posts:add_comment': {'user': '2/m', 'ip': '10/m'},
+        'users:signup': {'ip': '1/h'},
+    }
+)
+class RateLimitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/m'), (10, 60))
+        self.assertEqual(parse_rate('100/5m'), (100, 300))
+        with self.assertRaises(ValueError):
+            parse_rate('10 per minute')
+
+    def test_bucket_refills(self):
+        """Корзина пропускает limit запросов разом и пополняется со
+        временем, Retry-After указывает, когда запрос пройдёт."""
+        self.assertEqual(
+            [hit('test', '3/m', now=0) for _ in range(4)], [0, 0, 0, 90]
+        )
+        self.assertEqual(hit('test', '3/m', now=60), 45)
+        self.assertEqual(hit('test', '3/m', now=105), 0)
+
+    def test_comment_limit(self):
+        """Лишний комментарий получает 429, другие пользователи - нет."""
+        client = Client()
+        client.force_login(self.author)
+        url = reverse('posts:add_comment', args=[self.post.pk])
+        for _ in range(2):
+            response = client.post(url, {'text': 'Комментарий'})
+            self.assertEqual(response.status_code, 302)
+        response = client.post(url, {'text': 'Комментарий'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.post.comments.count(), 2)
+
+        other = Client()
+        other.force_login(User.objects.create_user(username='other'))
+        response = other.post(url, {'text': 'Комментарий'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_signup_limited_by_middleware(self):
+        """Регистрация ограничена по адресу через middleware, GET - нет."""
+        client = Client()
+        url = reverse('users:signup')
+        response = client.post(url, {'username': 'first'})
+        self.assertEqual(response.status_code, 200)
+        response = client.post(url, {'username': 'second'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(client.get(url).status_code, 200)
+
+
+class SessionCleanupTests(TestCase):
+    def make_sessions(self, count, expired=True):
+        for _ in range(count):
+            session = SessionStore()
+            session.set_expiry(-60 if expired else 3600)
+            session.save()
+
+    def test_delete_expired_in_batches(self):
+        """Истёкшие сессии удаляются пачками, действующие остаются."""
+        self.make_sessions(5)
+        self.make_sessions(1, expired=False)
+        self.assertEqual(
+            delete_expired(batch_size=2, max_batches=1), (2, True)
+        )
+        self.assertEqual(delete_expired(batch_size=2), (3, False))
+        self.assertEqual(Session.objects.count(), 1)
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+        SESSION_CLEANUP_BATCH_SIZE=2,
+        SESSION_CLEANUP_BATCHES=1
+    )
+    def test_task_reschedules_itself(self):
+        """Задача уборки ставит себя снова, пока есть истёкшие сессии."""
+        self.make_sessions(3)
+        clear_expired_sessions()
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertTrue(Task.objects.filter(
+            name='core.sessions.clear_expired_sessions'
+        ).exists())
+
+    def test_cleanup_is_periodic(self):
+        """Уборку ставит runworker по расписанию, а не каждый вход."""
+        User.objects.create_user(username='sessions', password='secret')
+        self.assertTrue(
+            Client().login(username='sessions', password='secret')
+        )
+        cleanup = Task.objects.filter(
+            name='core.sessions.clear_expired_sessions'
+        )
+        self.assertFalse(cleanup.exists())
+        schedule_periodic({})
+        self.assertEqual(cleanup.count(), 1)
+
+    def test_benchmark(self):
+        """Сессии в кеше не читаются из базы на каждый запрос."""
+        User.objects.create_user(username='sessions')
+        out = StringIO()
+        call_command('benchmark_sessions', repeat=5, stdout=out)
+        rows = {
+            line.split()[0]: float(line.split()[1])
+            for line in out.getvalue().splitlines()[1:]
+        }
+        self.assertEqual(rows['db'] - rows['cached_db'], 1)
+        self.assertEqual(rows['cache'], rows['cached_db'])
+
+
+class SessionStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_sessions_need_shared_cache(self):
+        """Сессии в кеше памяти процесса не проходят проверку запуска."""
+        local = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        shared = {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        }
+        tiered = {'BACKEND': 'core.cache.TieredCache',
+                  'OPTIONS': {'SHARED': 'shared'}}
+        cases = [
+            ('db', {'default': local}, []),
+            ('cached_db', {'default': local}, ['core.E001']),
+            ('cache', {'default': tiered, 'shared': local}, ['core.E001']),
+            ('cache', {'default': tiered, 'shared': shared}, []),
+        ]
+        for store, caches_config, errors in cases:
+            engine = settings.SESSION_ENGINES[store]
+            with self.subTest(store=store, caches=caches_config), \
+                    self.settings(SESSION_ENGINE=engine, CACHES=caches_config):
+                self.assertEqual(
+                    [error.id for error in check_session_cache(None)],
+                    errors
+                )
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.cache'
+    )
+    def test_warm_session_cache(self):
+        """Сессии из базы переносятся в кеш под своими ключами."""
+        session = SessionStore()
+        session['answer'] = 42
+        session.save()
+        call_command('warm_session_cache', stdout=StringIO())
+        cached = CacheSessionStore(session.session_key)
+        self.assertEqual(cached['answer'], 42)
+        self.assertEqual(cached.session_key, session.session_key)
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='cached', password='secret'
+        )
+        client = Client()
+        client.force_login(self.user)
+        self.request = RequestFactory().get('/')
+        self.request.session = client.session
+        # Сессию читаем заранее: считаем только запросы за пользователем.
+        self.request.session.load()
+
+    def test_user_read_from_cache(self):
+        self.assertEqual(get_user(self.request), self.user)
+        with self.assertNumQueries(0):
+            user = get_user(self.request)
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.backend, settings.AUTHENTICATION_BACKENDS[0])
+
+    def test_save_invalidates(self):
+        get_user(self.request)
+        self.user.first_name = 'Новое имя'
+        self.user.save()
+        self.assertEqual(get_user(self.request).first_name, 'Новое имя')
+
+    def test_password_change_logs_out(self):
+        """Смена пароля разлогинивает и сессии с пользователем в кеше."""
+        get_user(self.request)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertFalse(get_user(self.request).is_authenticated)
+
+    def test_inactive_user_rejected_on_cache_hit(self):
+        """Отключённый пользователь из кеша не входит."""
+        get_user(self.request)
+        cached = cache.get(user_key(self.user.pk))
+        cached['is_active'] = False
+        cache.set(user_key(self.user.pk), cached)
+        self.assertFalse(get_user(self.request).is_authenticated)
+
+    def test_password_hash_not_cached(self):
+        """В кеше нет хеша пароля, а save() его не затирает."""
+        get_user(self.request)
+        cached = cache.get(user_key(self.user.pk))
+        self.assertNotIn(self.user.password, repr(cached))
+        user = get_user(self.request)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertNotIn('username', user.get_deferred_fields())
+        user.first_name = 'Новое имя'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('secret'))
+        self.assertEqual(self.user.first_name, 'Новое имя')
+
+    def test_session_hash_checked_on_cache_hit(self):
+        get_user(self.request)
+        self.request.session[HASH_SESSION_KEY] = 'stale'
+        self.assertFalse(get_user(self.request).is_authenticated)
+        self.assertIsNone(self.request.session.session_key)
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+
+    def tearDown(self):
+        _stores.pop(self.id(), None)
+
+    def make_cache(self, **options):
+        return TieredCache(self.id(), {'OPTIONS': {
+            'SHARED': 'shared', 'LOCAL_KEY_PREFIXES': ('hot:',), **options
+        }})
+
+    def test_local_tier(self):
+        """Ключи с префиксами из LOCAL_KEY_PREFIXES читаются из L1."""
+        tiered = self.make_cache()
+        tiered.set('hot:a', 1)
+        tiered.set('cold:b', 2)
+        caches['shared'].delete_many(['hot:a', 'cold:b'])
+        self.assertEqual(tiered.get('hot:a'), 1)
+        self.assertIsNone(tiered.get('cold:b'))
+        self.assertEqual(tiered.get_many(['hot:a', 'cold:b']), {'hot:a': 1})
+        stats = tiered.stats()
+        self.assertEqual((stats['l1']['hits'], stats['l1']['misses']), (2, 0))
+        self.assertEqual((stats['l2']['hits'], stats['l2']['misses']), (0, 2))
+
+    def test_bounded(self):
+        """L1 ограничен числом записей и байтами, вытесняет старые."""
+        tiered = self.make_cache(LOCAL_MAX_ENTRIES=2, LOCAL_MAX_BYTES=280)
+        tiered.set('hot:a', 1)
+        tiered.set('hot:b', 2)
+        tiered.get('hot:a')
+        tiered.set('hot:c', 3)
+        self.assertEqual(
+            [key.split(':')[-1] for key in tiered.local.entries], ['a', 'c']
+        )
+        tiered.set('hot:d', 'x' * 250)
+        self.assertEqual(len(tiered.local.entries), 1)
+        self.assertLessEqual(tiered.local.size, 280)
+
+    def test_local_timeout(self):
+        tiered = self.make_cache(LOCAL_TIMEOUT=5)
+        tiered.set('hot:a', 1, 60)
+        expires, _ = next(iter(tiered.local.entries.values()))
+        self.assertLessEqual(expires - time.monotonic(), 5)
+        tiered.set('hot:b', 1, 0)
+        self.assertEqual(len(tiered.local.entries), 1)
+
+    def test_invalidation_between_processes(self):
+        """Изменение в одном процессе выбрасывает ключ из L1 другого."""
+        first = self.make_cache()
+        second = self.make_cache()
+        second.local = LocalStore(1000, 1024 * 1024)
+        first.set('hot:a', 1)
+        self.assertEqual(second.get('hot:a'), 1)
+        self.assertEqual(first.get('hot:a'), 1)
+        first.set('hot:a', 2)
+        # До сверки второй процесс отдаёт своё.
+        self.assertEqual(second.get('hot:a'), 1)
+        for tiered in (first, second):
+            tiered.local.synced -= 1
+        self.assertEqual(second.get('hot:a'), 2)
+        # Свои сообщения процесс пропускает.
+        self.assertEqual(first.get('hot:a'), 2)
+        self.assertEqual(first.local.stats['l1_hits'], 2)
+
+    def test_lost_messages_clear_local_tier(self):
+        first = self.make_cache()
+        second = self.make_cache()
+        second.local = LocalStore(1000, 1024 * 1024)
+        second.set('hot:b', 1)
+        second.get('hot:b')
+        first.set('hot:a', 1)
+        caches['shared'].delete(f'tiered:{self.id()}:inv:2')
+        second.local.synced -= 1
+        second.get('hot:a')
+        self.assertNotIn(
+            caches['shared'].make_key('hot:b'), second.local.entries
+        )
+
+    def test_stats_command(self):
+        cache.get('template.cache.missing')
+        out = StringIO()
+        call_command('cache_stats', stdout=out)
+        self.assertIn('l1', out.getvalue())
+
+
+class GetOrComputeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def expire(self, key, delta=0):
+        cache.set(f'{key}:meta', (time.time() - 1, delta))
+
+    def test_computes_once(self):
+        self.assertEqual(get_or_compute('feed_count:k', self.compute, 60), 1)
+        self.assertEqual(get_or_compute('feed_count:k', self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_while_revalidate(self):
+        """Пока другой процесс пересчитывает, отдаётся старое значение."""
+        get_or_compute('feed_count:k', self.compute, 60)
+        self.expire('feed_count:k')
+        cache.add('lock:feed_count:k', 1)
+        self.assertEqual(get_or_compute('feed_count:k', self.compute, 60), 1)
+        cache.delete('lock:feed_count:k')
+        self.assertEqual(get_or_compute('feed_count:k', self.compute, 60), 2)
+        self.assertFalse(cache.has_key('lock:feed_count:k'))
+
+    def test_foreign_lock_is_kept(self):
+        """Блокировку, которую уже взял другой процесс, не снимаем."""
+        def slow_compute():
+            # Наша блокировка истекла, её взял другой процесс.
+            cache.set('lock:feed_count:k', 'other')
+            return self.compute()
+
+        get_or_compute('feed_count:k', slow_compute, 60)
+        self.assertEqual(cache.get('lock:feed_count:k'), 'other')
+
+    def test_early_expiration(self):
+        """Дорогое значение пересчитывается до срока."""
+        get_or_compute('feed_count:k', self.compute, 60)
+        cache.set('feed_count:k:meta', (time.time() + 5, 10))
+        with mock.patch('core.cache.random.random', return_value=0.1):
+            get_or_compute('feed_count:k', self.compute, 60)
+        self.assertEqual(self.calls, 1)
+        with mock.patch('core.cache.random.random', return_value=0.99):
+            get_or_compute('feed_count:k', self.compute, 60)
+        self.assertEqual(self.calls, 2)
+
+    def test_missing_value_waits_for_lock_holder(self):
+        cache.add('lock:feed_count:k', 1)
+        with mock.patch(
+            'core.cache.time.sleep',
+            side_effect=lambda _: cache.set('feed_count:k', 'готово')
+        ):
+            value = get_or_compute('feed_count:k', self.compute, 60)
+        self.assertEqual(value, 'готово')
+        self.assertEqual(self.calls, 0)
+
+    @override_settings(CACHE_LOCK_WAIT=0)
+    def test_missing_value_computed_after_wait(self):
+        cache.add('lock:feed_count:k', 1)
+        self.assertEqual(get_or_compute('feed_count:k', self.compute, 60), 1)
+
+    def test_fragment_tag(self):
+        template = engines['django'].from_string(
+            '{% load fragment_cache %}{% cache 20 frag %}{{ n }}'
+            '{% endcache %}'
+        )
+        self.assertEqual(template.render({'n': 1}), '1')
+        self.assertEqual(template.render({'n': 2}), '1')
+        self.expire(make_template_fragment_key('frag'))
+        self.assertEqual(template.render({'n': 3}), '3')
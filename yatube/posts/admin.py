@@ -1,17 +1,24 @@
 from django.contrib import admin
 
-from .models import Comment, Follow, Group, Post
+from .models import Comment, Follow, Group, Notification, Post, PostImage
+
+
+class PostImageInline(admin.TabularInline):
+    model = PostImage
+    fields = ('image', 'position')
+    extra = 0
 
 
 class PostAdmin(admin.ModelAdmin):
     # Перечисляем поля, которые должны отображаться в админке
-    list_display = ('pk', 'text', 'pub_date', 'author', 'group')
+    list_display = ('pk', 'text', 'pub_date', 'author', 'group', 'views')
     list_editable = ('group',)
     # Добавляем интерфейс для поиска по тексту постов
     search_fields = ('text',)
     # Добавляем возможность фильтрации по дате
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
+    inlines = (PostImageInline,)
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -27,9 +34,17 @@ class FollowAdmin(admin.ModelAdmin):
     list_display = ('user', 'author')
 
 
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = (
+        'recipient', 'actor', 'kind', 'post', 'is_read', 'is_emailed'
+    )
+    list_filter = ('kind', 'is_read', 'is_emailed')
+
+
 # При регистрации модели Post источником конфигурации для неё назначаем
 # класс PostAdmin
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(Notification, NotificationAdmin)
@@ -0,0 +1,43 @@
+"""Постраничная выдача веток комментариев с курсором по пути.
+
+Комментарии идут в порядке обхода дерева (по ``Comment.path``), курсор -
+путь последнего показанного комментария. Первая страница комментариев
+поста хранится в кеше и сбрасывается при добавлении или удалении
+комментария.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Comment
+
+FIRST_PAGE_KEY = 'comments:first:{}'
+
+
+def comments_page(post_id, after=None):
+    """Возвращает комментарии после курсора ``after`` и курсор дальше."""
+    comments = Comment.objects.filter(post_id=post_id)
+    if after:
+        comments = comments.filter(path__gt=after)
+    per_page = settings.COMMENTS_PER_PAGE
+    comments = list(
+        comments.select_related('author').order_by('path')[:per_page + 1]
+    )
+    next_cursor = None
+    if len(comments) > per_page:
+        comments = comments[:per_page]
+        next_cursor = comments[-1].path
+    return comments, next_cursor
+
+
+def first_comments_page(post_id):
+    """Первая страница комментариев из кеша."""
+    key = FIRST_PAGE_KEY.format(post_id)
+    page = cache.get(key)
+    if page is None:
+        page = comments_page(post_id)
+        cache.set(key, page, settings.COMMENTS_CACHE_TIMEOUT)
+    return page
+
+
+def invalidate_first_page(post_id):
+    cache.delete(FIRST_PAGE_KEY.format(post_id))
@@ -0,0 +1,6 @@
+from .viewer import get_viewer
+
+
+def viewer(request):
+    """Добавляет переменную viewer - данные о смотрящем (posts.viewer)."""
+    return {'viewer': get_viewer(request)}
@@ -0,0 +1,116 @@
+"""Буфер счётчиков просмотров постов.
+
+Просмотры копятся в кеше по временным корзинам длиной
+VIEWS_FLUSH_INTERVAL секунд и попадают в ``Post.views`` пакетными UPDATE,
+по одному на каждое различное приращение. Запрос только увеличивает
+счётчики. Завершённые корзины сбрасывает в БД периодическая задача
+``flush_pending_views`` (TASKS_PERIODIC, её ставит runworker). Корзины
+ждут сброса, пока живут в кеше: KEPT_BUCKETS интервалов.
+
+Буфер работает только с кешем, общим для процессов: корзины из памяти
+процесса сайта воркер не увидит. С кешем в памяти процесса
+``record_view`` сразу увеличивает ``Post.views`` в БД.
+"""
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db.models import F
+
+from core.cache import is_process_local
+
+from .models import Post
+
+KEPT_BUCKETS = 10
+
+
+def _counter_key(bucket, post_id):
+    return f'views:{bucket}:post:{post_id}'
+
+
+def _index_key(bucket):
+    return f'views:{bucket}:count'
+
+
+def _slot_key(bucket, number):
+    return f'views:{bucket}:slot:{number}'
+
+
+def _timeout():
+    # Корзину должны успеть сбросить до того, как её вытеснит кеш.
+    return settings.VIEWS_FLUSH_INTERVAL * KEPT_BUCKETS
+
+
+def current_bucket():
+    return int(time.time() // settings.VIEWS_FLUSH_INTERVAL)
+
+
+def _incr(key):
+    cache.add(key, 0, _timeout())
+    return cache.incr(key)
+
+
+def is_buffered():
+    """Копятся ли просмотры в кеше или сразу пишутся в БД."""
+    return not is_process_local(DEFAULT_CACHE_ALIAS)
+
+
+def record_view(post_id):
+    """Учитывает просмотр поста, по возможности без записи в БД."""
+    if not is_buffered():
+        Post.objects.filter(pk=post_id).update(views=F('views') + 1)
+        return
+    bucket = current_bucket()
+    counter = _counter_key(bucket, post_id)
+    if not cache.add(counter, 1, _timeout()):
+        _incr(counter)
+        return
+    # Первый просмотр поста в корзине: запоминаем пост для сброса.
+    number = _incr(_index_key(bucket))
+    cache.set(_slot_key(bucket, number), post_id, _timeout())
+
+
+def pending_views(post_id):
+    """Просмотры поста, ещё не сброшенные в БД."""
+    bucket = current_bucket()
+    counters = cache.get_many([
+        _counter_key(bucket - 1, post_id), _counter_key(bucket, post_id)
+    ])
+    return sum(counters.values())
+
+
+def pending_buckets():
+    """Завершённые корзины, которые ещё не сброшены в БД."""
+    current = current_bucket()
+    buckets = range(current - KEPT_BUCKETS, current)
+    found = cache.get_many([_index_key(bucket) for bucket in buckets])
+    return [bucket for bucket in buckets if _index_key(bucket) in found]
+
+
+def flush_pending():
+    """Сбрасывает в БД все завершённые корзины. Возвращает число постов."""
+    return sum(flush_views(bucket) for bucket in pending_buckets())
+
+
+def flush_views(bucket):
+    """Сбрасывает просмотры корзины в БД. Возвращает число постов."""
+    if not cache.add(f'views:{bucket}:flushed', 1, _timeout()):
+        return 0
+    count = cache.get(_index_key(bucket), 0)
+    slot_keys = [_slot_key(bucket, number) for number in range(1, count + 1)]
+    post_ids = set(cache.get_many(slot_keys).values())
+    counter_keys = {pk: _counter_key(bucket, pk) for pk in post_ids}
+    counters = cache.get_many(list(counter_keys.values()))
+
+    by_increment = defaultdict(list)
+    for pk, key in counter_keys.items():
+        if counters.get(key):
+            by_increment[counters[key]].append(pk)
+    for increment, pks in by_increment.items():
+        Post.objects.filter(pk__in=pks).update(views=F('views') + increment)
+
+    cache.delete_many(
+        slot_keys + list(counter_keys.values()) + [_index_key(bucket)]
+    )
+    return len(post_ids)
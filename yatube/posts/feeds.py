@@ -0,0 +1,39 @@
+"""Ключи кеша, в которых хранится число постов в лентах."""
+from django.core.cache import cache
+
+from core.paginator import adjust_count
+
+
+def all_posts_key():
+    return 'feed_count:all'
+
+
+def group_posts_key(group_id):
+    return f'feed_count:group:{group_id}'
+
+
+def author_posts_key(author_id):
+    return f'feed_count:author:{author_id}'
+
+
+def follow_posts_key(user_id):
+    return f'feed_count:follow:{user_id}'
+
+
+def index_page_key(number):
+    """Посты страницы ``number`` главной ленты, общие для всех."""
+    return f'feed_page:all:{number}'
+
+
+def post_counts_changed(post, delta):
+    """Обновляет числа постов в лентах, куда попадает пост."""
+    adjust_count(all_posts_key(), delta)
+    adjust_count(author_posts_key(post.author_id), delta)
+    if post.group_id:
+        adjust_count(group_posts_key(post.group_id), delta)
+
+
+def follow_counts_changed(user_id):
+    # Ленту подписок пересчитываем заново: сдвиг на число постов автора
+    # стоил бы отдельного запроса.
+    cache.delete(follow_posts_key(user_id))
@@ -0,0 +1,85 @@
+"""Граф подписок с кешем смежности.
+
+Для каждого пользователя в кеше лежит множество id авторов, на которых он
+подписан. Проверка «подписан ли я на X», взаимные подписки и подсказки
+«кого почитать» считаются по этим множествам в памяти.
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Follow
+
+FOLLOWING_KEY = 'following:{}'
+
+
+def following_key(user_id):
+    return FOLLOWING_KEY.format(user_id)
+
+
+def following_map(user_ids):
+    """Возвращает {user_id: frozenset(author_id)} для списка пользователей.
+
+    Всё, чего нет в кеше, добирается одним запросом к БД.
+    """
+    user_ids = list(user_ids)
+    cached = cache.get_many([following_key(pk) for pk in user_ids])
+    result = {}
+    missing = []
+    for pk in user_ids:
+        ids = cached.get(following_key(pk))
+        if ids is None:
+            missing.append(pk)
+        else:
+            result[pk] = ids
+    if missing:
+        loaded = defaultdict(set)
+        for user_id, author_id in Follow.objects.filter(
+            user_id__in=missing
+        ).values_list('user_id', 'author_id'):
+            loaded[user_id].add(author_id)
+        fresh = {pk: frozenset(loaded[pk]) for pk in missing}
+        cache.set_many(
+            {following_key(pk): ids for pk, ids in fresh.items()},
+            settings.FOLLOW_CACHE_TIMEOUT
+        )
+        result.update(fresh)
+    return result
+
+
+def following_ids(user_id):
+    """Множество id авторов, на которых подписан пользователь."""
+    return following_map([user_id])[user_id]
+
+
+def invalidate_following(*user_ids):
+    cache.delete_many([following_key(pk) for pk in user_ids])
+
+
+def _neighbours(user_id):
+    following = following_ids(user_id)
+    # Ограничиваем обход, чтобы цена запроса не росла с числом подписок.
+    sample = sorted(following)[:settings.FOLLOW_GRAPH_FANOUT]
+    return following, following_map(sample)
+
+
+def mutual_follows(user_id):
+    """id пользователей, подписанных на пользователя взаимно."""
+    following, neighbours = _neighbours(user_id)
+    return {
+        pk for pk, ids in neighbours.items()
+        if user_id in ids and pk in following
+    }
+
+
+def suggestions(user_id, limit=None):
+    """id авторов, на которых чаще всего подписаны авторы пользователя."""
+    following, neighbours = _neighbours(user_id)
+    counter = Counter()
+    for ids in neighbours.values():
+        counter.update(ids)
+    for pk in following | {user_id}:
+        counter.pop(pk, None)
+    limit = limit or settings.FOLLOW_SUGGESTIONS
+    return [pk for pk, _ in counter.most_common(limit)]
@@ -1,6 +1,13 @@
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Max
 from django.forms import ModelForm
 
-from .models import Comment, Post
+from core.images import check_image
+
+from .images import image_meta, store_image, store_images
+from .models import Comment, Post, PostImage
 
 
 class PostForm(ModelForm):
@@ -8,6 +15,106 @@ class PostForm(ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def __init__(self, *args, upload_errors=None, upload_digests=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_errors = upload_errors or {}
+        self.upload_digests = upload_digests or {}
+
+    def clean_image(self):
+        """Отказ, если файл отброшен при приёме или не читается Pillow."""
+        if 'image' in self.upload_errors:
+            raise ValidationError(self.upload_errors['image'])
+        image = self.cleaned_data['image']
+        if image and 'image' in self.files:
+            check_image(image)
+        return image
+
+    def save(self, commit=True):
+        """Сохраняет новую картинку в хранилище и затем пост.
+
+        Картинка пишется только сюда, после проверки формы: отклонённая
+        форма ничего не оставляет в хранилище. Одинаковые картинки
+        сохраняются один раз (posts.images), размеры и заглушка
+        записываются в пост.
+        """
+        image = self.cleaned_data.get('image')
+        if image and 'image' in self.files:
+            digests = self.upload_digests.get('image') or [None]
+            name, meta = store_image(image, digests[0])
+            self.instance.image = name
+            self.set_image_meta(meta)
+        elif image is False:
+            self.set_image_meta(image_meta(None))
+        return super().save(commit)
+
+    def set_image_meta(self, meta):
+        for field, value in meta.items():
+            setattr(self.instance, field, value)
+
+
+class GalleryForm(forms.Form):
+    """Картинки галереи поста, несколько файлов в одном поле.
+
+    Отдельная форма, а не поле PostForm: у той ровно поля модели.
+    """
+    gallery = forms.FileField(
+        required=False,
+        widget=forms.ClearableFileInput(attrs={'multiple': True}),
+        label='Галерея',
+        help_text='Можно выбрать несколько картинок'
+    )
+
+    def __init__(self, *args, post=None, upload_errors=None,
+                 upload_digests=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.post = post
+        self.upload_errors = upload_errors or {}
+        self.upload_digests = upload_digests or {}
+
+    def clean_gallery(self):
+        """Проверяет число картинок и каждый файл, возвращает загрузки.
+
+        Вместе с уже добавленными в галерею поста ``post`` картинок
+        должно быть не больше POST_GALLERY_MAX_IMAGES. Каждый файл
+        открывается Pillow, как в ImageField.
+        """
+        if 'gallery' in self.upload_errors:
+            raise ValidationError(self.upload_errors['gallery'])
+        files = self.files.getlist('gallery') if self.files else []
+        existing = self.post.gallery.count() if self.post else 0
+        if files and existing + len(files) > settings.POST_GALLERY_MAX_IMAGES:
+            raise ValidationError(
+                f'Не больше {settings.POST_GALLERY_MAX_IMAGES} картинок '
+                'в галерее.'
+            )
+        for upload in files:
+            check_image(upload)
+        return files
+
+    def save(self, post):
+        """Сохраняет картинки и добавляет их в конец галереи поста.
+
+        Файлы пишутся в хранилище только здесь, после проверки обеих
+        форм. Возвращает созданные PostImage.
+        """
+        files = self.cleaned_data['gallery']
+        if not files:
+            return []
+        digests = self.upload_digests.get('gallery')
+        if not digests or len(digests) != len(files):
+            digests = None
+        last = post.gallery.aggregate(last=Max('position'))['last']
+        first = 0 if last is None else last + 1
+        return [
+            PostImage.objects.create(
+                post=post, image=name, position=position, **meta
+            )
+            for position, (name, meta) in enumerate(
+                store_images(files, digests), first
+            )
+        ]
+
 
 class CommentForm(ModelForm):
     class Meta:
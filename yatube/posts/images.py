@@ -0,0 +1,225 @@
+"""Картинки постов в хранилище по адресу от содержимого.
+
+Имя файла - SHA-256 загрузки: ``posts/ab/cd/abcd....jpg``. Повторная
+загрузка той же картинки не декодируется и не пишется заново, пост
+получает имя уже сохранённого файла вместе со всеми его миниатюрами.
+Посты держат ссылки на ``ImageBlob`` (см. signals), а файлы без ссылок
+удаляет ``python manage.py gc_images``. Новая картинка сразу попадает
+в индекс похожих (posts.similar).
+"""
+import hashlib
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F
+from django.utils import timezone
+from sorl.thumbnail import delete as delete_thumbnails
+
+from core.images import describe, dhash, normalize_image
+
+from .models import ImageBlob, ImageHash, Post, PostImage
+from .similar import save_hash
+
+
+def image_storage():
+    return Post._meta.get_field('image').storage
+
+
+def file_digest(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(digest, extension):
+    return f'posts/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def _write(uploaded, digest):
+    """Готовит и сохраняет новую картинку, не обращаясь к базе.
+
+    Вся тяжёлая работа с пикселями здесь, поэтому картинки одной
+    загрузки обрабатываются параллельно в потоках: Pillow отпускает GIL
+    на декодировании, масштабировании и сжатии.
+    """
+    normalized = normalize_image(uploaded)
+    _, extension = os.path.splitext(normalized.name)
+    name = blob_name(digest, extension.lower())
+    storage = image_storage()
+    if not storage.exists(name):
+        name = storage.save(name, normalized)
+    return name, dhash(normalized), describe(normalized)
+
+
+def _register(digest, name, value, description):
+    """Заводит ImageBlob для записанного файла, возвращает имя файла."""
+    width, height, placeholder = description
+    blob, created = ImageBlob.objects.get_or_create(
+        digest=digest, defaults={
+            'name': name, 'width': width, 'height': height,
+            'placeholder': placeholder
+        }
+    )
+    if created:
+        save_hash(blob.name, value)
+    elif blob.name != name:
+        # Ту же картинку параллельно сохранил другой запрос, и наш
+        # файл лёг рядом под другим именем. Строки у него нет, так
+        # что gc_images его не найдёт - удаляем сразу.
+        image_storage().delete(name)
+    return blob.name
+
+
+def store_images(files, digests=None):
+    """Сохраняет загрузки, возвращает [(имя в хранилище, поля картинки)].
+
+    ``digests`` - SHA-256 файлов, посчитанные при приёме; где хеша нет,
+    он считается здесь. Уже сохранённые картинки переиспользуются, новые
+    готовятся в IMAGE_UPLOAD_THREADS потоков. Поля картинки - размеры и
+    заглушка из ImageBlob, как в ``image_meta``.
+    """
+    digests = [
+        digest or file_digest(file)
+        for file, digest in zip(files, digests or [None] * len(files))
+    ]
+    names, metas = {}, {}
+    for digest, name, *description in ImageBlob.objects.filter(
+        digest__in=digests
+    ).values_list('digest', 'name', 'width', 'height', 'placeholder'):
+        names[digest] = name
+        metas[name] = _meta(*description)
+    if names:
+        # Отодвигаем сборку мусора: пост с этими картинками вот-вот появится.
+        ImageBlob.objects.filter(digest__in=names).update(
+            used_at=timezone.now()
+        )
+    missing = {}
+    for file, digest in zip(files, digests):
+        if digest not in names:
+            missing.setdefault(digest, file)
+
+    if len(missing) > 1:
+        workers = min(len(missing), settings.IMAGE_UPLOAD_THREADS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            written = list(
+                executor.map(_write, missing.values(), missing.keys())
+            )
+    else:
+        written = [_write(file, digest) for digest, file in missing.items()]
+
+    for digest, (name, value, description) in zip(missing, written):
+        names[digest] = _register(digest, name, value, description)
+        metas.setdefault(names[digest], _meta(*description))
+    for name in list(metas):
+        if metas[name]['image_width'] is None:
+            # Файл сохранён раньше, чем размеры стали писаться в ImageBlob.
+            metas[name] = image_meta(name)
+    return [(names[digest], metas[names[digest]]) for digest in digests]
+
+
+def store_image(uploaded, digest=None):
+    """Сохраняет одну загрузку, см. ``store_images``."""
+    return store_images([uploaded], [digest])[0]
+
+
+def _meta(width, height, placeholder):
+    return {'image_width': width, 'image_height': height,
+            'image_placeholder': placeholder}
+
+
+def image_meta(name):
+    """Поля поста с размерами и заглушкой картинки ``name``.
+
+    Данные берутся из ImageBlob по имени файла. Если их там ещё нет,
+    файл читается один раз, и результат записывается в ImageBlob.
+    """
+    if not name:
+        return _meta(None, None, '')
+    known = ImageBlob.objects.filter(
+        name=name, width__isnull=False
+    ).values_list('width', 'height', 'placeholder').first()
+    if known is not None:
+        return _meta(*known)
+    try:
+        with image_storage().open(name) as file:
+            width, height, placeholder = describe(file)
+    except (OSError, SyntaxError, ValueError):
+        return _meta(None, None, '')
+    ImageBlob.objects.filter(name=name).update(
+        width=width, height=height, placeholder=placeholder
+    )
+    return _meta(width, height, placeholder)
+
+
+def retain(name):
+    if name:
+        ImageBlob.objects.filter(name=name).update(
+            refcount=F('refcount') + 1, used_at=timezone.now()
+        )
+
+
+def release(name):
+    if name:
+        ImageBlob.objects.filter(name=name, refcount__gt=0).update(
+            refcount=F('refcount') - 1, used_at=timezone.now()
+        )
+
+
+def recount():
+    """Пересчитывает ссылки по постам и галереям. Возвращает число правок."""
+    counts = Counter()
+    for model in (Post, PostImage):
+        counts.update(dict(
+            model.objects.exclude(image='').values_list('image').annotate(
+                total=Count('pk')
+            ).order_by()
+        ))
+    fixed = 0
+    for blob in ImageBlob.objects.all():
+        actual = counts.get(blob.name, 0)
+        if blob.refcount != actual:
+            ImageBlob.objects.filter(pk=blob.pk).update(refcount=actual)
+            fixed += 1
+    return fixed
+
+
+def is_referenced(name):
+    return (
+        Post.objects.filter(image=name).exists()
+        or PostImage.objects.filter(image=name).exists()
+    )
+
+
+def collect_garbage(grace=None, dry_run=False):
+    """Удаляет картинки без ссылок вместе с миниатюрами.
+
+    Картинка должна пролежать без ссылок ``grace`` секунд: за это время
+    успевает сохраниться пост, для которого её только что загрузили.
+    Возвращает список удалённых имён.
+    """
+    if grace is None:
+        grace = settings.IMAGE_GC_GRACE
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    removed = []
+    orphans = ImageBlob.objects.filter(refcount=0, used_at__lt=cutoff)
+    for blob in orphans.iterator():
+        if is_referenced(blob.name):
+            continue
+        if dry_run:
+            removed.append(blob.name)
+            continue
+        # Строка удаляется, только если ссылок так и не появилось.
+        deleted, _ = ImageBlob.objects.filter(
+            pk=blob.pk, refcount=0, used_at__lt=cutoff
+        ).delete()
+        if deleted:
+            ImageHash.objects.filter(name=blob.name).delete()
+            delete_thumbnails(blob.name)
+            removed.append(blob.name)
+    return removed
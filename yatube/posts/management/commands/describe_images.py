@@ -0,0 +1,56 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.images import stored_description
+from core.pool import map_batches
+from posts.models import ImageBlob, Post
+
+
+class Command(BaseCommand):
+    help = ('Записывает в посты размеры и превью-заглушки картинок, '
+            'загруженных до появления этих полей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; 1 - считать в текущем процессе.'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=500,
+            help='Сколько картинок записывать в базу за раз.'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать и уже описанные картинки.'
+        )
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image='')
+        if not options['all']:
+            names = names.filter(image_width__isnull=True)
+        names = names.values_list('image', flat=True).distinct().order_by()
+
+        described = failed = 0
+        for results in map_batches(
+            stored_description, names.iterator(),
+            options['workers'], options['batch']
+        ):
+            with transaction.atomic():
+                for name, width, height, placeholder in results:
+                    if width is None:
+                        self.stderr.write(f'Не удалось прочитать {name}')
+                        failed += 1
+                        continue
+                    ImageBlob.objects.filter(name=name).update(
+                        width=width, height=height, placeholder=placeholder
+                    )
+                    described += Post.objects.filter(image=name).update(
+                        image_width=width,
+                        image_height=height,
+                        image_placeholder=placeholder
+                    )
+        self.stdout.write(
+            f'Обновлено постов: {described}, ошибок: {failed}.'
+        )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import collect_garbage, recount
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки постов, на которые не осталось ссылок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=None,
+            help='Сколько секунд картинка должна пролежать без ссылок '
+                 '(по умолчанию IMAGE_GC_GRACE).'
+        )
+        parser.add_argument(
+            '--recount', action='store_true',
+            help='Сначала пересчитать ссылки по таблице постов.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.'
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            fixed = recount()
+            self.stdout.write(f'Исправлено счётчиков ссылок: {fixed}.')
+        removed = collect_garbage(options['grace'], options['dry_run'])
+        for name in removed:
+            self.stdout.write(name)
+        verb = 'К удалению' if options['dry_run'] else 'Удалено'
+        self.stdout.write(f'{verb} картинок: {len(removed)}.')
@@ -0,0 +1,61 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from core.images import stored_dhash
+from core.pool import map_batches
+from posts.models import ImageHash, Post, PostImage
+from posts.similar import bands
+
+
+class Command(BaseCommand):
+    help = ('Считает перцептивные хеши картинок постов и галерей, '
+            'которых нет в индексе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; 1 - считать в текущем процессе.'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=500,
+            help='Сколько картинок записывать в базу за раз.'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать и уже проиндексированные картинки.'
+        )
+
+    def handle(self, *args, **options):
+        sources = [Post.objects.exclude(image=''), PostImage.objects.all()]
+        if options['all']:
+            ImageHash.objects.all().delete()
+        else:
+            indexed = ImageHash.objects.values('name')
+            sources = [
+                queryset.exclude(image__in=indexed) for queryset in sources
+            ]
+        # union убирает повторы: один файл бывает и у поста, и в галерее.
+        posts, gallery = [
+            queryset.values_list('image', flat=True).order_by()
+            for queryset in sources
+        ]
+        names = posts.union(gallery)
+
+        indexed = failed = 0
+        for results in map_batches(
+            stored_dhash, names.iterator(),
+            options['workers'], options['batch']
+        ):
+            hashes = []
+            for name, value in results:
+                if value is None:
+                    self.stderr.write(f'Не удалось прочитать {name}')
+                    failed += 1
+                    continue
+                hashes.append(ImageHash(name=name, **bands(value)))
+            ImageHash.objects.bulk_create(hashes, ignore_conflicts=True)
+            indexed += len(hashes)
+        self.stdout.write(
+            f'Проиндексировано картинок: {indexed}, ошибок: {failed}.'
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.ranking import recompute_scores
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинг всех постов для ленты «Популярное».'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk', type=int, default=1000,
+            help='Сколько постов пересчитывать за один заход.'
+        )
+
+    def handle(self, *args, **options):
+        chunk = options['chunk']
+        last_pk = 0
+        total = 0
+        while True:
+            pks = list(
+                Post.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:chunk]
+            )
+            if not pks:
+                break
+            total += recompute_scores(Post.objects.filter(pk__in=pks))
+            last_pk = pks[-1]
+        self.stdout.write(f'Пересчитано постов: {total}.')
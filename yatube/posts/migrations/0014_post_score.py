@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_follow_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='score',
+            field=models.FloatField(db_index=True, default=0, editable=False, verbose_name='Рейтинг'),
+        ),
+    ]
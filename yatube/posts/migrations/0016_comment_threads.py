@@ -0,0 +1,59 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+PATH_STEP = 8
+PATH_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk):
+    segment = ''
+    while pk:
+        pk, digit = divmod(pk, len(PATH_ALPHABET))
+        segment = PATH_ALPHABET[digit] + segment
+    return segment.rjust(PATH_STEP, '0')
+
+
+def fill_paths(apps, schema_editor):
+    # До этой миграции все комментарии были верхнего уровня.
+    Comment = apps.get_model('posts', 'Comment')
+    for comment in Comment.objects.only('pk').iterator():
+        Comment.objects.filter(pk=comment.pk).update(
+            path=path_segment(comment.pk)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Глубина'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.Comment', verbose_name='Ответ на'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Путь в ветке'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Ответов в ветке'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='posts_comme_post_id_abd11d_idx'),
+        ),
+    ]
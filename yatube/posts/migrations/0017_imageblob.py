@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_comment_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 загрузки')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла в хранилище')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+                ('used_at', models.DateTimeField(auto_now_add=True, verbose_name='Последнее использование')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='imageblob',
+            index=models.Index(fields=['refcount', 'used_at'], name='posts_image_refcoun_94dfeb_idx'),
+        ),
+    ]
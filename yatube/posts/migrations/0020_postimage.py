@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-19 19:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_image_meta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='posts/', verbose_name='Картинка')),
+                ('position', models.PositiveSmallIntegerField(default=0, verbose_name='Порядок')),
+                ('image_width', models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки')),
+                ('image_height', models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки')),
+                ('image_placeholder', models.TextField(blank=True, editable=False, verbose_name='Превью-заглушка картинки')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gallery', to='posts.Post', verbose_name='Пост')),
+            ],
+            options={
+                'ordering': ['position', 'pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='postimage',
+            index=models.Index(fields=['post', 'position'], name='posts_posti_post_id_d88342_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.2.28 on 2026-10-19 20:14
+
+from django.db import migrations, models
+
+
+def copy_meta(apps, schema_editor):
+    # Размеры уже описанных картинок есть у постов и галерей.
+    ImageBlob = apps.get_model('posts', 'ImageBlob')
+    for model in (apps.get_model('posts', 'Post'),
+                  apps.get_model('posts', 'PostImage')):
+        described = model.objects.filter(
+            image__in=ImageBlob.objects.filter(
+                width__isnull=True
+            ).values('name'),
+            image_width__isnull=False
+        ).values_list(
+            'image', 'image_width', 'image_height', 'image_placeholder'
+        ).distinct().order_by()
+        for name, width, height, placeholder in described.iterator():
+            ImageBlob.objects.filter(name=name, width__isnull=True).update(
+                width=width, height=height, placeholder=placeholder
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_postimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Высота'),
+        ),
+        migrations.AddField(
+            model_name='imageblob',
+            name='placeholder',
+            field=models.TextField(blank=True, verbose_name='Превью-заглушка'),
+        ),
+        migrations.AddField(
+            model_name='imageblob',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Ширина'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, upload_to='posts/', verbose_name='Картинка'),
+        ),
+        migrations.AlterField(
+            model_name='postimage',
+            name='image',
+            field=models.ImageField(db_index=True, upload_to='posts/', verbose_name='Картинка'),
+        ),
+        migrations.RunPython(copy_meta, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,6 @@
 from core.models import CreatedModel
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
 from django.db.models import UniqueConstraint
 
 User = get_user_model()
@@ -40,7 +40,38 @@ class Post(CreatedModel):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
-        blank=True
+        blank=True,
+        db_index=True
+    )
+    # Размеры и превью-заглушка картинки считаются при загрузке
+    # (core.images.describe), чтобы лента не открывала файлы.
+    image_width = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Ширина картинки'
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Высота картинки'
+    )
+    image_placeholder = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Превью-заглушка картинки'
+    )
+    views = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Просмотры'
+    )
+    score = models.FloatField(
+        default=0,
+        db_index=True,
+        editable=False,
+        verbose_name='Рейтинг'
     )
 
     class Meta:
@@ -51,6 +82,16 @@ class Post(CreatedModel):
 
 
 class Comment(CreatedModel):
+    """Класс Comment описывает модель Комментариев в БД.
+
+    Ветки ответов хранятся материализованным путём: ``path`` - это id всех
+    предков и самого комментария, каждый в PATH_STEP символах base36.
+    Сортировка по ``path`` даёт дерево в порядке обхода, а поддерево
+    читается одним запросом по диапазону индекса.
+    """
+    PATH_STEP = 8
+    PATH_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
@@ -70,6 +111,84 @@ class Comment(CreatedModel):
         verbose_name='Текст комментария',
         help_text='Введите текст комментария'
     )
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name='replies',
+        verbose_name='Ответ на'
+    )
+    path = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        verbose_name='Путь в ветке'
+    )
+    depth = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Глубина'
+    )
+    reply_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Ответов в ветке'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path']),
+        ]
+
+    @classmethod
+    def path_segment(cls, pk):
+        segment = ''
+        while pk:
+            pk, digit = divmod(pk, len(cls.PATH_ALPHABET))
+            segment = cls.PATH_ALPHABET[digit] + segment
+        return segment.rjust(cls.PATH_STEP, '0')
+
+    @property
+    def ancestor_ids(self):
+        step = self.PATH_STEP
+        return [
+            int(self.path[i:i + step], len(self.PATH_ALPHABET))
+            for i in range(0, len(self.path) - step, step)
+        ]
+
+    def subtree(self, max_depth=None):
+        """Комментарий и все ответы на него одним запросом."""
+        comments = Comment.objects.filter(
+            post_id=self.post_id,
+            path__gte=self.path,
+            path__lt=self.path + '~'
+        )
+        if max_depth is not None:
+            comments = comments.filter(depth__lte=self.depth + max_depth)
+        return comments.order_by('path')
+
+    def save(self, *args, **kwargs):
+        creating = self.pk is None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if creating:
+                self._attach()
+
+    def _attach(self):
+        prefix = self.parent.path if self.parent_id else ''
+        self.path = prefix + self.path_segment(self.pk)
+        self.depth = self.parent.depth + 1 if self.parent_id else 0
+        Comment.objects.filter(pk=self.pk).update(
+            path=self.path, depth=self.depth
+        )
+        if self.parent_id:
+            Comment.objects.filter(pk__in=self.ancestor_ids).update(
+                reply_count=models.F('reply_count') + 1
+            )
+
+    def __str__(self) -> str:
+        return self.text[:15]
 
 
 class Follow(models.Model):
@@ -87,9 +206,181 @@ class Follow(models.Model):
     )
 
     class Meta:
-        constraints = UniqueConstraint(
+        constraints = [UniqueConstraint(
             fields=['user', 'author'], name='unique_following'
-        )
+        )]
 
     def __str__(self) -> str:
         return f'user: {self.user}, author: {self.author}'
+
+
+class Notification(CreatedModel):
+    """Класс Notification описывает уведомление пользователя в БД."""
+    NEW_POST = 'new_post'
+    NEW_COMMENT = 'new_comment'
+    KIND_CHOICES = (
+        (NEW_POST, 'Новый пост автора'),
+        (NEW_COMMENT, 'Новый комментарий к посту'),
+    )
+
+    recipient = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='notifications',
+        verbose_name='Получатель'
+    )
+    actor = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Инициатор'
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        verbose_name='Тип'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Пост'
+    )
+    comment = models.ForeignKey(
+        Comment,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name='+',
+        verbose_name='Комментарий'
+    )
+    is_read = models.BooleanField(default=False, verbose_name='Прочитано')
+    is_emailed = models.BooleanField(
+        default=False,
+        verbose_name='Отправлено в дайджесте'
+    )
+
+    class Meta:
+        ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['recipient', 'is_read']),
+            models.Index(fields=['is_emailed', 'pub_date']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.recipient}: {self.get_kind_display()}'
+
+
+class PostImage(models.Model):
+    """Картинка галереи поста; ``position`` задаёт порядок показа."""
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='gallery',
+        verbose_name='Пост'
+    )
+    image = models.ImageField(
+        verbose_name='Картинка',
+        upload_to='posts/',
+        db_index=True
+    )
+    position = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Порядок'
+    )
+    image_width = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Ширина картинки'
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Высота картинки'
+    )
+    image_placeholder = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Превью-заглушка картинки'
+    )
+
+    class Meta:
+        ordering = ['position', 'pk']
+        indexes = [
+            models.Index(fields=['post', 'position']),
+        ]
+
+    def __str__(self) -> str:
+        return self.image.name
+
+
+class ImageBlob(CreatedModel):
+    """Картинка в хранилище, адрес которой получен из её содержимого.
+
+    Одинаковые загрузки ссылаются на один файл, ``refcount`` - сколько
+    постов его используют. Размеры и заглушка считаются один раз при
+    сохранении файла и копируются в посты и галереи.
+    """
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name='SHA-256 загрузки'
+    )
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Имя файла в хранилище'
+    )
+    refcount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число ссылок'
+    )
+    used_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Последнее использование'
+    )
+    width = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Ширина'
+    )
+    height = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Высота'
+    )
+    placeholder = models.TextField(
+        blank=True,
+        verbose_name='Превью-заглушка'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount', 'used_at']),
+        ]
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class ImageHash(models.Model):
+    """Перцептивный хеш картинки (dHash, 64 бита), разбитый на 4 полосы.
+
+    Каждая 16-битная полоса проиндексирована: у картинок на расстоянии
+    Хэмминга не больше d хотя бы одна полоса отличается не больше чем
+    на d // 4 бит, так что кандидаты находятся по индексам (posts.similar).
+    """
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Имя файла в хранилище'
+    )
+    band0 = models.PositiveIntegerField(db_index=True)
+    band1 = models.PositiveIntegerField(db_index=True)
+    band2 = models.PositiveIntegerField(db_index=True)
+    band3 = models.PositiveIntegerField(db_index=True)
+
+    def __str__(self) -> str:
+        return self.name
@@ -0,0 +1,62 @@
+"""Рейтинг постов для ленты «Популярное».
+
+Рейтинг устроен как у «горячих» лент: логарифм вовлечённости плюс время
+публикации, делённое на POPULAR_DECAY. Каждые POPULAR_DECAY секунд новизны
+весят столько же, сколько десятикратный рост вовлечённости, то есть старые
+посты затухают экспоненциально. Временная часть не меняется со временем,
+поэтому пересчитывать рейтинг нужно только при изменении вовлечённости, а
+лента читается по индексу колонки ``score``.
+"""
+import math
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Follow, Post
+
+
+def hot_score(comments, followers, pub_date):
+    engagement = (
+        1
+        + comments * settings.POPULAR_COMMENT_WEIGHT
+        + followers * settings.POPULAR_FOLLOWER_WEIGHT
+    )
+    return (
+        math.log10(engagement)
+        + pub_date.timestamp() / settings.POPULAR_DECAY
+    )
+
+
+def initial_score(post):
+    """Рейтинг нового поста: комментариев ещё нет, подписчики автора есть.
+
+    Без него пост, созданный в обход обработчиков (админка, shell,
+    фикстуры), остался бы с нулём в самом низу ленты.
+    """
+    followers = Follow.objects.filter(author_id=post.author_id).count()
+    return hot_score(0, followers, post.pub_date or timezone.now())
+
+
+def recompute_scores(posts):
+    """Пересчитывает и сохраняет рейтинг постов из queryset."""
+    posts = list(
+        posts.annotate(comment_count=Count('comments')).only(
+            'pk', 'pub_date', 'author_id', 'score'
+        )
+    )
+    if not posts:
+        return 0
+    followers = dict(
+        Follow.objects.filter(
+            author_id__in={post.author_id for post in posts}
+        ).values_list('author_id').annotate(count=Count('id'))
+    )
+    for post in posts:
+        post.score = hot_score(
+            post.comment_count,
+            followers.get(post.author_id, 0),
+            post.pub_date
+        )
+    Post.objects.bulk_update(posts, ['score'], batch_size=500)
+    return len(posts)
@@ -0,0 +1,102 @@
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .comments import invalidate_first_page
+from .feeds import follow_counts_changed, group_posts_key, post_counts_changed
+from .follows import invalidate_following
+from .images import release, retain
+from .models import Comment, Follow, Post, PostImage
+from .ranking import initial_score
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    """Сбрасывает кеш подписок при изменении подписки."""
+    invalidate_following(instance.user_id)
+    follow_counts_changed(instance.user_id)
+
+
+@receiver(pre_save, sender=Post)
+def post_scored(sender, instance, **kwargs):
+    """Сразу даёт новому посту рейтинг, не дожидаясь воркера."""
+    if instance._state.adding and not instance.score:
+        instance.score = initial_score(instance)
+
+
+@receiver(post_init, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    # Отложенное поле не читаем, как и в remember_image.
+    instance._saved_group_id = instance.__dict__.get('group_id')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    """Обновляет закешированные числа постов в лентах."""
+    group_id = instance.__dict__.get('group_id', instance._saved_group_id)
+    if created:
+        post_counts_changed(instance, 1)
+    elif group_id != instance._saved_group_id:
+        # Пост сменил группу: числа постов в старой и новой группе
+        # пересчитаем заново.
+        cache.delete_many([
+            group_posts_key(pk)
+            for pk in (instance._saved_group_id, group_id)
+            if pk is not None
+        ])
+    instance._saved_group_id = group_id
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    post_counts_changed(instance, -1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    """Сбрасывает закешированную первую страницу комментариев."""
+    invalidate_first_page(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """Уменьшает счётчик ответов у предков удалённого комментария."""
+    if instance.parent_id:
+        Comment.objects.filter(pk__in=instance.ancestor_ids).update(
+            reply_count=F('reply_count') - 1
+        )
+
+
+def _image_name(post):
+    # Отложенное поле (.only/.defer) не читаем, чтобы не делать запрос.
+    value = post.__dict__.get('image')
+    return getattr(value, 'name', value)
+
+
+@receiver(post_init, sender=Post)
+@receiver(post_init, sender=PostImage)
+def remember_image(sender, instance, **kwargs):
+    instance._saved_image = _image_name(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=PostImage)
+def image_saved(sender, instance, created, **kwargs):
+    """Переносит ссылку поста или галереи со старой картинки на новую."""
+    name = _image_name(instance)
+    if created:
+        retain(name)
+    elif name is not None and name != instance._saved_image:
+        retain(name)
+        release(instance._saved_image)
+    instance._saved_image = name
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=PostImage)
+def image_deleted(sender, instance, **kwargs):
+    release(_image_name(instance))
@@ -0,0 +1,98 @@
+"""Поиск похожих картинок по перцептивному хешу.
+
+Хеш (core.images.dhash) хранится в ``ImageHash`` четырьмя 16-битными
+полосами с индексами - это multi-index hashing. Если два хеша
+отличаются не больше чем на d бит, то по принципу Дирихле хотя бы одна
+полоса отличается не больше чем на d // 4 бит. Поэтому кандидаты
+выбираются по индексам полос (все значения в радиусе d // 4 от полосы
+запроса), а точное расстояние считается только для них.
+"""
+from itertools import combinations
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import ImageHash
+
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def split(value):
+    """Полосы хеша от старших бит к младшим."""
+    return [
+        value >> (BAND_BITS * (BANDS - 1 - index)) & BAND_MASK
+        for index in range(BANDS)
+    ]
+
+
+def join(bands):
+    value = 0
+    for band in bands:
+        value = value << BAND_BITS | band
+    return value
+
+
+def distance(first, second):
+    return bin(first ^ second).count('1')
+
+
+def neighbours(band, radius):
+    """Все значения полосы, отличающиеся от ``band`` не больше чем на
+    ``radius`` бит."""
+    values = [band]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), flips):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            values.append(band ^ mask)
+    return values
+
+
+def bands(value):
+    """Поля ``ImageHash`` для хеша."""
+    return {f'band{index}': band for index, band in enumerate(split(value))}
+
+
+def save_hash(name, value):
+    ImageHash.objects.update_or_create(name=name, defaults=bands(value))
+
+
+def find_similar(value, max_distance=None, exclude=None):
+    """Картинки на расстоянии не больше ``max_distance`` от хеша.
+
+    Возвращает [(имя, расстояние)] от самых похожих. По умолчанию
+    расстояние - IMAGE_SIMILAR_DISTANCE.
+    """
+    if max_distance is None:
+        max_distance = settings.IMAGE_SIMILAR_DISTANCE
+    radius = max_distance // BANDS
+    query = Q()
+    for index, band in enumerate(split(value)):
+        query |= Q(**{f'band{index}__in': neighbours(band, radius)})
+    candidates = ImageHash.objects.filter(query)
+    if exclude:
+        candidates = candidates.exclude(name=exclude)
+    found = []
+    for name, *bands in candidates.values_list(
+        'name', 'band0', 'band1', 'band2', 'band3'
+    ):
+        bits = distance(value, join(bands))
+        if bits <= max_distance:
+            found.append((name, bits))
+    found.sort(key=lambda item: (item[1], item[0]))
+    return found
+
+
+def similar_to(name, max_distance=None):
+    """Картинки, похожие на уже проиндексированную ``name``."""
+    image_hash = ImageHash.objects.filter(name=name).first()
+    if image_hash is None:
+        return []
+    value = join([
+        image_hash.band0, image_hash.band1,
+        image_hash.band2, image_hash.band3,
+    ])
+    return find_similar(value, max_distance, exclude=name)
@@ -0,0 +1,176 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
+
+from core.tasks import enqueue_batched, task
+
+from .counters import flush_pending
+from .models import Comment, Follow, Notification, Post, PostImage
+from .ranking import recompute_scores
+
+# Параметры миниатюры, с которыми картинку выводят шаблоны
+THUMBNAIL_GEOMETRY = '960x339'
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+GALLERY_THUMBNAIL_GEOMETRY = '300x300'
+GALLERY_THUMBNAIL_OPTIONS = {'crop': 'center'}
+
+
+@task
+def warm_thumbnail(post_id):
+    """Заранее создаёт миниатюру картинки поста."""
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None or not post.image:
+        return
+    get_thumbnail(post.image, THUMBNAIL_GEOMETRY, **THUMBNAIL_OPTIONS)
+
+
+@task
+def warm_gallery_thumbnail(image_id):
+    """Заранее создаёт миниатюру картинки галереи.
+
+    Задача ставится на каждую картинку отдельно, так что миниатюры
+    галереи делят между собой все исполнители воркера.
+    """
+    item = PostImage.objects.filter(pk=image_id).first()
+    if item is None:
+        return
+    get_thumbnail(
+        item.image, GALLERY_THUMBNAIL_GEOMETRY, **GALLERY_THUMBNAIL_OPTIONS
+    )
+
+
+@task
+def notify_followers(post_id):
+    """Создаёт подписчикам автора уведомления о новом посте.
+
+    Подписчики читаются и уведомления пишутся пачками по
+    NOTIFICATIONS_BATCH_SIZE, так что память задачи не растёт с числом
+    подписчиков.
+    """
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None:
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).order_by('user_id').values_list('user_id', flat=True)
+    batch_size = settings.NOTIFICATIONS_BATCH_SIZE
+    last_id = 0
+    with transaction.atomic():
+        while True:
+            batch = list(followers.filter(user_id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            Notification.objects.bulk_create([
+                Notification(
+                    recipient_id=user_id,
+                    actor_id=post.author_id,
+                    kind=Notification.NEW_POST,
+                    post=post
+                )
+                for user_id in batch
+            ])
+            last_id = batch[-1]
+    schedule_digest()
+
+
+@task
+def notify_post_author(comment_id):
+    """Создаёт автору поста уведомление о новом комментарии."""
+    comment = Comment.objects.select_related('post').filter(
+        pk=comment_id
+    ).first()
+    if comment is None or comment.author_id == comment.post.author_id:
+        return
+    Notification.objects.create(
+        recipient_id=comment.post.author_id,
+        actor_id=comment.author_id,
+        kind=Notification.NEW_COMMENT,
+        post_id=comment.post_id,
+        comment=comment
+    )
+    schedule_digest()
+
+
+def schedule_digest():
+    """Ставит рассылку дайджеста на конец текущего временного окна."""
+    enqueue_batched(
+        send_digests,
+        key='digest',
+        window=settings.NOTIFICATIONS_DIGEST_WINDOW
+    )
+
+
+@task
+def send_digests():
+    """Отправляет накопившиеся уведомления, одно письмо на пользователя.
+
+    Все письма рассылки уходят через одно соединение с почтовым сервером.
+    Уведомления получателя помечаются отправленными сразу после его
+    письма, так что повтор упавшей рассылки не шлёт письма дважды.
+    """
+    pending = Notification.objects.filter(is_emailed=False)
+    last_pk = pending.order_by('-pk').values_list('pk', flat=True).first()
+    if last_pk is None:
+        return
+    pending = pending.filter(pk__lte=last_pk)
+    recipient_ids = list(
+        pending.values_list('recipient_id', flat=True).distinct().order_by()
+    )
+    batch_size = settings.NOTIFICATIONS_BATCH_SIZE
+    with get_connection() as connection:
+        for start in range(0, len(recipient_ids), batch_size):
+            batch = pending.filter(
+                recipient_id__in=recipient_ids[start:start + batch_size]
+            ).select_related(
+                'recipient', 'actor', 'post'
+            ).order_by('recipient_id', 'pub_date')
+            for recipient, notifications in groupby(
+                list(batch), key=lambda n: n.recipient
+            ):
+                if recipient.email:
+                    send_digest(connection, recipient, list(notifications))
+                pending.filter(recipient=recipient).update(is_emailed=True)
+
+
+def send_digest(connection, recipient, notifications):
+    context = {
+        'recipient': recipient,
+        'notifications': notifications,
+    }
+    connection.send_messages([EmailMessage(
+        subject=render_to_string(
+            'posts/email/digest_subject.txt', context
+        ).strip(),
+        body=render_to_string('posts/email/digest.txt', context),
+        to=[recipient.email],
+        connection=connection
+    )])
+
+
+@task
+def update_post_score(post_id):
+    """Пересчитывает рейтинг поста."""
+    recompute_scores(Post.objects.filter(pk=post_id))
+
+
+@task
+def update_author_scores(author_id):
+    """Пересчитывает рейтинг свежих постов автора."""
+    since = timezone.now() - timedelta(
+        seconds=settings.POPULAR_RECOMPUTE_WINDOW
+    )
+    recompute_scores(
+        Post.objects.filter(author_id=author_id, pub_date__gte=since)
+    )
+
+
+@task
+def flush_pending_views():
+    """Сбрасывает в БД просмотры из завершённых корзин (posts.counters)."""
+    flush_pending()
@@ -1,14 +1,30 @@
+import hashlib
+import os
 import shutil
 import tempfile
 from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image, ImageFilter
 
-from ..models import Group, Post
+from core.images import describe, dhash
+from core.models import Task
+
+from ..images import _write, blob_name, collect_garbage, image_storage
+from ..models import Group, ImageBlob, ImageHash, Post, PostImage
+from ..similar import find_similar, save_hash, similar_to
 
 User = get_user_model()
 
@@ -171,8 +187,539 @@ class PostImagesTests(TestCase):
         self.assertEqual(self.user, first_post.author)
         self.assertEqual(self.post.group, first_post.group)
         self.assertEqual(
-            'posts/' + form_data['image'].name, first_post.image
+            blob_name(hashlib.sha256(small_gif).hexdigest(), '.gif'),
+            first_post.image.name
+        )
+
+
+def make_image(size, image_format='JPEG', mode='RGB', exif=None):
+    image = Image.new(mode, size, 'red')
+    output = BytesIO()
+    options = {'exif': exif.tobytes()} if exif is not None else {}
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_SIDE=100)
+class ImageIngestTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, name, content):
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Пост с картинкой',
+                'image': SimpleUploadedFile(name, content)
+            }
+        )
+
+    def test_large_photo_is_downscaled_and_rotated(self):
+        """Большое фото ужимается, поворачивается по EXIF и теряет EXIF."""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # повернуть на 90° по часовой
+        exif[0x010F] = 'Phone'
+        self.upload('photo.jpeg', make_image((400, 200), exif=exif))
+        post = Post.objects.get()
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.size, (50, 100))
+            self.assertEqual(image.format, 'JPEG')
+            self.assertNotIn('exif', image.info)
+
+    def test_transparent_image_stays_png(self):
+        """Картинка с прозрачностью пережимается в PNG."""
+        self.upload('logo.png', make_image((300, 300), 'PNG', 'RGBA'))
+        post = Post.objects.get()
+        with Image.open(post.image) as image:
+            self.assertEqual(image.format, 'PNG')
+            self.assertEqual(image.size, (100, 100))
+
+    def test_small_clean_image_is_kept(self):
+        """Маленькая картинка без EXIF сохраняется байт в байт."""
+        content = make_image((50, 40), 'PNG')
+        self.upload('small.png', content)
+        post = Post.objects.get()
+        with post.image.open() as image:
+            self.assertEqual(image.read(), content)
+
+    def test_rejected_uploads(self):
+        """Не картинки и слишком большие файлы отбрасываются при приёме."""
+        cases = [
+            ('fake.png', b'<html>not an image</html>', 'Загрузите'),
+            ('huge.png', make_image((20, 20), 'PNG') + b'\0' * 2048,
+             'Файл больше'),
+        ]
+        for name, content, error in cases:
+            with self.subTest(name=name), \
+                    self.settings(IMAGE_UPLOAD_MAX_SIZE=1024):
+                response = self.upload(name, content)
+                self.assertContains(response, error)
+                self.assertFalse(Post.objects.exists())
+
+    def test_oversized_image_is_form_error(self):
+        """Картинка больше IMAGE_MAX_PIXELS - ошибка формы, а не 500."""
+        with self.settings(IMAGE_MAX_PIXELS=100):
+            response = self.upload('wide.png', make_image((20, 20), 'PNG'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Слишком большая картинка.')
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(CSRF_FAILURE_VIEW='django.views.csrf.csrf_failure')
+    def test_upload_views_keep_csrf(self):
+        """Формы постов по-прежнему проверяют CSRF."""
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(
+            reverse('posts:post_create'), data={'text': 'Пост'}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Post.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageDeduplicationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+        cls.content = make_image((30, 20), 'PNG')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, name, url=None):
+        self.authorized_client.post(
+            url or reverse('posts:post_create'),
+            data={
+                'text': 'Пост с картинкой',
+                'image': SimpleUploadedFile(name, self.content)
+            }
+        )
+
+    def test_duplicate_upload_reuses_file(self):
+        """Повторная загрузка той же картинки ссылается на тот же файл."""
+        self.upload('meme.png')
+        self.upload('repost.png')
+        first, second = Post.objects.all()
+        self.assertEqual(first.image.name, second.image.name)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.name, first.image.name)
+        self.assertEqual(blob.refcount, 2)
+        folder = os.path.join(TEMP_MEDIA_ROOT, os.path.dirname(blob.name))
+        self.assertEqual(len(os.listdir(folder)), 1)
+
+    def test_rejected_form_stores_nothing(self):
+        """Картинка из отклонённой формы не попадает в хранилище."""
+        other = User.objects.create_user(username='Other')
+        post = Post.objects.create(text='Чужой пост', author=other)
+        self.content = make_image((13, 7), 'PNG')
+        name = blob_name(hashlib.sha256(self.content).hexdigest(), '.png')
+        self.upload('meme.png', reverse('posts:post_edit', args=[post.pk]))
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'image': SimpleUploadedFile('meme.png', self.content)}
+        )
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(image_storage().exists(name))
+
+    def test_concurrent_duplicate_is_removed(self):
+        """Копия, проигравшая гонку одинаковых загрузок, удаляется."""
+        def racing_write(uploaded, digest):
+            # Другой запрос успел сохранить ту же картинку, наш файл
+            # лёг рядом под другим именем.
+            name, value, meta = _write(uploaded, digest)
+            ImageBlob.objects.create(digest=digest, name=name)
+            copy = image_storage().save(name, ContentFile(self.content))
+            return copy, value, meta
+
+        with mock.patch('posts.images._write', racing_write):
+            self.upload('meme.png')
+        post = Post.objects.get()
+        blob = ImageBlob.objects.get()
+        self.assertEqual(post.image.name, blob.name)
+        folder = os.path.join(TEMP_MEDIA_ROOT, os.path.dirname(blob.name))
+        self.assertEqual(os.listdir(folder), [os.path.basename(blob.name)])
+
+    def test_refcount_follows_posts(self):
+        """Смена картинки и удаление поста отпускают ссылку."""
+        self.upload('meme.png')
+        post = Post.objects.get()
+        self.content = make_image((10, 10), 'PNG')
+        self.upload(
+            'other.png', reverse('posts:post_edit', args=[post.pk])
+        )
+        post.refresh_from_db()
+        counts = dict(ImageBlob.objects.values_list('name', 'refcount'))
+        self.assertEqual(sorted(counts.values()), [0, 1])
+        self.assertEqual(counts[post.image.name], 1)
+        post.delete()
+        self.assertEqual(ImageBlob.objects.filter(refcount=0).count(), 2)
+
+    def test_gc_removes_orphans(self):
+        """Сборщик удаляет картинки без ссылок вместе с файлами."""
+        self.upload('meme.png')
+        post = Post.objects.get()
+        name = post.image.name
+        self.assertEqual(collect_garbage(grace=0), [])
+        post.delete()
+        self.assertEqual(collect_garbage(grace=3600), [])
+        self.assertEqual(collect_garbage(grace=0), [name])
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(
+            os.path.exists(os.path.join(TEMP_MEDIA_ROOT, name))
+        )
+
+
+def make_fractal(size=(200, 150), image_format='PNG', quality=95):
+    image = Image.effect_mandelbrot((200, 150), (-2, -1.5, 1, 1.5), 100)
+    image = image.filter(ImageFilter.GaussianBlur(6)).resize(size)
+    output = BytesIO()
+    image.convert('RGB').save(output, image_format, quality=quality)
+    return output.getvalue()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_SIMILAR_DISTANCE=6)
+class ImageSimilarityTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_upload_is_indexed(self):
+        """Загруженная картинка находится по пережатой уменьшенной копии."""
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Фрактал',
+                'image': SimpleUploadedFile('fractal.png', make_fractal())
+            }
+        )
+        name = Post.objects.get().image.name
+        self.assertTrue(ImageHash.objects.filter(name=name).exists())
+        copy = BytesIO(make_fractal((120, 90), 'JPEG', quality=40))
+        found = find_similar(dhash(copy))
+        self.assertEqual([found_name for found_name, _ in found], [name])
+        other = BytesIO(make_image((200, 150)))
+        self.assertEqual(find_similar(dhash(other)), [])
+
+    def test_search_radius(self):
+        """Находятся хеши не дальше IMAGE_SIMILAR_DISTANCE бит."""
+        value = 0x0123456789abcdef
+        save_hash('posts/a.png', value)
+        # По два бита в двух полосах и по одному в двух других.
+        near = value ^ 0b11 << 48 ^ 0b11 << 32 ^ 1 << 16 ^ 1
+        self.assertEqual(find_similar(near), [('posts/a.png', 6)])
+        self.assertEqual(find_similar(near ^ 1 << 1), [])
+        save_hash('posts/b.png', value ^ 1)
+        self.assertEqual(similar_to('posts/a.png'), [('posts/b.png', 1)])
+
+    def test_index_images_backfills_posts(self):
+        """index_images считает хеши картинок старых постов."""
+        name = image_storage().save(
+            'posts/legacy.png', ContentFile(make_fractal())
+        )
+        Post.objects.create(author=self.user, text='Старый', image=name)
+        call_command('index_images', workers=1, stdout=StringIO())
+        image_hash = ImageHash.objects.get(name=name)
+        with image_storage().open(name) as file:
+            self.assertEqual(
+                find_similar(dhash(file)), [(image_hash.name, 0)]
+            )
+
+    def test_index_images_all_keeps_gallery(self):
+        """index_images --all пересчитывает и картинки галерей."""
+        post_image = image_storage().save(
+            'posts/cover.png', ContentFile(make_fractal())
+        )
+        gallery_image = image_storage().save(
+            'posts/slide.png', ContentFile(make_fractal((40, 30)))
+        )
+        post = Post.objects.create(
+            author=self.user, text='Старый', image=post_image
+        )
+        PostImage.objects.create(post=post, image=gallery_image)
+        PostImage.objects.create(post=post, image=post_image, position=1)
+        call_command('index_images', workers=1, stdout=StringIO())
+        call_command('index_images', workers=1, all=True, stdout=StringIO())
+        self.assertEqual(
+            set(ImageHash.objects.values_list('name', flat=True)),
+            {post_image, gallery_image}
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_SIDE=100)
+class ImagePlaceholderTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def upload(self, name, content):
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост', 'image': SimpleUploadedFile(name, content)}
+        )
+
+    def test_describe_rotated_photo(self):
+        """Размеры считаются после поворота по EXIF."""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        photo = BytesIO(make_image((40, 20), exif=exif))
+        width, height, placeholder = describe(photo)
+        self.assertEqual((width, height), (20, 40))
+        self.assertTrue(placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(placeholder), 1000)
+
+    def test_upload_stores_meta(self):
+        """Размеры сохранённой картинки и заглушка пишутся в пост."""
+        self.upload('big.png', make_fractal((200, 150)))
+        self.upload('copy.png', make_fractal((200, 150)))
+        first, second = Post.objects.all()
+        self.assertEqual((first.image_width, first.image_height), (100, 75))
+        self.assertTrue(first.image_placeholder)
+        self.assertEqual(
+            first.image_placeholder, second.image_placeholder
+        )
+
+    def test_repeat_upload_reads_meta_from_blob(self):
+        """Повторная загрузка берёт размеры из ImageBlob, не из постов."""
+        self.upload('big.png', make_fractal((200, 150)))
+        blob = ImageBlob.objects.get()
+        self.assertEqual((blob.width, blob.height), (100, 75))
+        Post.objects.all().delete()
+        with mock.patch('posts.images.describe') as describe_file:
+            self.upload('copy.png', make_fractal((200, 150)))
+        describe_file.assert_not_called()
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (100, 75))
+        self.assertEqual(post.image_placeholder, blob.placeholder)
+
+    def test_feed_images_are_lazy_with_dimensions(self):
+        """В ленте у картинок размеры и заглушка, грузятся они лениво."""
+        self.upload('first.png', make_fractal())
+        self.upload('second.png', make_image((30, 20), 'PNG'))
+        content = self.authorized_client.get(
+            reverse('posts:index')
+        ).content.decode()
+        self.assertEqual(content.count('width="960" height="339"'), 2)
+        self.assertEqual(content.count('loading="lazy"'), 1)
+        self.assertIn('url(data:image/jpeg;base64,', content)
+
+    def test_feed_dimensions_come_from_post(self):
+        """Размеры в ленте берутся из поста, а не из файла через sorl."""
+        self.upload('first.png', make_fractal())
+        self.authorized_client.get(reverse('posts:index'))
+        Post.objects.update(image_width=None, image_height=None)
+        cache.clear()
+        content = self.authorized_client.get(
+            reverse('posts:index')
+        ).content.decode()
+        self.assertIn('decoding="async"', content)
+        self.assertNotIn('width="960"', content)
+
+    def test_describe_images_backfills_posts(self):
+        """describe_images заполняет поля у старых постов."""
+        name = image_storage().save(
+            'posts/legacy.png', ContentFile(make_fractal((60, 30)))
+        )
+        Post.objects.create(author=self.user, text='Старый', image=name)
+        call_command('describe_images', workers=1, stdout=StringIO())
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (60, 30))
+        self.assertTrue(post.image_placeholder)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POST_GALLERY_MAX_IMAGES=3)
+class GalleryTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def gallery(self, *sizes):
+        return [
+            SimpleUploadedFile(f'{index}.png', make_image(size, 'PNG'))
+            for index, size in enumerate(sizes)
+        ]
+
+    def test_create_post_with_gallery(self):
+        """Картинки галереи сохраняются по порядку, миниатюры - в очередь."""
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Галерея',
+                'gallery': self.gallery((10, 10), (20, 10))
+            }
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        post = Post.objects.get()
+        sizes = [
+            (item.image_width, item.image_height)
+            for item in post.gallery.all()
+        ]
+        self.assertEqual(sizes, [(10, 10), (20, 10)])
+        self.assertEqual(
+            list(post.gallery.values_list('position', flat=True)), [0, 1]
+        )
+        self.assertEqual(
+            sorted(ImageBlob.objects.values_list('refcount', flat=True)),
+            [1, 1]
+        )
+        self.assertEqual(Task.objects.filter(
+            name='posts.tasks.warm_gallery_thumbnail'
+        ).count(), 2)
+
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=[post.pk]),
+            data={'text': 'Галерея', 'gallery': self.gallery((30, 30))}
+        )
+        self.assertEqual(
+            list(post.gallery.values_list('position', flat=True)),
+            [0, 1, 2]
+        )
+        post.delete()
+        self.assertEqual(
+            ImageBlob.objects.filter(refcount=0).count(), 3
+        )
+
+    def test_gallery_size_limit(self):
+        """Слишком большая галерея не сохраняется."""
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Галерея',
+                'gallery': self.gallery(*[(10, 10 + i) for i in range(4)])
+            }
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.context['gallery_form'].errors)
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_broken_gallery_file_is_form_error(self):
+        """Файл с сигнатурой GIF и мусором дальше - ошибка формы."""
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Галерея',
+                'gallery': [SimpleUploadedFile(
+                    'broken.gif', b'GIF89a' + b'\xff' * 64
+                )]
+            }
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.context['gallery_form'].errors)
+        self.assertFalse(Post.objects.exists())
+
+    def test_failed_gallery_write_rolls_back_post(self):
+        """Ошибка записи галереи не оставляет ни поста, ни задач."""
+        with mock.patch(
+            'posts.forms.store_images',
+            side_effect=ValidationError('Файл не похож на картинку.')
+        ):
+            response = self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': 'Галерея', 'gallery': self.gallery((10, 10))}
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Файл не похож на картинку.')
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(
+            Task.objects.filter(name__startswith='posts.').exists()
+        )
+
+    def test_gallery_limit_counts_existing_images(self):
+        """При правке лимит считается вместе с уже добавленными."""
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Галерея', 'gallery': self.gallery((10, 10))}
+        )
+        post = Post.objects.get()
+        response = self.authorized_client.post(
+            reverse('posts:post_edit', args=[post.pk]),
+            data={
+                'text': 'Галерея',
+                'gallery': self.gallery((20, 20), (30, 30), (40, 40))
+            }
+        )
+        self.assertTrue(response.context['gallery_form'].errors)
+        self.assertEqual(post.gallery.count(), 1)
+        self.assertEqual(ImageBlob.objects.count(), 1)
+
+    def test_both_forms_report_errors(self):
+        """Ошибки показываются сразу в обеих формах."""
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'gallery': self.gallery(*[(10, 10 + i) for i in range(4)])}
+        )
+        self.assertTrue(response.context['form'].errors)
+        self.assertTrue(response.context['gallery_form'].errors)
+
+    def test_rejected_post_stores_no_gallery(self):
+        """Галерея отклонённого поста не попадает в хранилище."""
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'gallery': self.gallery((10, 10), (20, 10))}
         )
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_feed_prefetches_galleries(self):
+        """Галереи всей страницы ленты читаются одним запросом."""
+        for index in range(3):
+            post = Post.objects.create(author=self.user, text=str(index))
+            name = image_storage().save(
+                f'posts/{index}.png', ContentFile(make_image((10, 10), 'PNG'))
+            )
+            PostImage.objects.create(post=post, image=name)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(reverse('posts:index'))
+        gallery_queries = [
+            query for query in queries.captured_queries
+            if 'posts_postimage' in query['sql']
+        ]
+        self.assertEqual(len(gallery_queries), 1)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
 
 
 class CommentFormTest(TestCase):
@@ -236,5 +783,5 @@ class CommentFormTest(TestCase):
             reverse('posts:post_detail', kwargs={'post_id': self.post.id})
         )
         self.assertEqual(
-            form_data['text'], resp.context['comments'].first().text
+            form_data['text'], resp.context['comments'][0].text
         )
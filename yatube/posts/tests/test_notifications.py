@@ -0,0 +1,160 @@
+from smtplib import SMTPException
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.models import Task
+from core.tasks import run_pending
+
+from ..models import Follow, Notification, Post
+from ..tasks import notify_followers, send_digests
+
+User = get_user_model()
+
+
+class NotificationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='Slava', email='slava@example.com'
+        )
+        cls.follower = User.objects.create_user(
+            username='Vova', email='vova@example.com'
+        )
+        cls.author_client = Client()
+        cls.author_client.force_login(cls.author)
+        cls.follower_client = Client()
+        cls.follower_client.force_login(cls.follower)
+        Follow.objects.create(user=cls.follower, author=cls.author)
+
+    def test_new_post_notifies_followers(self):
+        """Новый пост создаёт уведомления подписчикам автора."""
+        self.author_client.post(
+            reverse('posts:post_create'), data={'text': 'Новый пост'}
+        )
+        self.assertFalse(Notification.objects.exists())
+        run_pending()
+        notification = Notification.objects.get(recipient=self.follower)
+        self.assertEqual(notification.kind, Notification.NEW_POST)
+        self.assertEqual(notification.actor, self.author)
+
+    @override_settings(NOTIFICATIONS_BATCH_SIZE=2)
+    def test_followers_notified_in_batches(self):
+        """Подписчики читаются пачками, каждый получает одно уведомление."""
+        for index in range(4):
+            Follow.objects.create(
+                user=User.objects.create_user(username=f'reader{index}'),
+                author=self.author
+            )
+        post = Post.objects.create(author=self.author, text='Пост')
+        with CaptureQueriesContext(connection) as queries:
+            notify_followers(post.pk)
+        self.assertEqual(sum(
+            query['sql'].startswith('INSERT INTO "posts_notification"')
+            for query in queries.captured_queries
+        ), 3)
+        self.assertEqual(
+            Notification.objects.filter(post=post).count(), 5
+        )
+
+    def test_comment_notifies_post_author(self):
+        """Комментарий создаёт уведомление автору поста."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        self.follower_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.id}),
+            data={'text': 'Комментарий'}
+        )
+        run_pending()
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.kind, Notification.NEW_COMMENT)
+
+    def test_own_comment_does_not_notify(self):
+        """Комментарий к своему посту уведомления не создаёт."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        self.author_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.id}),
+            data={'text': 'Комментарий'}
+        )
+        run_pending()
+        self.assertFalse(Notification.objects.exists())
+
+    def test_digest_is_scheduled_once_per_window(self):
+        """На окно рассылки ставится одна задача дайджеста."""
+        for text in ('Первый', 'Второй'):
+            self.author_client.post(
+                reverse('posts:post_create'), data={'text': text}
+            )
+        run_pending()
+        self.assertEqual(
+            Task.objects.filter(name='posts.tasks.send_digests').count(), 1
+        )
+
+    def test_digest_batches_notifications(self):
+        """Дайджест объединяет уведомления в одно письмо на пользователя."""
+        for text in ('Первый', 'Второй', 'Третий'):
+            post = Post.objects.create(author=self.author, text=text)
+            Notification.objects.create(
+                recipient=self.follower,
+                actor=self.author,
+                kind=Notification.NEW_POST,
+                post=post
+            )
+        send_digests()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.follower.email])
+        self.assertIn('Третий', mail.outbox[0].body)
+        self.assertFalse(
+            Notification.objects.filter(is_emailed=False).exists()
+        )
+        send_digests()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_digest_retry_skips_mailed_recipients(self):
+        """После сбоя посреди рассылки повтор не шлёт письмо дважды."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        for recipient in (self.author, self.follower):
+            Notification.objects.create(
+                recipient=recipient,
+                actor=self.follower,
+                kind=Notification.NEW_POST,
+                post=post
+            )
+        send = EmailBackend.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(messages)
+            if len(calls) > 1:
+                raise SMTPException('сбой')
+            return send(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', flaky):
+            with self.assertRaises(SMTPException):
+                send_digests()
+        send_digests()
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            [self.author.email, self.follower.email]
+        )
+
+    def test_inbox_marks_notifications_read(self):
+        """Страница уведомлений показывает их и отмечает прочитанными."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Notification.objects.create(
+            recipient=self.follower,
+            actor=self.author,
+            kind=Notification.NEW_POST,
+            post=post
+        )
+        response = self.follower_client.get(reverse('posts:notifications'))
+        self.assertEqual(len(response.context['page_obj']), 1)
+        self.assertFalse(
+            Notification.objects.filter(is_read=False).exists()
+        )
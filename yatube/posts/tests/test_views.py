@@ -1,16 +1,31 @@
+import re
 import shutil
 import tempfile
+from datetime import timedelta
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
+from core.models import Task
+from core.testing import small_gif
 from yatube.settings import NUMBER_OF_POSTS
 
-from ..models import Follow, Group, Post
+from ..counters import flush_views, pending_views, record_view
+from ..follows import following_ids, mutual_follows, suggestions
+from ..models import Comment, Follow, Group, Post
+from ..ranking import recompute_scores
+from ..tasks import flush_pending_views
+from ..viewer import get_viewer
 
 User = get_user_model()
 
@@ -190,6 +205,9 @@ class PostPaginationTests(TestCase):
 
         Post.objects.bulk_create(cls.posts)
 
+    def setUp(self):
+        cache.clear()
+
     def test_first_page_contains_ten_records(self):
         """Проверка: количество постов на первой странице равно 10"""
         templates_pages_names = {
@@ -208,6 +226,19 @@ class PostPaginationTests(TestCase):
                     len(response.context['page_obj']), NUMBER_OF_POSTS
                 )
 
+    def test_index_pages_are_cached_separately(self):
+        """Кешированная первая страница главной не подменяет вторую."""
+        pages = []
+        for page in (1, 2):
+            response = self.authorized_client.get(
+                reverse('posts:index') + f'?page={page}'
+            )
+            pages.append(set(re.findall(
+                r'Тестовый пост \d+', response.content.decode()
+            )))
+        self.assertEqual(len(pages[0]), NUMBER_OF_POSTS)
+        self.assertFalse(pages[0] & pages[1])
+
     def test_second_page_contains_three_records(self):
         """Проверка: на второй странице должно быть три поста"""
         templates_pages_names = {
@@ -301,6 +332,31 @@ class PostImagesTests(TestCase):
         )
 
 
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class PostSideEffectsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_post_create_enqueues_thumbnail(self):
+        """Создание поста с картинкой ставит миниатюру в очередь."""
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': small_gif()}
+        )
+        self.assertTrue(
+            Task.objects.filter(name='posts.tasks.warm_thumbnail').exists()
+        )
+
+
 class FollowTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -382,3 +438,517 @@ class FollowTests(TestCase):
         )
 
         self.assertNotIn(post, response.context['page_obj'])
+
+    def test_profile_reads_following_once(self):
+        """Подписки смотрящего читаются один раз за запрос."""
+        Follow.objects.create(user=self.user, author=self.user_2)
+        Post.objects.create(author=self.user_2, text='Тестовый пост')
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(
+                reverse('posts:profile', kwargs={'username': self.user_2})
+            )
+        self.assertTrue(response.context['following'])
+        self.assertIs(
+            response.context['viewer'], response.wsgi_request.viewer
+        )
+        self.assertEqual(sum(
+            'FROM "posts_follow"' in query['sql']
+            for query in queries.captured_queries
+        ), 1)
+
+    def test_edit_link_only_for_author(self):
+        """Ссылку на правку поста видит только автор."""
+        post = Post.objects.create(author=self.user, text='Тестовый пост')
+        edit_url = reverse('posts:post_edit', args=[post.pk])
+        for client, shown in (
+            (self.authorized_client, True),
+            (self.authorized_client_2, False),
+        ):
+            for url in (
+                reverse('posts:post_detail', args=[post.pk]),
+                reverse('posts:profile', kwargs={'username': self.user}),
+            ):
+                with self.subTest(url=url, shown=shown):
+                    cache.clear()
+                    content = client.get(url).content.decode()
+                    self.assertEqual(edit_url in content, shown)
+
+    def test_index_edit_link_is_not_cached(self):
+        """Кнопка правки на главной не попадает в общий кеш."""
+        cache.clear()
+        post = Post.objects.create(author=self.user, text='Тестовый пост')
+        edit_url = reverse('posts:post_edit', args=[post.pk])
+        for client, shown in (
+            (self.authorized_client, True),
+            (self.authorized_client_2, False),
+            (self.authorized_client, True),
+        ):
+            with self.subTest(shown=shown):
+                content = client.get(reverse('posts:index')).content
+                self.assertEqual(edit_url in content.decode(), shown)
+
+    def test_anonymous_viewer(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        viewer = get_viewer(request)
+        self.assertIs(get_viewer(request), viewer)
+        with self.assertNumQueries(0):
+            self.assertIsNone(viewer.id)
+            self.assertFalse(viewer.follows(self.user.pk))
+            self.assertFalse(viewer.is_staff)
+
+
+class FollowGraphTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.user_2 = User.objects.create_user(username='Vova')
+        cls.user_3 = User.objects.create_user(username='Kolya')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_following_cache_is_invalidated(self):
+        """Кеш подписок сбрасывается при подписке и отписке."""
+        self.assertEqual(following_ids(self.user.pk), frozenset())
+        follow = Follow.objects.create(user=self.user, author=self.user_2)
+        self.assertEqual(
+            following_ids(self.user.pk), frozenset({self.user_2.pk})
+        )
+        follow.delete()
+        self.assertEqual(following_ids(self.user.pk), frozenset())
+
+    def test_profile_uses_cached_following(self):
+        """Страница автора не спрашивает БД о подписке повторно."""
+        Follow.objects.create(user=self.user, author=self.user_2)
+        url = reverse('posts:profile', kwargs={'username': self.user_2})
+        self.assertTrue(self.authorized_client.get(url).context['following'])
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client.get(url)
+        self.assertFalse(
+            [q for q in queries.captured_queries if 'posts_follow' in q['sql']]
+        )
+
+    def test_bulk_follow_and_unfollow(self):
+        """Один запрос подписывает и отписывает от нескольких авторов."""
+        Follow.objects.create(user=self.user, author=self.user_3)
+        response = self.authorized_client.post(
+            reverse('posts:follow_bulk'),
+            data={
+                'follow': [self.user_2.username, self.user.username],
+                'unfollow': [self.user_3.username],
+            }
+        )
+        self.assertEqual(response.json()['following'], [self.user_2.pk])
+        self.assertEqual(
+            list(self.user.follower.values_list('author', flat=True)),
+            [self.user_2.pk]
+        )
+
+    @override_settings(PAGINATION_EXACT_THRESHOLD=0)
+    def test_bulk_follow_resets_feed_count(self):
+        """Пакетная подписка сбрасывает число постов ленты подписок."""
+        cache.clear()
+        Post.objects.create(author=self.user_2, text='Пост')
+        url = reverse('posts:follow_index')
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 0)
+        self.authorized_client.post(
+            reverse('posts:follow_bulk'),
+            data={'follow': [self.user_2.username]}
+        )
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+
+    def test_bulk_follow_limit(self):
+        """Слишком большой пакет подписок отклоняется."""
+        response = self.authorized_client.post(
+            reverse('posts:follow_bulk'),
+            data={'follow': [f'user{i}' for i in range(101)]}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(
+        RATELIMIT_ENABLED=True,
+        RATELIMITS={'posts:follow_bulk': {'user': '1/m'}}
+    )
+    def test_bulk_follow_rate_limit(self):
+        """Частые пакетные подписки получают 429."""
+        cache.clear()
+        url = reverse('posts:follow_bulk')
+        data = {'follow': [self.user_2.username]}
+        response = self.authorized_client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        response = self.authorized_client.post(url, data)
+        self.assertEqual(response.status_code, 429)
+
+    def test_mutual_follows_and_suggestions(self):
+        """Взаимные подписки и подсказки строятся по графу подписок."""
+        Follow.objects.create(user=self.user, author=self.user_2)
+        Follow.objects.create(user=self.user_2, author=self.user)
+        Follow.objects.create(user=self.user_2, author=self.user_3)
+        self.assertEqual(mutual_follows(self.user.pk), {self.user_2.pk})
+        self.assertEqual(suggestions(self.user.pk), [self.user_3.pk])
+
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['mutual'], [self.user_2])
+        self.assertEqual(response.context['suggested'], [self.user_3])
+
+
+class PopularFeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+
+    def test_commented_post_ranks_higher(self):
+        """Пост с комментариями выше поста без них."""
+        quiet = Post.objects.create(author=self.user, text='Тихий пост')
+        discussed = Post.objects.create(author=self.user, text='Обсуждаемый')
+        Post.objects.filter(pk=discussed.pk).update(pub_date=quiet.pub_date)
+        Comment.objects.bulk_create([
+            Comment(post=discussed, author=self.user, text=str(i))
+            for i in range(5)
+        ])
+        recompute_scores(Post.objects.all())
+        response = self.authorized_client.get(reverse('posts:popular'))
+        self.assertEqual(
+            list(response.context['page_obj']), [discussed, quiet]
+        )
+
+    def test_old_posts_decay(self):
+        """Старый пост с той же вовлечённостью ниже нового."""
+        old = Post.objects.create(author=self.user, text='Старый пост')
+        new = Post.objects.create(author=self.user, text='Новый пост')
+        Post.objects.filter(pk=old.pk).update(
+            pub_date=timezone.now() - timedelta(days=3)
+        )
+        recompute_scores(Post.objects.all())
+        self.assertEqual(
+            list(Post.objects.order_by('-score')), [new, old]
+        )
+
+    def test_new_post_is_scored(self):
+        """Пост, созданный в обход обработчиков, получает рейтинг сразу."""
+        old = Post.objects.create(author=self.user, text='Старый пост')
+        Post.objects.filter(pk=old.pk).update(
+            pub_date=timezone.now() - timedelta(days=3)
+        )
+        recompute_scores(Post.objects.all())
+        new = Post.objects.create(author=self.user, text='Новый пост')
+        self.assertGreater(new.score, 0)
+        self.assertEqual(
+            list(Post.objects.order_by('-score')), [new, old]
+        )
+
+    def test_comment_schedules_score_update(self):
+        """Новый комментарий ставит пересчёт рейтинга в очередь."""
+        post = Post.objects.create(author=self.user, text='Пост')
+        self.authorized_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.id}),
+            data={'text': 'Комментарий'}
+        )
+        self.assertTrue(
+            Task.objects.filter(
+                idempotency_key__startswith=f'score:post:{post.pk}:'
+            ).exists()
+        )
+
+
+class PostViewsCounterTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        cls.guest_client = Client()
+
+    def setUp(self):
+        cache.clear()
+        # Кеш тестов в памяти процесса; буфер проверяем в одном процессе.
+        buffered = mock.patch('posts.counters.is_buffered', return_value=True)
+        buffered.start()
+        self.addCleanup(buffered.stop)
+
+    def test_views_are_buffered(self):
+        """Просмотры копятся в буфере и видны на странице поста."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        with mock.patch('posts.counters.current_bucket', return_value=1):
+            self.guest_client.get(url)
+            response = self.guest_client.get(url)
+        self.assertEqual(response.context['views'], 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 0)
+
+    def test_request_does_not_flush(self):
+        """Просмотр только копит счётчики, в БД их пишет задача."""
+        with mock.patch('posts.counters.current_bucket', return_value=1):
+            record_view(self.post.pk)
+        with mock.patch('posts.counters.current_bucket', return_value=2):
+            with self.assertNumQueries(0):
+                record_view(self.post.pk)
+
+    def test_pending_buckets_are_flushed(self):
+        """Задача пишет в БД все завершённые корзины, текущую - нет."""
+        other = Post.objects.create(author=self.user, text='Другой пост')
+        for bucket in (1, 3):
+            with mock.patch(
+                'posts.counters.current_bucket', return_value=bucket
+            ):
+                for _ in range(3):
+                    record_view(self.post.pk)
+                record_view(other.pk)
+        with mock.patch('posts.counters.current_bucket', return_value=4):
+            record_view(other.pk)
+            flush_pending_views()
+        self.post.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.post.views, 6)
+        self.assertEqual(other.views, 2)
+
+    def test_process_local_cache_writes_views(self):
+        """С кешем в памяти процесса просмотр сразу пишется в БД."""
+        with mock.patch('posts.counters.is_buffered', return_value=False):
+            record_view(self.post.pk)
+            record_view(self.post.pk)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 2)
+        self.assertEqual(pending_views(self.post.pk), 0)
+
+    def test_bucket_is_flushed_once(self):
+        """Корзина сбрасывается в БД только один раз."""
+        with mock.patch('posts.counters.current_bucket', return_value=1):
+            record_view(self.post.pk)
+        self.assertEqual(flush_views(1), 1)
+        self.assertEqual(flush_views(1), 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 1)
+
+
+@override_settings(COMMENTS_PER_PAGE=2)
+class CommentPaginationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий {i}'
+            )
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_post_detail_shows_first_page(self):
+        """На странице поста выводится только первая страница."""
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        )
+        self.assertEqual(response.context['comments'], self.comments[:2])
+        self.assertEqual(
+            response.context['next_cursor'], self.comments[1].path
+        )
+
+    def test_load_more_returns_next_batch(self):
+        """Фрагмент «Показать ещё» отдаёт следующую порцию."""
+        response = self.authorized_client.get(
+            reverse('posts:comments_more', kwargs={'post_id': self.post.id}),
+            {'after': self.comments[3].path}
+        )
+        self.assertEqual(response.context['comments'], self.comments[4:])
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertContains(response, 'Комментарий 4')
+        self.assertNotContains(response, 'Комментарий 3')
+
+    def test_load_more_missing_post(self):
+        response = self.authorized_client.get(
+            reverse('posts:comments_more', kwargs={'post_id': 10 ** 6})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_first_page_is_cached_and_invalidated(self):
+        """Первая страница берётся из кеша и сбрасывается при удалении."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        self.authorized_client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client.get(url)
+        self.assertFalse([
+            q for q in queries.captured_queries
+            if 'posts_comment' in q['sql']
+        ])
+        Comment.objects.filter(pk=self.comments[0].pk).delete()
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.context['comments'], self.comments[1:3])
+
+
+class CommentThreadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.user)
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+
+    def reply(self, parent, text):
+        return Comment.objects.create(
+            post=self.post, author=self.user, text=text, parent=parent
+        )
+
+    def test_thread_is_read_in_tree_order(self):
+        """Ветка читается одним запросом в порядке обхода дерева."""
+        root = self.reply(None, 'Корень')
+        other = self.reply(None, 'Другой корень')
+        child = self.reply(root, 'Ответ')
+        grandchild = self.reply(child, 'Ответ на ответ')
+        second_child = self.reply(root, 'Второй ответ')
+        root.refresh_from_db()
+        with self.assertNumQueries(1):
+            thread = list(root.subtree())
+        self.assertEqual(thread, [root, child, grandchild, second_child])
+        self.assertEqual(list(root.subtree(max_depth=1)),
+                         [root, child, second_child])
+        self.assertEqual(
+            list(Comment.objects.order_by('path')),
+            [root, child, grandchild, second_child, other]
+        )
+        self.assertEqual(grandchild.depth, 2)
+
+    def test_reply_counts_are_maintained(self):
+        """Счётчики ответов обновляются при ответе и удалении."""
+        root = self.reply(None, 'Корень')
+        child = self.reply(root, 'Ответ')
+        grandchild = self.reply(child, 'Ответ на ответ')
+        root.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual((root.reply_count, child.reply_count), (2, 1))
+        grandchild.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 1)
+        child.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 0)
+
+    def test_add_reply_through_form(self):
+        """Форма комментария принимает родителя из того же поста."""
+        root = self.reply(None, 'Корень')
+        self.authorized_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.id}),
+            data={'text': 'Ответ', 'parent': root.pk}
+        )
+        reply = Comment.objects.get(text='Ответ')
+        self.assertEqual(reply.parent, root)
+        self.assertTrue(reply.path.startswith(root.path))
+
+    def test_thread_fragment(self):
+        """Фрагмент ветки отдаёт комментарий и ответы на него."""
+        root = self.reply(None, 'Корень')
+        child = self.reply(root, 'Ответ')
+        self.reply(None, 'Чужая ветка')
+        response = self.authorized_client.get(reverse(
+            'posts:comment_thread',
+            kwargs={'post_id': self.post.id, 'comment_id': root.pk}
+        ))
+        self.assertEqual(list(response.context['comments']), [root, child])
+
+
+@override_settings(PAGINATION_EXACT_THRESHOLD=0)
+class CachedCountTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Slava')
+        cls.guest_client = Client()
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_slug',
+            description='Тестовое описание',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feed_count_is_cached(self):
+        """Лента не считает COUNT, пока число есть в кеше."""
+        Post.objects.create(author=self.user, text='Пост', group=self.group)
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        response = self.guest_client.get(url)
+        self.assertTrue(response.context['page_obj'].paginator.count_is_exact)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_client.get(url)
+        self.assertFalse([
+            q for q in queries.captured_queries if 'COUNT' in q['sql']
+        ])
+        paginator = response.context['page_obj'].paginator
+        self.assertEqual(paginator.count, 1)
+        self.assertFalse(paginator.count_is_exact)
+
+    def test_feed_count_follows_writes(self):
+        """Создание и удаление поста сдвигают закешированные числа."""
+        url = reverse('posts:profile', kwargs={'username': self.user})
+        Post.objects.create(author=self.user, text='Первый')
+        self.guest_client.get(url)
+        second = Post.objects.create(author=self.user, text='Второй')
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+        self.assertContains(response, 'Всего постов: &asymp;2')
+        second.delete()
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+
+    def test_group_change_resets_both_groups(self):
+        """Смена группы поста сбрасывает числа старой и новой группы."""
+        other = Group.objects.create(title='Другая', slug='other')
+        post = Post.objects.create(
+            author=self.user, text='Пост', group=self.group
+        )
+        for group in (self.group, other):
+            self.guest_client.get(
+                reverse('posts:group_list', kwargs={'slug': group.slug})
+            )
+        for new_group, counts in ((other, (0, 1)), (None, (0, 0))):
+            with self.subTest(group=new_group):
+                post = Post.objects.get(pk=post.pk)
+                post.group = new_group
+                post.save()
+                for group, count in zip((self.group, other), counts):
+                    response = self.guest_client.get(reverse(
+                        'posts:group_list', kwargs={'slug': group.slug}
+                    ))
+                    self.assertEqual(
+                        response.context['page_obj'].paginator.count, count
+                    )
+
+    @override_settings(PAGINATION_EXACT_THRESHOLD=1000)
+    def test_small_feeds_are_counted_exactly(self):
+        """Небольшие выборки считаются точно."""
+        Post.objects.create(author=self.user, text='Пост')
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        response = self.guest_client.get(url)
+        self.assertTrue(response.context['page_obj'].paginator.count_is_exact)
+
+    @override_settings(PAGINATION_EXACT_THRESHOLD=1000)
+    def test_exact_count_replaces_stale_one(self):
+        """Точное число небольшой выборки записывается в кеш."""
+        Post.objects.create(author=self.user, text='Пост')
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        cache.set('feed_count:all', 5)
+        response = self.guest_client.get(url)
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        self.assertEqual(cache.get('feed_count:all'), 1)
@@ -7,10 +7,21 @@ app_name = 'posts'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('popular/', views.popular, name='popular'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
     path('profile/<str:username>/', views.profile, name='profile'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.comments_more,
+        name='comments_more'
+    ),
+    path(
+        'posts/<int:post_id>/comments/<int:comment_id>/thread/',
+        views.comment_thread,
+        name='comment_thread'
+    ),
     path(
         'posts/<int:post_id>/comment/',
         views.add_comment,
@@ -18,6 +29,12 @@ urlpatterns = [
     ),
     path('create/', views.post_create, name='post_create'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('follow/bulk/', views.follow_bulk, name='follow_bulk'),
+    path(
+        'notifications/',
+        views.notifications,
+        name='notifications'
+    ),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
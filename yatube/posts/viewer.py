@@ -0,0 +1,59 @@
+"""Данные о том, кто смотрит страницу.
+
+Обработчики и шаблоны получают их из одного объекта ``Viewer`` на
+запрос (``get_viewer``, в шаблонах - переменная ``viewer``). Каждое
+поле считается при первом обращении и запоминается, так что
+пользователь и его подписки читаются из кеша или базы не больше раза
+за запрос, а страницы, которым они не нужны, их не трогают.
+"""
+from django.utils.functional import cached_property
+
+from .follows import following_ids
+
+
+class Viewer:
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def user(self):
+        return self.request.user
+
+    @cached_property
+    def is_authenticated(self):
+        return self.user.is_authenticated
+
+    @cached_property
+    def id(self):
+        return self.user.pk if self.is_authenticated else None
+
+    @cached_property
+    def is_staff(self):
+        return self.is_authenticated and self.user.is_staff
+
+    @cached_property
+    def is_superuser(self):
+        return self.is_authenticated and self.user.is_superuser
+
+    @cached_property
+    def following(self):
+        """id авторов, на которых подписан пользователь."""
+        if not self.is_authenticated:
+            return frozenset()
+        return following_ids(self.id)
+
+    def follows(self, author_id):
+        return author_id in self.following
+
+    def is_author(self, obj):
+        """Написал ли пользователь пост или комментарий."""
+        return self.id is not None and obj.author_id == self.id
+
+
+def get_viewer(request):
+    """Viewer текущего запроса, один на запрос."""
+    try:
+        return request.viewer
+    except AttributeError:
+        request.viewer = Viewer(request)
+        return request.viewer
@@ -1,26 +1,134 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page
+from django.db import transaction
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
 
-from yatube.settings import NUMBER_OF_POSTS
+from core.images import limit_image_uploads
+from core.cache import get_or_compute
+from core.paginator import CachedCountPaginator, cached_count
+from core.ratelimit import ratelimit
+from core.tasks import enqueue, enqueue_batched
+from yatube.settings import (COMMENTS_MAX_DEPTH, FOLLOW_BULK_LIMIT,
+                             INDEX_PAGE_TIMEOUT, NUMBER_OF_POSTS,
+                             POPULAR_UPDATE_WINDOW)
 
-from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post
+from .comments import comments_page, first_comments_page
+from .counters import pending_views, record_view
+from .feeds import (all_posts_key, author_posts_key, follow_counts_changed,
+                    follow_posts_key, group_posts_key, index_page_key)
+from .follows import (following_ids, invalidate_following, mutual_follows,
+                      suggestions)
+from .forms import CommentForm, GalleryForm, PostForm
+from .models import Comment, Follow, Group, Notification, Post
+from .tasks import (notify_followers, notify_post_author,
+                    update_author_scores, update_post_score,
+                    warm_gallery_thumbnail, warm_thumbnail)
+from .viewer import get_viewer
 
 User = get_user_model()
 
 
-def pagination_process(req, obj, number) -> Paginator:
-    paginator = Paginator(obj, number)
+def pagination_process(req, obj, number, count_key=None) -> Page:
+    paginator = CachedCountPaginator(obj, number, count_key=count_key)
     page_number = req.GET.get('page')
     return paginator.get_page(page_number)
 
 
+def upload_info(request):
+    """Итоги приёма файлов для форм постов (limit_image_uploads)."""
+    return {
+        'upload_errors': getattr(request, 'upload_errors', None),
+        'upload_digests': getattr(request, 'upload_digests', None),
+    }
+
+
+def schedule_post_side_effects(post, created=False, gallery=()):
+    """Отдаёт в фоновую очередь работу, не нужную для ответа."""
+    if created:
+        enqueue(
+            notify_followers,
+            post.pk,
+            idempotency_key=f'notify:post:{post.pk}'
+        )
+        schedule_score_update(post.pk)
+    if post.image:
+        enqueue(
+            warm_thumbnail,
+            post.pk,
+            idempotency_key=f'thumbnail:{post.pk}:{post.image.name}'
+        )
+    for item in gallery:
+        enqueue(
+            warm_gallery_thumbnail,
+            item.pk,
+            idempotency_key=f'thumbnail:gallery:{item.pk}'
+        )
+
+
+def save_post(form, gallery_form, author=None):
+    """Сохраняет пост, галерею и фоновые задачи одной транзакцией.
+
+    Если картинку не удалось записать в хранилище, в базе не остаётся
+    ни поста, ни задач, а ошибка показывается у поля картинки.
+    Возвращает пост или None.
+    """
+    created = form.instance.pk is None
+    failed_form, field = form, 'image'
+    try:
+        with transaction.atomic():
+            post = form.save(commit=False)
+            if author is not None:
+                post.author = author
+            post.save()
+            form.save_m2m()
+            failed_form, field = gallery_form, 'gallery'
+            gallery = gallery_form.save(post)
+            schedule_post_side_effects(post, created=created, gallery=gallery)
+    except ValidationError as error:
+        failed_form.add_error(field, error)
+        return None
+    return post
+
+
+def schedule_score_update(post_id):
+    """Пересчёт рейтинга поста, частые вызовы сливаются в один."""
+    enqueue_batched(
+        update_post_score,
+        post_id,
+        key=f'score:post:{post_id}',
+        window=POPULAR_UPDATE_WINDOW
+    )
+
+
+def schedule_author_scores_update(author_id):
+    """Пересчёт рейтинга постов автора после смены числа подписчиков."""
+    enqueue_batched(
+        update_author_scores,
+        author_id,
+        key=f'score:author:{author_id}',
+        window=POPULAR_UPDATE_WINDOW
+    )
+
+
 def index(request):
     """Обработчик главной страницы."""
-    posts = Post.objects.all()
-    page_obj = pagination_process(request, posts, NUMBER_OF_POSTS)
+    posts = Post.objects.select_related(
+        'author', 'group'
+    ).prefetch_related('gallery')
+    page_obj = pagination_process(
+        request, posts, NUMBER_OF_POSTS, count_key=all_posts_key()
+    )
+    # Посты страницы одни для всех и берутся из кеша; фрагменты постов
+    # кешируются в шаблоне, а кнопки автора рисуются для каждого.
+    page_obj.object_list = get_or_compute(
+        index_page_key(page_obj.number),
+        lambda: list(page_obj.object_list),
+        INDEX_PAGE_TIMEOUT
+    )
     template = 'posts/index.html'
     context = {
         'page_obj': page_obj
@@ -28,11 +136,30 @@ def index(request):
     return render(request=request, template_name=template, context=context)
 
 
+def popular(request):
+    """Обработчик ленты популярных постов."""
+    posts = Post.objects.select_related(
+        'author', 'group'
+    ).prefetch_related('gallery').order_by('-score')
+    page_obj = pagination_process(
+        request, posts, NUMBER_OF_POSTS, count_key=all_posts_key()
+    )
+    template = 'posts/popular.html'
+    context = {
+        'page_obj': page_obj,
+        'popular': True
+    }
+    return render(request=request, template_name=template, context=context)
+
+
 def group_posts(request, slug):
     """Обработчик груп постов."""
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = pagination_process(request, posts, NUMBER_OF_POSTS)
+    posts = group.posts.prefetch_related('gallery')
+    page_obj = pagination_process(
+        request, posts, NUMBER_OF_POSTS,
+        count_key=group_posts_key(group.pk)
+    )
     template = 'posts/group_list.html'
     context = {
         'group': group,
@@ -44,13 +171,12 @@ def group_posts(request, slug):
 def profile(request, username):
     """Обработчик страницы автора."""
     author = get_object_or_404(User, username=username)
-    user = request.user
-    posts = author.posts.all()
-    following = False
-    if user.is_authenticated:
-        if author.following.filter(user=user).exists():
-            following = True
-    page_obj = pagination_process(request, posts, NUMBER_OF_POSTS)
+    posts = author.posts.prefetch_related('gallery')
+    following = get_viewer(request).follows(author.pk)
+    page_obj = pagination_process(
+        request, posts, NUMBER_OF_POSTS,
+        count_key=author_posts_key(author.pk)
+    )
     template = 'posts/profile.html'
     context = {
         'posts_user': posts,
@@ -64,42 +190,90 @@ def profile(request, username):
 def post_detail(request, post_id):
     """Обработчик страницы поста в деталях."""
     post = get_object_or_404(Post, id=post_id)
+    record_view(post.pk)
     form_comment = CommentForm()
-    comments_post = post.comments.all()
+    comments_post, next_cursor = first_comments_page(post.pk)
     user = post.author
-    count_posts = user.posts.count()
+    count_posts, count_posts_exact = cached_count(
+        user.posts.all(), author_posts_key(user.pk)
+    )
     template = 'posts/post_detail.html'
     context = {
         'post': post,
+        'views': post.views + pending_views(post.pk),
         'count_posts': count_posts,
+        'count_posts_exact': count_posts_exact,
         'form': form_comment,
-        'comments': comments_post
+        'comments': comments_post,
+        'next_cursor': next_cursor
+    }
+    return render(request, template_name=template, context=context)
+
+
+def comments_more(request, post_id):
+    """Следующая страница комментариев поста фрагментом HTML."""
+    post = get_object_or_404(Post, id=post_id)
+    after = request.GET.get('after')
+    comments, next_cursor = comments_page(post.pk, after=after)
+    template = 'posts/includes/comment_list.html'
+    context = {
+        'post_id': post.pk,
+        'comments': comments,
+        'next_cursor': next_cursor
+    }
+    return render(request, template_name=template, context=context)
+
+
+def comment_thread(request, post_id, comment_id):
+    """Ветка ответов на комментарий фрагментом HTML."""
+    comment = get_object_or_404(Comment, id=comment_id, post_id=post_id)
+    try:
+        depth = int(request.GET.get('depth', COMMENTS_MAX_DEPTH))
+    except ValueError:
+        depth = COMMENTS_MAX_DEPTH
+    template = 'posts/includes/comment_list.html'
+    context = {
+        'post_id': post_id,
+        'comments': comment.subtree(max_depth=depth).select_related(
+            'author'
+        )
     }
     return render(request, template_name=template, context=context)
 
 
 @login_required
+@ratelimit
+@limit_image_uploads
 def post_create(request):
     """Обработчик создания поста."""
     template = 'posts/create_post.html'
     form = PostForm(
         request.POST or None,
-        files=request.FILES or None
+        files=request.FILES or None,
+        **upload_info(request)
+    )
+    gallery_form = GalleryForm(
+        request.POST or None,
+        files=request.FILES or None,
+        **upload_info(request)
     )
 
-    if form.is_valid():
-        post = form.save(commit=False)
-        post.author = request.user
-        post.save()
-        return redirect('posts:profile', post.author)
+    # Проверяем обе формы, чтобы показать ошибки сразу в обеих.
+    if (
+        all([form.is_valid(), gallery_form.is_valid()])
+        and save_post(form, gallery_form, author=request.user)
+    ):
+        return redirect('posts:profile', request.user)
 
     context = {
-        'form': form
+        'form': form,
+        'gallery_form': gallery_form
     }
     return render(request, template_name=template, context=context)
 
 
 @login_required
+@limit_image_uploads
 def post_edit(request, post_id):
     """Обработчик редактирования поста."""
     post = get_object_or_404(Post, id=post_id)
@@ -107,20 +281,32 @@ def post_edit(request, post_id):
     form = PostForm(
         request.POST or None,
         files=request.FILES or None,
-        instance=post
+        instance=post,
+        **upload_info(request)
+    )
+    gallery_form = GalleryForm(
+        request.POST or None,
+        files=request.FILES or None,
+        post=post,
+        **upload_info(request)
     )
-    if form.is_valid() and post.author == request.user:
-        form.save()
+    if (
+        all([form.is_valid(), gallery_form.is_valid()])
+        and get_viewer(request).is_author(post)
+        and save_post(form, gallery_form)
+    ):
         return redirect('posts:post_detail', post.id)
 
     template = 'posts/create_post.html'
     context = {
         'form': form,
+        'gallery_form': gallery_form
     }
     return render(request, template_name=template, context=context)
 
 
 @login_required
+@ratelimit
 def add_comment(request, post_id):
     """Добавление комментария."""
     post = get_object_or_404(Post, id=post_id)
@@ -129,17 +315,58 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
+        parent_id = request.POST.get('parent', '')
+        if parent_id.isdigit():
+            # Отвечать можно только на комментарии этого же поста.
+            comment.parent = post.comments.filter(pk=parent_id).first()
+        # Слишком глубокий ответ становится соседом родителя.
+        while comment.parent and comment.parent.depth + 1 >= (
+            COMMENTS_MAX_DEPTH
+        ):
+            comment.parent = comment.parent.parent
         comment.save()
+        enqueue(notify_post_author, comment.pk)
+        schedule_score_update(post.pk)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
     """Обработчик страницы подписок"""
-    user = request.user
-    posts = Post.objects.filter(author__following__user=user)
-    page_obj = pagination_process(request, posts, NUMBER_OF_POSTS)
+    viewer = get_viewer(request)
+    posts = Post.objects.filter(
+        author__following__user_id=viewer.id
+    ).prefetch_related('gallery')
+    page_obj = pagination_process(
+        request, posts, NUMBER_OF_POSTS,
+        count_key=follow_posts_key(viewer.id)
+    )
+    mutual = mutual_follows(viewer.id)
+    suggested = suggestions(viewer.id)
+    users = User.objects.in_bulk(list(mutual.union(suggested)))
     template = 'posts/follow.html'
+    context = {
+        'page_obj': page_obj,
+        'mutual': [users[pk] for pk in sorted(mutual) if pk in users],
+        'suggested': [users[pk] for pk in suggested if pk in users]
+    }
+    return render(request=request, template_name=template, context=context)
+
+
+@login_required
+def notifications(request):
+    """Обработчик страницы уведомлений."""
+    notifications = request.user.notifications.select_related(
+        'actor', 'post'
+    )
+    page_obj = pagination_process(request, notifications, NUMBER_OF_POSTS)
+    unread = [
+        notification.pk for notification in page_obj
+        if not notification.is_read
+    ]
+    if unread:
+        Notification.objects.filter(pk__in=unread).update(is_read=True)
+    template = 'posts/notifications.html'
     context = {
         'page_obj': page_obj
     }
@@ -147,14 +374,19 @@ def follow_index(request):
 
 
 @login_required
+@ratelimit
 def profile_follow(request, username):
     """Подписаться на автора."""
     author = get_object_or_404(User, username=username)
-    user = request.user
-    if author == user:
+    viewer = get_viewer(request)
+    if author.pk == viewer.id:
         return redirect('posts:profile', username=username)
 
-    Follow.objects.get_or_create(user=user, author=author)
+    _, created = Follow.objects.get_or_create(
+        user_id=viewer.id, author=author
+    )
+    if created:
+        schedule_author_scores_update(author.pk)
     return redirect('posts:profile', username=username)
 
 
@@ -166,5 +398,43 @@ def profile_unfollow(request, username):
     follow_user = author.following.filter(user=user)
     if follow_user:
         follow_user.delete()
+        schedule_author_scores_update(author.pk)
 
     return redirect('posts:profile', username=username)
+
+
+@login_required
+@require_POST
+@ratelimit
+def follow_bulk(request):
+    """Подписаться и отписаться от нескольких авторов одним запросом."""
+    follow = request.POST.getlist('follow')
+    unfollow = request.POST.getlist('unfollow')
+    if len(follow) + len(unfollow) > FOLLOW_BULK_LIMIT:
+        return JsonResponse(
+            {'error': f'Не больше {FOLLOW_BULK_LIMIT} авторов за запрос'},
+            status=400
+        )
+    user = request.user
+    authors = dict(
+        User.objects.filter(
+            username__in=follow + unfollow
+        ).values_list('username', 'pk')
+    )
+    follow_ids = {authors[name] for name in follow if name in authors}
+    follow_ids.discard(user.pk)
+    unfollow_ids = {
+        authors[name] for name in unfollow if name in authors
+    } - follow_ids
+
+    Follow.objects.bulk_create(
+        [Follow(user=user, author_id=pk) for pk in follow_ids],
+        ignore_conflicts=True
+    )
+    Follow.objects.filter(user=user, author_id__in=unfollow_ids).delete()
+    for author_id in follow_ids | unfollow_ids:
+        schedule_author_scores_update(author_id)
+    # bulk_create не отправляет сигналы, поэтому сбрасываем кеши сами.
+    invalidate_following(user.pk)
+    follow_counts_changed(user.pk)
+    return JsonResponse({'following': sorted(following_ids(user.pk))})
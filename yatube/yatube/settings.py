@@ -34,11 +34,67 @@ ALLOWED_HOSTS = [
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Хранилище сессий (core.sessions): 'db', 'cached_db' (кеш с записью в
+# базу), 'cache' или 'signed_cookies'; 'cached_db' и 'cache' - только с
+# общим для процессов кешем, иначе сайт не запустится (core.checks)
+SESSION_STORE = 'db'
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE = SESSION_ENGINES[SESSION_STORE]
+# истёкшие сессии убираются раз в столько секунд (TASKS_PERIODIC),
+# пачками по SESSION_CLEANUP_BATCH_SIZE строк, не больше
+# SESSION_CLEANUP_BATCHES пачек за задачу
+SESSION_CLEANUP_INTERVAL = 60 * 60
+SESSION_CLEANUP_BATCH_SIZE = 1000
+SESSION_CLEANUP_BATCHES = 10
+
+# Сколько секунд вошедший пользователь лежит в кеше (core.auth);
+# запись сбрасывается при сохранении пользователя, а срок ограничивает,
+# сколько процесс, не увидевший сброса, пускает отключённого
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Кеш в два уровня (core.cache.TieredCache): LRU в памяти процесса перед
+# общим кешем 'shared' (в бою - memcached или redis, общий для всех
+# процессов). В L1 попадают только ключи с префиксами из
+# LOCAL_KEY_PREFIXES и живут там не дольше LOCAL_TIMEOUT секунд;
+# изменения из других процессов видны через SYNC_INTERVAL секунд
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_MAX_BYTES': 16 * 1024 * 1024,
+            'LOCAL_TIMEOUT': 5,
+            'SYNC_INTERVAL': 1,
+            'LOCAL_KEY_PREFIXES': (
+                'template.cache.',
+                'compressed:',
+                'following:',
+                'auth:user:',
+                'comments:first:',
+                'feed_count:',
+            ),
+        },
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
 }
+# Пересчёт без давки (core.cache.get_or_compute): истёкшее значение
+# отдаётся ещё CACHE_STALE_TIMEOUT секунд, пока его пересчитывает один
+# процесс; CACHE_EARLY_BETA > 1 - пересчитывать раньше, 0 - не раньше
+# срока. Без значения запросы ждут пересчитывающего CACHE_LOCK_WAIT с,
+# опрашивая кеш раз в CACHE_LOCK_POLL с
+CACHE_STALE_TIMEOUT = 60
+CACHE_EARLY_BETA = 1.0
+CACHE_LOCK_TIMEOUT = 30
+CACHE_LOCK_WAIT = 2
+CACHE_LOCK_POLL = 0.05
 
 # Application definition
 
@@ -49,9 +105,9 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'posts',
+    'posts.apps.PostsConfig',
     'users.apps.UsersConfig',
-    'core',
+    'core.apps.CoreConfig',
     'sorl.thumbnail'
 ]
 
@@ -60,43 +116,177 @@ LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
 
 NUMBER_OF_POSTS = 10
+# Пагинатор показывает столько номеров вокруг текущей страницы и по краям
+PAGINATION_ON_EACH_SIDE = 2
+PAGINATION_ON_ENDS = 1
+# Число постов в лентах берётся из кеша (секунды хранения); выборки меньше
+# порога считаются точным COUNT
+PAGINATION_COUNT_TIMEOUT = 10 * 60
+PAGINATION_EXACT_THRESHOLD = 1000
+# Сколько секунд посты страницы главной ленты берутся из кеша
+INDEX_PAGE_TIMEOUT = 20
+
+# Кеш подписок (posts.follows): время жизни множества подписок в секундах
+FOLLOW_CACHE_TIMEOUT = 60 * 60
+# сколько авторов можно подписать/отписать одним запросом
+FOLLOW_BULK_LIMIT = 100
+# сколько подписок пользователя обходить при поиске взаимных и подсказок
+FOLLOW_GRAPH_FANOUT = 200
+FOLLOW_SUGGESTIONS = 5
+
+# Лента «Популярное» (posts.ranking): каждые POPULAR_DECAY секунд новизны
+# весят как десятикратный рост вовлечённости
+POPULAR_DECAY = 12 * 60 * 60
+POPULAR_COMMENT_WEIGHT = 1.0
+POPULAR_FOLLOWER_WEIGHT = 0.1
+# за сколько секунд пересчитывать посты автора при смене числа подписчиков
+POPULAR_RECOMPUTE_WINDOW = 7 * 24 * 60 * 60
+# пересчёты рейтинга одного поста сливаются в окне (секунды)
+POPULAR_UPDATE_WINDOW = 60
+
+# Просмотры постов копятся в кеше и пишутся в БД раз в интервал (секунды)
+# периодической задачей posts.tasks.flush_pending_views; с кешем в памяти
+# процесса буфер отключён и просмотры пишутся в БД сразу
+VIEWS_FLUSH_INTERVAL = 60
+
+# Комментарии к посту выводятся страницами, первая страница кешируется
+COMMENTS_PER_PAGE = 20
+COMMENTS_CACHE_TIMEOUT = 5 * 60
+# глубина веток ответов, не больше 30 (255 символов Comment.path)
+COMMENTS_MAX_DEPTH = 10
+
+# Фоновая очередь задач (core.tasks), воркер: python manage.py runworker
+# TASKS_EAGER = True выполняет задачи сразу, без очереди
+TASKS_EAGER = False
+TASKS_WORKERS = 4
+TASKS_POLL_INTERVAL = 1
+TASKS_MAX_ATTEMPTS = 3
+# пауза перед повтором в секундах, удваивается с каждой попыткой
+TASKS_RETRY_DELAY = 10
+# через сколько секунд задачу упавшего воркера можно взять снова
+TASKS_VISIBILITY_TIMEOUT = 300
+# выполненные задачи хранятся столько секунд, потом их удаляет
+# core.tasks.purge_finished пачками по TASKS_PURGE_BATCH_SIZE строк
+TASKS_RETENTION = 7 * 24 * 60 * 60
+TASKS_PURGE_BATCH_SIZE = 1000
+# периодические задачи, которые ставит runworker: путь -> период в секундах
+TASKS_PERIODIC = {
+    'core.tasks.purge_finished': 60 * 60,
+    'posts.tasks.flush_pending_views': VIEWS_FLUSH_INTERVAL,
+    'core.sessions.clear_expired_sessions': SESSION_CLEANUP_INTERVAL,
+}
 
 # подключаем движок filebased.EmailBackend
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Уведомления копятся в окне (секунды) и уходят одним письмом-дайджестом
+NOTIFICATIONS_DIGEST_WINDOW = 15 * 60
+# сколько уведомлений создаётся и писем отправляется за один заход
+NOTIFICATIONS_BATCH_SIZE = 500
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.CachedAuthenticationMiddleware',
+    'core.middleware.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.TemplateProfilerMiddleware',
 ]
 
+# Ограничение частоты запросов (core.ratelimit) по имени маршрута:
+# 'user' - корзина на пользователя, 'ip' - на адрес клиента, 'methods' -
+# какие запросы считать (по умолчанию только POST)
+RATELIMIT_ENABLED = not DEBUG
+RATELIMITS = {
+    'posts:post_create': {'user': '10/h', 'ip': '30/h'},
+    'posts:add_comment': {'user': '10/m', 'ip': '30/m'},
+    'posts:profile_follow': {
+        'user': '30/m', 'ip': '60/m', 'methods': ('GET', 'POST'),
+    },
+    # один запрос меняет до FOLLOW_BULK_LIMIT подписок
+    'posts:follow_bulk': {'user': '5/m', 'ip': '10/m'},
+    'users:signup': {'ip': '5/h'},
+}
+# откуда брать адрес клиента; за прокси - например, 'HTTP_X_REAL_IP'
+RATELIMIT_IP_HEADER = 'REMOTE_ADDR'
+
+# Сжатие ответов (core.middleware.CompressionMiddleware): кодировки в
+# порядке предпочтения, br и zstd - если установлены brotli и zstandard
+COMPRESSION_ENCODINGS = ['br', 'zstd', 'gzip']
+COMPRESSION_LEVELS = {'br': 5, 'zstd': 3, 'gzip': 6}
+# ответы меньше порога (байты) не сжимаются
+COMPRESSION_MIN_SIZE = 500
+COMPRESSION_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+# сколько секунд хранить сжатые страницы для анонимов
+COMPRESSION_CACHE_TIMEOUT = 5 * 60
+
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+# Кеширующий загрузчик разбирает каждый шаблон один раз на процесс,
+# wsgi.py при старте компилирует все шаблоны заранее
+TEMPLATES_CACHED = not DEBUG
+if TEMPLATES_CACHED:
+    TEMPLATE_LOADERS = [
+        ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+    ]
+# Замер времени {% include %} и {% thumbnail %} в заголовке Server-Timing
+TEMPLATE_PROFILING = False
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.year.year',
+                'posts.context_processors.viewer',
             ],
         },
     },
 ]
 
+# Шаблоны лент из каталога jinja2/ на движке Jinja2, остальные страницы
+# по-прежнему рисует Django. Сравнить движки: manage.py benchmark_templates
+TEMPLATES_JINJA2 = False
+JINJA2_TEMPLATES = {
+    'BACKEND': 'django.template.backends.jinja2.Jinja2',
+    'DIRS': [os.path.join(BASE_DIR, 'jinja2')],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        'environment': 'core.jinja.environment',
+        'context_processors': [
+            'django.contrib.auth.context_processors.auth',
+            'core.context_processors.year.year',
+            'posts.context_processors.viewer',
+        ],
+    },
+}
+if TEMPLATES_JINJA2:
+    TEMPLATES.insert(0, JINJA2_TEMPLATES)
+
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
 
@@ -150,6 +340,62 @@ USE_TZ = True
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# collectstatic добавляет к именам хеш и сжимает текстовые файлы в .gz и
+# .br (core.static); без DEBUG {% static %} ссылается на хешированные имена
+STATIC_HASHED = not DEBUG
+if STATIC_HASHED:
+    STATICFILES_STORAGE = 'core.static.CompressedManifestStaticFilesStorage'
+STATIC_COMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.ico')
+# Отдавать STATIC_ROOT из Django, если перед ним нет nginx и т.п.
+STATIC_SERVE = not DEBUG
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Где хранить загрузки (core.storage): 'local' - MEDIA_ROOT, 's3' -
+# S3-совместимое хранилище (нужен boto3), 'memory' - заглушка S3 для тестов
+MEDIA_STORAGE = 'local'
+MEDIA_S3 = {
+    'BUCKET': os.environ.get('MEDIA_S3_BUCKET', ''),
+    'ENDPOINT_URL': os.environ.get('MEDIA_S3_ENDPOINT_URL'),
+    'REGION': os.environ.get('MEDIA_S3_REGION'),
+    'ACCESS_KEY': os.environ.get('MEDIA_S3_ACCESS_KEY'),
+    'SECRET_KEY': os.environ.get('MEDIA_S3_SECRET_KEY'),
+    # публичный адрес бакета со слешем на конце, по нему строятся ссылки
+    'PUBLIC_URL': os.environ.get('MEDIA_S3_PUBLIC_URL', ''),
+}
+DEFAULT_FILE_STORAGE = 'core.storage.MediaStorage'
+# Миниатюры sorl лежат в том же хранилище рядом с оригиналами
+THUMBNAIL_STORAGE = DEFAULT_FILE_STORAGE
+THUMBNAIL_BACKEND = 'core.storage.SiblingThumbnailBackend'
+
+# Локальные медиафайлы отдаёт core.media.serve: проверяет доступ и
+# передаёт файл прокси - 'x-accel-redirect' (nginx, location internal по
+# MEDIA_ACCEL_PREFIX с alias на MEDIA_ROOT) или 'x-sendfile' (Apache,
+# lighttpd). None - отдавать из Django через sendfile с поддержкой Range
+MEDIA_OFFLOAD = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# какие каталоги MEDIA_ROOT открыты всем
+MEDIA_PUBLIC_PREFIXES = ('posts/',)
+
+# Загрузка картинок (core.images): в формах постов не картинки и файлы
+# больше лимита (байты) отбрасываются ещё во время приёма
+IMAGE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+# оригинал ужимается до этой длинной стороны и пережимается без EXIF
+IMAGE_MAX_SIDE = 2048
+IMAGE_JPEG_QUALITY = 85
+# картинки больше стольких пикселей не декодируются
+IMAGE_MAX_PIXELS = 50_000_000
+# длинная сторона превью-заглушки, которое показывается до загрузки
+# картинки в ленте
+IMAGE_PLACEHOLDER_SIZE = 16
+# картинки одной загрузки (галерея) готовятся в стольких потоках
+IMAGE_UPLOAD_THREADS = 4
+# сколько картинок можно добавить в галерею поста за раз
+POST_GALLERY_MAX_IMAGES = 10
+# картинки без ссылок из постов gc_images удаляет через столько секунд
+IMAGE_GC_GRACE = 24 * 60 * 60
+# картинки, хеши которых (dHash, 64 бита) отличаются не больше чем на
+# столько бит, считаются похожими (posts.similar)
+IMAGE_SIMILAR_DISTANCE = 6